@@ -0,0 +1,222 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Tuple
+
+from records import dumps_line, loads
+
+# 生成结果的规范化：有的 provider（尤其 grok / llama 脚本用的是 "strictly follows the
+# user's JSON output schema" 的 system prompt）会把答案包成 JSON 字符串或者 ```json 代码块，
+# judge 会为这些括号、引号、转义重复付 token，分数也会被格式噪音带偏。
+# 这里把它们统一拆成纯文本答案，原文可选地写到旁边的 raw 文件里。
+
+# 单 key 包装时，这些 key 的值就是答案本身
+ANSWER_KEYS = ("answer", "response", "reply", "content", "text", "output", "message")
+
+_FENCE_RE = re.compile(r"```(?:json|JSON)?\s*\n(.*?)\n?```", re.DOTALL)
+
+
+class AnswerValidationError(ValueError):
+    """provider 返回的答案规范化后为空 / 不是字符串。"""
+
+
+@dataclass
+class NormalizedAnswer:
+    text: str
+    # plain: 原样；json_wrapped: {"answer": "..."} 一类单 key 包装；
+    # json_structured: 结构化 JSON 渲染成文本；fenced: 正文里嵌了 ```json 代码块
+    format: str
+    raw_sha1: str
+    raw_chars: int
+
+
+def _humanize_key(key: str) -> str:
+    key = re.sub(r"(?<=[a-z0-9])([A-Z])", r" \1", str(key))
+    key = key.replace("_", " ").strip()
+    return key[:1].upper() + key[1:]
+
+
+def _scalar(value: Any) -> str:
+    if isinstance(value, bool):
+        return "yes" if value else "no"
+    if value is None:
+        return "n/a"
+    return str(value).strip()
+
+
+def render_json(value: Any, indent: int = 0) -> List[str]:
+    """把任意 JSON 值渲染成缩进的 "Key: value" / "- item" 文本行。"""
+    pad = "  " * indent
+    lines: List[str] = []
+    if isinstance(value, dict):
+        for k, v in value.items():
+            label = _humanize_key(k)
+            if isinstance(v, (dict, list)) and v:
+                lines.append(f"{pad}{label}:")
+                lines.extend(render_json(v, indent + 1))
+            else:
+                value_text = "" if isinstance(v, (dict, list)) else _scalar(v)
+                lines.append(f"{pad}{label}: {value_text}".rstrip())
+    elif isinstance(value, list):
+        for item in value:
+            if isinstance(item, (dict, list)) and item:
+                sub = render_json(item, indent + 1)
+                sub[0] = f"{pad}- {sub[0].lstrip()}"
+                lines.extend(sub)
+            else:
+                lines.append(f"{pad}- {_scalar(item)}")
+    else:
+        lines.append(f"{pad}{_scalar(value)}")
+    return lines
+
+
+def _unwrap_json(obj: Any) -> Tuple[str, str]:
+    """返回 (text, format)。"""
+    if isinstance(obj, str):
+        return obj.strip(), "json_wrapped"
+    if isinstance(obj, dict) and len(obj) == 1:
+        (key, value), = obj.items()
+        if isinstance(value, str) and str(key).lower() in ANSWER_KEYS:
+            return value.strip(), "json_wrapped"
+    return "\n".join(render_json(obj)).strip(), "json_structured"
+
+
+def _try_json(s: str) -> Optional[Any]:
+    try:
+        return json.loads(s)
+    except (json.JSONDecodeError, TypeError):
+        return None
+
+
+def normalize_answer(raw: Any) -> NormalizedAnswer:
+    """
+    校验并拆包一个 provider 原始输出。空答案 / 非字符串会抛 AnswerValidationError。
+    """
+    if not isinstance(raw, str):
+        raise AnswerValidationError(f"Answer must be a string, got {type(raw).__name__}")
+    sha1 = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+    stripped = raw.strip()
+    if not stripped:
+        raise AnswerValidationError("Answer is empty")
+
+    text, fmt = stripped, "plain"
+
+    # 1) 整个答案就是一个 JSON（可能外面包了一层 ```json）
+    whole = _FENCE_RE.fullmatch(stripped)
+    candidate = whole.group(1) if whole else stripped
+    obj = _try_json(candidate) if candidate[:1] in "{[\"" else None
+    if obj is not None:
+        text, fmt = _unwrap_json(obj)
+    else:
+        # 2) 正文里夹着 ```json 代码块：只替换能 parse 的块
+        def replace(m: "re.Match") -> str:
+            block = _try_json(m.group(1))
+            if block is None:
+                return m.group(0)
+            return _unwrap_json(block)[0]
+
+        replaced = _FENCE_RE.sub(replace, stripped)
+        if replaced != stripped:
+            text, fmt = replaced.strip(), "fenced"
+
+    if not text:
+        raise AnswerValidationError("Answer is empty after unwrapping")
+    return NormalizedAnswer(text=text, format=fmt, raw_sha1=sha1, raw_chars=len(raw))
+
+
+class RawAnswerStore:
+    """原始输出的旁路存储：一行 {question_id, raw_sha1, raw}，按 sha1 可以和答案记录对上。"""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.f = open(path, "a", encoding="utf-8")
+
+    def write(self, question_id: Any, raw: str, raw_sha1: str) -> None:
+        self.f.write(dumps_line({"question_id": question_id, "raw_sha1": raw_sha1, "raw": raw}))
+        self.f.flush()
+
+    def close(self) -> None:
+        self.f.close()
+
+
+def normalize_record(
+    record: Dict[str, Any],
+    raw_store: Optional[RawAnswerStore] = None,
+) -> Dict[str, Any]:
+    """
+    原地规范化一条 model_answers 记录的 "answer"，在 meta 里记下格式和原文 sha1。
+    """
+    raw = record["answer"]
+    normalized = normalize_answer(raw)
+    record["answer"] = normalized.text
+    meta = record.setdefault("meta", {})
+    meta["answer_format"] = normalized.format
+    meta["raw_sha1"] = normalized.raw_sha1
+    if raw_store is not None:
+        raw_store.write(record.get("question_id"), raw, normalized.raw_sha1)
+    return record
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Normalize an existing model_answers .jsonl file (unwrap JSON-wrapped answers)."
+    )
+    parser.add_argument(
+        "--input_jsonl",
+        type=str,
+        default="./results/model_answers/out_grok.jsonl",
+        help="Path to input model answers .jsonl file.",
+    )
+    parser.add_argument(
+        "--output_jsonl",
+        type=str,
+        default="./results/model_answers/out_grok.normalized.jsonl",
+        help="Path to output .jsonl file with normalized answers.",
+    )
+    parser.add_argument(
+        "--raw_jsonl",
+        type=str,
+        default=None,
+        help="Optional side store for the raw provider output.",
+    )
+    args = parser.parse_args(argv)
+
+    raw_store = RawAnswerStore(args.raw_jsonl) if args.raw_jsonl else None
+    counts: Dict[str, int] = {}
+    raw_chars = 0
+    norm_chars = 0
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output_jsonl)), exist_ok=True)
+    with open(args.input_jsonl, "r", encoding="utf-8") as in_f, open(
+        args.output_jsonl, "w", encoding="utf-8"
+    ) as out_f:
+        for line in in_f:
+            line = line.strip()
+            if not line:
+                continue
+            rec = loads(line)
+            raw_chars += len(rec.get("answer") or "")
+            try:
+                normalize_record(rec, raw_store)
+            except AnswerValidationError as e:
+                print(f"[ERROR] question_id={rec.get('question_id')} invalid answer: {e}")
+                continue
+            norm_chars += len(rec["answer"])
+            fmt = rec["meta"]["answer_format"]
+            counts[fmt] = counts.get(fmt, 0) + 1
+            out_f.write(dumps_line(rec))
+
+    if raw_store is not None:
+        raw_store.close()
+    print(f"Answer formats: {counts}")
+    if raw_chars:
+        print(f"Answer size: {raw_chars} -> {norm_chars} chars ({norm_chars / raw_chars:.1%})")
+    print(f"Done. Saved normalized answers to {args.output_jsonl}")
+
+
+if __name__ == "__main__":
+    main()
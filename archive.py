@@ -0,0 +1,540 @@
+import argparse
+import glob
+import importlib
+import json
+import os
+import struct
+import sys
+from collections import OrderedDict
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from jsonl_index import metric_model_key, question_key, record_matches, record_model, select_entries
+from records import CODEC
+
+# 长期归档的结果文件：一个 .hzst 文件 = 一串 zstd frame，任何 zstd 工具都能整体解压（skippable frame 会被跳过）。
+#   [skippable: header] [skippable: 来源] [zstd frame] ... [skippable: 训练出来的字典] [skippable: 来源] [zstd frame] ...
+#   [skippable: frame 表 + 记录索引 + trailer]
+# 每个 zstd frame 是 --frame_records 条 JSONL 行，独立压缩，所以可以只解压一个 frame 就拿到一条记录；
+# 前面紧挨着一个小的来源 frame（这个 frame 里每行来自哪个文件），没有索引时也能按来源还原。
+# rubric / question / JSON 包装这些在所有模型、所有 metric 间重复的文本都进了字典，小 frame 也能压得很狠。
+# 写是流式的（pack 的内存不随文件大小涨）：header 一开始就写，每满一个 frame 就写出去并 flush，
+# 挂掉最多丢一个 frame。前 --train_records 条先不带字典压，攒够了训练字典、写进文件，之后的 frame 都用它；
+# 整个归档都没攒够的话，close 时用全部记录训练字典重写一遍（写临时文件再替换）。
+# 最后的索引 frame 没写（进程挂了）的话，读的时候顺着 frame 重新扫一遍索引。
+# 记录索引和 jsonl_index 一样按 (question_id, metric, model) 的 hash 排序，查询只解压命中的 frame。
+# 归档的是跑完的结果文件，run_pipeline 不会边跑边写归档。
+#
+#   python archive.py pack './results/**/*.jsonl' -o ./results/archive/history.hzst
+#   python archive.py get ./results/archive/history.hzst --question_id 3 --metric AVOID_VALUE_MANIPULATION
+#   python archive.py unpack ./results/archive/history.hzst --output_dir ./restored
+
+HEADER_MAGIC = b"HABZARC1"
+INDEX_MAGIC = b"HABZIDX1"
+DICT_MAGIC = b"HABZDIC1"
+SOURCE_MAGIC = b"HABZSRC1"
+FORMAT_VERSION = 2
+SKIPPABLE_MAGIC = 0x184D2A50
+SKIPPABLE = struct.Struct("<II")
+# 文件最后 16 字节：索引 skippable frame 的起始偏移 + INDEX_MAGIC
+TRAILER = struct.Struct("<Q8s")
+FRAME_DTYPE = np.dtype([("offset", "<u8"), ("csize", "<u4"), ("raw_size", "<u4"), ("n_records", "<u4")])
+ENTRY_DTYPE = np.dtype([("qkey", "<u8"), ("mkey", "<u8"), ("frame", "<u4"), ("line", "<u4"), ("source", "<u4")])
+
+DEFAULT_FRAME_RECORDS = 64
+DEFAULT_LEVEL = 19
+DEFAULT_DICT_SIZE = 112640
+DEFAULT_TRAIN_RECORDS = 4000
+# 读的时候缓存最近解压的几个 frame
+FRAME_CACHE_SIZE = 16
+
+
+def _zstd():
+    try:
+        return importlib.import_module("zstandard")
+    except ImportError:
+        raise RuntimeError("archive.py needs the 'zstandard' package: pip install zstandard") from None
+
+
+def _skippable(content: bytes) -> bytes:
+    return SKIPPABLE.pack(SKIPPABLE_MAGIC, len(content)) + content
+
+
+class ArchiveWriter:
+    """
+    流式写归档：write(record, source) 一条条追加，close() 写索引。
+    dictionary 给了就直接用（比如多个归档共用一个字典），否则用前 train_records 条训练。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        frame_records: int = DEFAULT_FRAME_RECORDS,
+        level: int = DEFAULT_LEVEL,
+        dict_size: int = DEFAULT_DICT_SIZE,
+        train_records: int = DEFAULT_TRAIN_RECORDS,
+        dictionary: Optional[bytes] = None,
+    ):
+        self.zstd = _zstd()
+        self.path = path
+        self.frame_records = max(1, frame_records)
+        self.level = level
+        self.dict_size = dict_size
+        self.train_records = train_records
+        self.dictionary = dictionary
+        self.f = None
+        self.cctx = None
+        self.pending: List[Tuple[bytes, int, int, int]] = []  # (line, qkey, mkey, source)
+        # 还没训练字典时留着的训练样本（和已经不带字典写出去的记录是同一批）
+        self.samples: Optional[List[Tuple[bytes, int, int, int]]] = None
+        self.sources: List[str] = []
+        self.source_ids: Dict[str, int] = {}
+        self.announced = 0
+        self.frames: List[Tuple[int, int, int, int]] = []
+        self.entries: List[Tuple[int, int, int, int, int]] = []
+        self.raw_bytes = 0
+        # 从第几个 frame 开始用字典压缩，字典写在文件的哪里（header 里带字典时是 0 / None）
+        self.dict_frame: Optional[int] = None
+        self.dict_offset: Optional[int] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, record: Dict[str, Any], source: str = "", line: Optional[bytes] = None) -> None:
+        """line 给了就原样存（pack 用，保证解包后逐字节一致），否则按 record 重新编码。"""
+        if line is None:
+            line = CODEC.dumps_bytes(record)
+        source_id = self.source_ids.get(source)
+        if source_id is None:
+            source_id = self.source_ids[source] = len(self.sources)
+            self.sources.append(source)
+        qkey = question_key(record.get("question_id"))
+        mkey = metric_model_key(record.get("metric") or "", record_model(source, record))
+        self._append((line + b"\n", qkey, mkey, source_id))
+
+    def _append(self, entry: Tuple[bytes, int, int, int]) -> None:
+        if self.f is None:
+            self._open()
+        self.pending.append(entry)
+        self.raw_bytes += len(entry[0])
+        if self.samples is not None:
+            self.samples.append(entry)
+            if len(self.samples) >= self.train_records:
+                self._start_dictionary(self._train([line for line, _, _, _ in self.samples]))
+        if len(self.pending) >= self.frame_records:
+            self._flush_frame(self.pending)
+            self.pending = []
+
+    def _train(self, samples: List[bytes]) -> Optional[bytes]:
+        # 样本总量太少时 zstd 训练会失败或者字典比省下来的还大，字典大小跟着样本量缩
+        size = min(self.dict_size, sum(len(s) for s in samples) // 20)
+        if size < 1024 or len(samples) < 8:
+            return None
+        try:
+            return self.zstd.train_dictionary(size, samples).as_bytes()
+        except self.zstd.ZstdError as e:
+            print(f"[WARN] Dictionary training failed ({e}); compressing without a dictionary.")
+            return None
+
+    def _open(self) -> None:
+        header_dict = self.dictionary or b""
+        meta = json.dumps(
+            {"version": FORMAT_VERSION, "frame_records": self.frame_records, "level": self.level}
+        ).encode("utf-8")
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.f = open(self.path, "wb")
+        self.f.write(_skippable(HEADER_MAGIC + struct.pack("<II", len(meta), len(header_dict)) + meta + header_dict))
+        self.f.flush()
+        if self.dictionary:
+            self.dict_frame = 0
+            self._set_compressor(self.dictionary)
+        else:
+            self._set_compressor(None)
+            # 外面给了空字典表示不要字典；None 才训练
+            self.samples = [] if self.dictionary is None else None
+
+    def _set_compressor(self, dictionary: Optional[bytes]) -> None:
+        dict_data = self.zstd.ZstdCompressionDict(dictionary) if dictionary else None
+        self.cctx = self.zstd.ZstdCompressor(level=self.level, dict_data=dict_data, write_content_size=True)
+
+    def _start_dictionary(self, dictionary: Optional[bytes]) -> None:
+        """训练完：字典写进文件，之后的 frame 用它压。"""
+        self.samples = None
+        self.dictionary = dictionary or b""
+        if not dictionary:
+            return
+        self.dict_offset = self.f.tell()
+        self.dict_frame = len(self.frames)
+        self.f.write(_skippable(DICT_MAGIC + dictionary))
+        self._set_compressor(dictionary)
+
+    def _flush_frame(self, chunk: List[Tuple[bytes, int, int, int]]) -> None:
+        raw = b"".join(line for line, _, _, _ in chunk)
+        data = self.cctx.compress(raw)
+        # 来源 frame：新出现的文件名 + 这个 frame 里每段连续行的来源
+        runs: List[List[int]] = []
+        for _, _, _, source in chunk:
+            if runs and runs[-1][0] == source:
+                runs[-1][1] += 1
+            else:
+                runs.append([source, 1])
+        src = {"first": self.announced, "names": self.sources[self.announced :], "runs": runs}
+        self.announced = len(self.sources)
+        self.f.write(_skippable(SOURCE_MAGIC + json.dumps(src, ensure_ascii=False).encode("utf-8")))
+        frame_no = len(self.frames)
+        self.frames.append((self.f.tell(), len(data), len(raw), len(chunk)))
+        self.entries.extend((qkey, mkey, frame_no, i, source) for i, (_, qkey, mkey, source) in enumerate(chunk))
+        self.f.write(data)
+        # 每个 frame 写完就落盘：挂掉最多丢一个 frame，读的时候能从 frame 序列恢复索引
+        self.f.flush()
+
+    def _rewrite_with_dictionary(self, dictionary: bytes) -> None:
+        """记录数没到 train_records：用全部记录训练出的字典重写整个归档，写完再替换。"""
+        tmp_path = self.path + ".tmp"
+        writer = ArchiveWriter(
+            tmp_path, frame_records=self.frame_records, level=self.level, dictionary=dictionary
+        )
+        writer.sources = list(self.sources)
+        writer.source_ids = dict(self.source_ids)
+        for entry in self.samples:
+            writer._append(entry)
+        writer.close()
+        self.f.close()
+        os.replace(tmp_path, self.path)
+        self.frames, self.entries = writer.frames, writer.entries
+        self.dictionary, self.dict_frame, self.samples = dictionary, 0, None
+
+    def close(self) -> None:
+        if self.f is None:
+            self._open()
+        if self.pending:
+            self._flush_frame(self.pending)
+            self.pending = []
+        if self.samples:
+            dictionary = self._train([line for line, _, _, _ in self.samples])
+            if dictionary:
+                self._rewrite_with_dictionary(dictionary)
+                return
+        frames = np.array(self.frames, dtype=FRAME_DTYPE)
+        entries = np.array(self.entries, dtype=ENTRY_DTYPE)
+        entries = entries[np.lexsort((entries["line"], entries["frame"], entries["mkey"], entries["qkey"]))]
+        meta = json.dumps(
+            {
+                "sources": self.sources,
+                "n_frames": len(frames),
+                "n_entries": len(entries),
+                "raw_bytes": self.raw_bytes,
+                "dict_frame": self.dict_frame,
+                "dict_offset": self.dict_offset,
+            },
+            ensure_ascii=False,
+        ).encode("utf-8")
+        start = self.f.tell()
+        content = INDEX_MAGIC + struct.pack("<I", len(meta)) + meta + frames.tobytes() + entries.tobytes()
+        self.f.write(_skippable(content + TRAILER.pack(start, INDEX_MAGIC)))
+        self.f.close()
+
+    @property
+    def n_records(self) -> int:
+        return len(self.entries) + len(self.pending)
+
+
+class ArchiveReader:
+    """随机读：get() 只解压命中的 frame；iter_records() 顺序解压全部。"""
+
+    def __init__(self, path: str):
+        self.zstd = _zstd()
+        self.path = path
+        self.f = open(path, "rb")
+        self.size = os.fstat(self.f.fileno()).st_size
+        self.plain_dctx = self.zstd.ZstdDecompressor()
+        self._read_header()
+        self.cache: "OrderedDict[int, List[bytes]]" = OrderedDict()
+        if not self._read_index():
+            print(f"[WARN] {path} has no index (writer did not finish); rebuilding it from the frames.")
+            self._recover_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        self.f.close()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _read_header(self) -> None:
+        magic, size = SKIPPABLE.unpack(self.f.read(SKIPPABLE.size))
+        content = self.f.read(size)
+        if magic != SKIPPABLE_MAGIC or not content.startswith(HEADER_MAGIC):
+            raise ValueError(f"{self.path} is not a result archive")
+        meta_len, dict_len = struct.unpack_from("<II", content, len(HEADER_MAGIC))
+        pos = len(HEADER_MAGIC) + 8
+        self.meta = json.loads(content[pos : pos + meta_len])
+        self._set_dictionary(content[pos + meta_len : pos + meta_len + dict_len])
+        self.dict_frame: Optional[int] = 0 if self.dictionary else None
+        self.data_start = SKIPPABLE.size + size
+
+    def _set_dictionary(self, dictionary: bytes) -> None:
+        self.dictionary = dictionary
+        dict_data = self.zstd.ZstdCompressionDict(dictionary) if dictionary else None
+        self.dict_dctx = self.zstd.ZstdDecompressor(dict_data=dict_data) if dict_data else None
+
+    def _dctx(self, frame_no: int):
+        # 训练字典之前写的 frame 没用字典
+        if self.dict_frame is not None and frame_no >= self.dict_frame:
+            return self.dict_dctx
+        return self.plain_dctx
+
+    def _read_skippable(self, offset: int) -> bytes:
+        self.f.seek(offset)
+        _, size = SKIPPABLE.unpack(self.f.read(SKIPPABLE.size))
+        return self.f.read(size)
+
+    def _read_index(self) -> bool:
+        if self.size < self.data_start + TRAILER.size:
+            return False
+        self.f.seek(self.size - TRAILER.size)
+        start, magic = TRAILER.unpack(self.f.read(TRAILER.size))
+        if magic != INDEX_MAGIC or start >= self.size:
+            return False
+        content = self._read_skippable(start)
+        (meta_len,) = struct.unpack_from("<I", content, len(INDEX_MAGIC))
+        pos = len(INDEX_MAGIC) + 4
+        meta = json.loads(content[pos : pos + meta_len])
+        pos += meta_len
+        self.sources = meta["sources"]
+        self.raw_bytes = meta["raw_bytes"]
+        self.frames = np.frombuffer(content, dtype=FRAME_DTYPE, count=meta["n_frames"], offset=pos)
+        pos += self.frames.nbytes
+        self.entries = np.frombuffer(content, dtype=ENTRY_DTYPE, count=meta["n_entries"], offset=pos)
+        self.n_sorted = len(self.entries)
+        if meta.get("dict_offset") is not None:
+            self._set_dictionary(self._read_skippable(meta["dict_offset"])[len(DICT_MAGIC) :])
+            self.dict_frame = meta["dict_frame"]
+        return True
+
+    def _recover_index(self) -> None:
+        """
+        没有索引时从 data_start 开始逐个 frame 解压，字典和来源从 skippable frame 里读回来。
+        旧版（version 1）归档没有来源 frame，来源统一记成空字符串。
+        """
+        frames: List[Tuple[int, int, int, int]] = []
+        entries: List[Tuple[int, int, int, int, int]] = []
+        sources: List[str] = []
+        runs: List[List[int]] = []
+        dctx = self.dict_dctx if self.dictionary else self.plain_dctx
+        self.f.seek(self.data_start)
+        data = memoryview(self.f.read())
+        pos = 0
+        while pos < len(data):
+            if len(data) - pos >= SKIPPABLE.size:
+                magic, size = SKIPPABLE.unpack_from(data, pos)
+                if magic == SKIPPABLE_MAGIC:
+                    content = bytes(data[pos + SKIPPABLE.size : pos + SKIPPABLE.size + size])
+                    if len(content) < size or content.startswith(INDEX_MAGIC):
+                        break
+                    if content.startswith(DICT_MAGIC):
+                        self._set_dictionary(content[len(DICT_MAGIC) :])
+                        self.dict_frame = len(frames)
+                        dctx = self.dict_dctx
+                    elif content.startswith(SOURCE_MAGIC):
+                        src = json.loads(content[len(SOURCE_MAGIC) :])
+                        sources[src["first"] :] = src["names"]
+                        runs = src["runs"]
+                    pos += SKIPPABLE.size + size
+                    continue
+            obj = dctx.decompressobj()
+            try:
+                raw = obj.decompress(data[pos:])
+            except self.zstd.ZstdError:
+                break  # 最后一个 frame 没写完
+            if not obj.eof:
+                break
+            csize = len(data) - pos - len(obj.unused_data)
+            lines = raw.split(b"\n")[:-1]
+            line_sources = [source for source, n in runs for _ in range(n)]
+            if len(line_sources) != len(lines):
+                line_sources = [0] * len(lines)
+            runs = []
+            frame_no = len(frames)
+            frames.append((self.data_start + pos, csize, len(raw), len(lines)))
+            for i, (line, source) in enumerate(zip(lines, line_sources)):
+                rec = CODEC.loads(line)
+                name = sources[source] if source < len(sources) else ""
+                entries.append(
+                    (
+                        question_key(rec.get("question_id")),
+                        metric_model_key(rec.get("metric") or "", record_model(name, rec)),
+                        frame_no,
+                        i,
+                        source,
+                    )
+                )
+            pos += csize
+        self.sources = sources or [""]
+        self.frames = np.array(frames, dtype=FRAME_DTYPE)
+        self.entries = np.array(entries, dtype=ENTRY_DTYPE)
+        self.n_sorted = 0
+        self.raw_bytes = int(self.frames["raw_size"].sum())
+
+    def _decompress_frame(self, frame_no: int) -> List[bytes]:
+        offset, csize = int(self.frames[frame_no]["offset"]), int(self.frames[frame_no]["csize"])
+        self.f.seek(offset)
+        return self._dctx(frame_no).decompress(self.f.read(csize)).split(b"\n")[:-1]
+
+    def frame_lines(self, frame_no: int) -> List[bytes]:
+        lines = self.cache.get(frame_no)
+        if lines is not None:
+            self.cache.move_to_end(frame_no)
+            return lines
+        lines = self._decompress_frame(frame_no)
+        self.cache[frame_no] = lines
+        if len(self.cache) > FRAME_CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return lines
+
+    def get(
+        self,
+        question_id: Any = None,
+        metric: Optional[str] = None,
+        model: Optional[str] = None,
+        source: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        entries = select_entries(self.entries, self.n_sorted, question_id, metric, model)
+        if source is not None:
+            entries = entries[entries["source"] == self.sources.index(source)] if source in self.sources else entries[:0]
+        entries = entries[np.lexsort((entries["line"], entries["frame"]))]
+        out: List[Dict[str, Any]] = []
+        for entry in entries:
+            src = self.sources[int(entry["source"])]
+            rec = CODEC.loads(self.frame_lines(int(entry["frame"]))[int(entry["line"])])
+            if record_matches(src, rec, question_id, metric, model):
+                out.append(rec)
+        return out
+
+    def iter_lines(self) -> Iterator[Tuple[str, bytes]]:
+        """按写入顺序返回 (source, 原始行)。"""
+        by_position = self.entries[np.lexsort((self.entries["line"], self.entries["frame"]))]
+        frame_no = -1
+        lines: List[bytes] = []
+        for entry in by_position:
+            if int(entry["frame"]) != frame_no:
+                frame_no = int(entry["frame"])
+                lines = self._decompress_frame(frame_no)
+            yield self.sources[int(entry["source"])], lines[int(entry["line"])]
+
+    def iter_records(self, source: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        for src, line in self.iter_lines():
+            if source is None or src == source:
+                yield CODEC.loads(line)
+
+
+def _restore_path(output_dir: str, source: str) -> str:
+    rel = os.path.normpath(source).lstrip(os.sep)
+    while rel.startswith(".." + os.sep):
+        rel = rel[3:]
+    return os.path.join(output_dir, rel or "records.jsonl")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Compressed, seekable zstd archives of JSONL result files.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_pack = sub.add_parser("pack", help="Stream JSONL files into one archive.")
+    p_pack.add_argument("patterns", nargs="+", help="JSONL files or glob patterns (** is recursive).")
+    p_pack.add_argument("-o", "--output", type=str, required=True, help="Archive path (.hzst).")
+    p_pack.add_argument("--frame_records", type=int, default=DEFAULT_FRAME_RECORDS, help="Records per zstd frame.")
+    p_pack.add_argument("--level", type=int, default=DEFAULT_LEVEL, help="zstd compression level.")
+    p_pack.add_argument("--dict_size", type=int, default=DEFAULT_DICT_SIZE, help="Max trained dictionary size (bytes).")
+    p_pack.add_argument("--train_records", type=int, default=DEFAULT_TRAIN_RECORDS, help="Records used to train it.")
+    p_pack.add_argument("--dictionary", type=str, default=None, help="Reuse the dictionary of this archive.")
+
+    p_unpack = sub.add_parser("unpack", help="Restore the original JSONL files.")
+    p_unpack.add_argument("archive", type=str)
+    p_unpack.add_argument("--output_dir", type=str, required=True)
+
+    p_get = sub.add_parser("get", help="Look up records by question_id / metric / model.")
+    p_get.add_argument("archive", type=str)
+    p_get.add_argument("--question_id", type=str, default=None)
+    p_get.add_argument("--metric", type=str, default=None)
+    p_get.add_argument("--model", type=str, default=None, help="Model label (see jsonl_index.record_model).")
+    p_get.add_argument("--source", type=str, default=None, help="Only records packed from this file.")
+
+    p_info = sub.add_parser("info", help="Show sources, sizes and compression ratio.")
+    p_info.add_argument("archive", type=str)
+    args = parser.parse_args(argv)
+
+    if args.command == "pack":
+        paths = sorted({p for pattern in args.patterns for p in glob.glob(pattern, recursive=True) if p.endswith(".jsonl")})
+        if not paths:
+            print(f"[ERROR] No .jsonl files matched {args.patterns}")
+            sys.exit(1)
+        dictionary = None
+        if args.dictionary:
+            with ArchiveReader(args.dictionary) as reader:
+                dictionary = reader.dictionary
+        with ArchiveWriter(
+            args.output,
+            frame_records=args.frame_records,
+            level=args.level,
+            dict_size=args.dict_size,
+            train_records=args.train_records,
+            dictionary=dictionary,
+        ) as writer:
+            for path in paths:
+                with open(path, "rb") as f:
+                    for line_no, line in enumerate(f, start=1):
+                        line = line.strip()
+                        if not line:
+                            continue
+                        try:
+                            rec = CODEC.loads(line)
+                        except json.JSONDecodeError as e:
+                            print(f"[WARN] Skipping invalid line {line_no} in {path}: {e}")
+                            continue
+                        writer.write(rec, source=path, line=line)
+        size = os.path.getsize(args.output)
+        print(
+            f"Packed {writer.n_records} records from {len(paths)} files: "
+            f"{writer.raw_bytes / 1e6:.2f} MB -> {size / 1e6:.2f} MB ({writer.raw_bytes / max(size, 1):.1f}x)"
+        )
+        print(f"Done. Saved archive to {args.output}")
+        return
+
+    with ArchiveReader(args.archive) as reader:
+        if args.command == "info":
+            size = os.path.getsize(args.archive)
+            print(f"records={len(reader)} frames={len(reader.frames)} dictionary={len(reader.dictionary)} bytes")
+            print(f"raw={reader.raw_bytes / 1e6:.2f} MB archive={size / 1e6:.2f} MB ratio={reader.raw_bytes / max(size, 1):.1f}x")
+            counts = np.bincount(reader.entries["source"], minlength=len(reader.sources))
+            for source, n in zip(reader.sources, counts):
+                print(f"  {int(n):>8}  {source}")
+        elif args.command == "get":
+            for rec in reader.get(args.question_id, args.metric, args.model, args.source):
+                print(CODEC.dumps(rec))
+        else:
+            files: Dict[str, Any] = {}
+            try:
+                for source, line in reader.iter_lines():
+                    f = files.get(source)
+                    if f is None:
+                        out_path = _restore_path(args.output_dir, source)
+                        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+                        f = files[source] = open(out_path, "wb")
+                    f.write(line + b"\n")
+            finally:
+                for f in files.values():
+                    f.close()
+            print(f"Done. Restored {len(files)} files under {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
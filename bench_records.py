@@ -0,0 +1,74 @@
+import argparse
+import glob
+import json
+import time
+from typing import Dict, Any, List, Optional
+
+from records import EvaluationRecord, available_codecs, get_codec
+
+# records.py 的 micro-benchmark：用 results/evaluations 里的真实记录放大到 --n 条，
+# 看 json 写的吞吐、各个 JSON codec 读的吞吐，以及 typed record 校验的额外开销。
+#
+#   python bench_records.py --n 50000
+
+
+def load_seed_records(pattern: str) -> List[Dict[str, Any]]:
+    seeds: List[Dict[str, Any]] = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, "r", encoding="utf-8") as f:
+            seeds.extend(json.loads(line) for line in f if line.strip())
+    if not seeds:
+        raise RuntimeError(f"No seed records matched {pattern}")
+    return seeds
+
+
+def timed(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark JSONL record encode/decode throughput.")
+    parser.add_argument(
+        "--seed_glob",
+        type=str,
+        default="./results/evaluations/out_*.jsonl",
+        help="Files whose records are replicated to build the benchmark set.",
+    )
+    parser.add_argument("--n", type=int, default=20000, help="Number of records.")
+    parser.add_argument("--repeat", type=int, default=3, help="Best-of repeats per measurement.")
+    args = parser.parse_args(argv)
+
+    seeds = load_seed_records(args.seed_glob)
+    records = []
+    for i in range(args.n):
+        rec = dict(seeds[i % len(seeds)])
+        rec["question_id"] = i
+        records.append(rec)
+    total_mb = sum(len(json.dumps(r, ensure_ascii=False).encode("utf-8")) for r in records) / 1e6
+    print(f"{args.n} records, {total_mb:.1f} MB of JSONL")
+    # 写只有一种格式（json），读按 codec 比
+    encoded = [json.dumps(r, ensure_ascii=False).encode("utf-8") for r in records]
+    json_codec = get_codec("json")
+    enc = timed(lambda: [json_codec.dumps_bytes(r) for r in records], args.repeat)
+    print(f"encode (json): {args.n / enc:,.0f} rec/s, {total_mb / enc:.1f} MB/s")
+    print(f"{'codec':<10} {'decode rec/s':>14} {'decode MB/s':>12}")
+
+    for name in available_codecs():
+        codec = get_codec(name)
+        dec = timed(lambda: [codec.loads(line) for line in encoded], args.repeat)
+        print(f"{name:<10} {args.n / dec:>14,.0f} {total_mb / dec:>12.1f}")
+
+    codec = get_codec()
+    dec_typed = timed(
+        lambda: [EvaluationRecord.from_dict(codec.loads(line)) for line in encoded], args.repeat
+    )
+    print(f"{codec.name + '+typed':<10} {args.n / dec_typed:>14,.0f} {total_mb / dec_typed:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+# CLI 启动时间 benchmark：每个子命令跑 `python hab.py <command> --help` 若干次（新进程，
+# 包括解释器启动 + import + argparse），和空解释器 `python -c pass` 对比。
+# --max_seconds 给了就当门槛用：有命令的最快一次超过它就 exit 1。--importtime 列出最慢的 import。
+#
+#   python bench_startup.py --repeat 5 --max_seconds 1.0
+
+HAB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hab.py")
+
+
+def command_argv(command: str) -> List[str]:
+    if command == "answers":
+        return [HAB, "answers", "gpt", "--help"]
+    return [HAB, command, "--help"]
+
+
+def time_process(argv: List[str], repeat: int) -> List[float]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable] + argv, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        times.append(time.perf_counter() - start)
+        if proc.returncode != 0:
+            raise RuntimeError(f"{' '.join(argv)} exited with {proc.returncode}: {proc.stderr.decode()[-500:]}")
+    return times
+
+
+def import_times(argv: List[str]) -> Dict[str, int]:
+    """-X importtime 的累计时间（us），只看顶层包。"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime"] + argv, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    rows: Dict[str, int] = {}
+    for line in proc.stderr.decode("utf-8", "replace").splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        try:
+            cumulative = int(parts[1])
+        except ValueError:
+            continue
+        name = parts[2].strip()
+        if "." not in name:
+            rows[name] = max(rows.get(name, 0), cumulative)
+    return rows
+
+
+def slowest_imports(argv: List[str], top: int, baseline: Dict[str, int]) -> List[Tuple[int, str]]:
+    # 空解释器本来就会 import 的（site 等）不算
+    rows = import_times(argv)
+    return sorted(((us, name) for name, us in rows.items() if name not in baseline), reverse=True)[:top]
+
+
+def main(argv: Optional[List[str]] = None):
+    from hab import COMMANDS
+
+    parser = argparse.ArgumentParser(description="Benchmark startup time of the hab.py subcommands.")
+    parser.add_argument(
+        "--commands",
+        type=str,
+        default=",".join(c for c in COMMANDS if c != "bench-startup"),
+        help="Comma-separated subcommands to time.",
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh processes per command.")
+    parser.add_argument("--max_seconds", type=float, default=None, help="Fail if a command's best time exceeds this.")
+    parser.add_argument("--importtime", type=int, default=0, help="Also list the N slowest top-level imports.")
+    args = parser.parse_args(argv)
+
+    baseline = min(time_process(["-c", "pass"], args.repeat))
+    baseline_imports = import_times(["-c", "pass"]) if args.importtime else {}
+    print(f"{'command':<16} {'best s':>8} {'median s':>9} {'over python':>12}")
+    print(f"{'(python -c pass)':<16} {baseline:>8.3f}")
+    results: List[Dict[str, Any]] = []
+    for command in [c.strip() for c in args.commands.split(",") if c.strip()]:
+        times = time_process(command_argv(command), args.repeat)
+        best, median = min(times), statistics.median(times)
+        results.append({"command": command, "best": best, "median": median})
+        print(f"{command:<16} {best:>8.3f} {median:>9.3f} {best - baseline:>12.3f}")
+        for us, name in slowest_imports(command_argv(command), args.importtime, baseline_imports):
+            print(f"    {name:<30} {us / 1000:>8.1f} ms")
+
+    if args.max_seconds is not None:
+        slow = [r["command"] for r in results if r["best"] > args.max_seconds]
+        if slow:
+            print(f"[ERROR] Startup over {args.max_seconds}s: {', '.join(slow)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+import contextvars
+import json
+import math
+import os
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+
+from deadletter import note_attempt
+from evaluate_answers import build_eval_prompt, evaluate_single_answer
+from progress import get_tracker, usage_tokens
+from prompts import EVAL_SYSTEM_PROMPT
+from providers import ChatAdapter, OpenAIChat, get_chat_adapter, parse_judge_spec
+
+# 两级 cascade judge：便宜的 screen judge 先给所有答案打分，
+# 只有 (1) 置信度低、(2) 落在中间分段、(3) 多个 screen judge 意见不一 的答案
+# 才升级给 strong judge（evaluate_answers.py 里的 --model）。screen / strong 都可以是任意 provider 的 judge spec，
+# 置信度只有 OpenAI 兼容 endpoint（logprobs）才有。
+# 阈值用 results/samples/out.jsonl 里带目标分数的样本来校准。
+
+DEFAULT_CASCADE_CONFIG: Dict[str, Any] = {
+    "min_confidence": 0.8,
+    "escalate_scores": [3],
+    "escalate_on_disagreement": True,
+}
+
+
+def score_confidence_from_logprobs(logprobs) -> Tuple[Optional[int], Optional[float]]:
+    """
+    从 chat completion 的 logprobs 里找 "score": 后面的那个数字 token，
+    返回 (score, 该数字在 1-5 这几个候选里的归一化概率)。
+    """
+    if logprobs is None or not getattr(logprobs, "content", None):
+        return None, None
+    seen = ""
+    for tok in logprobs.content:
+        seen += tok.token
+        if '"score"' not in seen:
+            continue
+        digit = tok.token.strip()
+        if digit not in {"1", "2", "3", "4", "5"}:
+            continue
+        probs: Dict[str, float] = {}
+        for alt in tok.top_logprobs or []:
+            alt_digit = alt.token.strip()
+            if alt_digit in {"1", "2", "3", "4", "5"}:
+                probs[alt_digit] = probs.get(alt_digit, 0.0) + math.exp(alt.logprob)
+        probs.setdefault(digit, math.exp(tok.logprob))
+        return int(digit), probs[digit] / sum(probs.values())
+    return None, None
+
+
+def screen_single_answer(
+    chat: ChatAdapter,
+    model: str,
+    record: Dict[str, Any],
+    metric_name: str,
+    rubric: str,
+    temperature: float = 0.0,
+    max_retries: int = 3,
+) -> Dict[str, Any]:
+    """
+    screen judge 打分，多要一份 logprobs 用来估置信度。
+    返回 evaluate_single_answer 一样的 JSON dict，外加 "confidence"。
+    只有 OpenAI 兼容 endpoint 给 logprobs；其他 provider（claude / gemini / local）照常打分，confidence 为 None，
+    这时只靠分段和 screen judge 之间的分歧决定是否升级。
+    """
+    if not isinstance(chat, OpenAIChat):
+        data = evaluate_single_answer(
+            client=chat,
+            model=model,
+            record=record,
+            metric_name=metric_name,
+            rubric=rubric,
+            temperature=temperature,
+            max_retries=max_retries,
+        )
+        data["confidence"] = None
+        return data
+
+    prompt = build_eval_prompt(metric_name, rubric, record["question"], record["answer"])
+    api_model = parse_judge_spec(model)[1]
+    for attempt in range(max_retries):
+        try:
+            response = chat.client.chat.completions.create(
+                model=api_model,
+                temperature=temperature,
+                logprobs=True,
+                top_logprobs=5,
+                messages=[
+                    {"role": "system", "content": EVAL_SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt},
+                ],
+            )
+            get_tracker().tokens("evaluate", model, usage_tokens(response))
+            choice = response.choices[0]
+            data = json.loads(choice.message.content)
+            _, data["confidence"] = score_confidence_from_logprobs(choice.logprobs)
+            return data
+        except Exception as e:
+            get_tracker().retry("evaluate", model)
+            note_attempt(e)
+            print(
+                f"[WARN] Screen eval error on attempt {attempt + 1} for question_id={record.get('question_id')}: {e}"
+            )
+            time.sleep(1.5)
+
+    raise RuntimeError(
+        f"Failed to get valid JSON screen evaluation for question_id={record.get('question_id')}"
+    )
+
+
+def build_adapters(models: List[str], **client_opts) -> Dict[str, ChatAdapter]:
+    """screen / strong judge spec -> ChatAdapter；每个 provider 走自己的 endpoint。"""
+    return {m: get_chat_adapter(m, **client_opts) for m in dict.fromkeys(models)}
+
+
+def escalation_reason(
+    screens: List[Dict[str, Any]], config: Dict[str, Any]
+) -> Optional[str]:
+    """根据 screen 结果判断要不要升级；不需要时返回 None。"""
+    scores = [s.get("score") for s in screens]
+    if any(not isinstance(s, int) for s in scores):
+        return "invalid_score"
+    if config.get("escalate_on_disagreement", True) and len(set(scores)) > 1:
+        return "disagreement"
+    confidences = [s.get("confidence") for s in screens if s.get("confidence") is not None]
+    if confidences and min(confidences) < config.get("min_confidence", 0.0):
+        return "low_confidence"
+    if scores[0] in set(config.get("escalate_scores", [])):
+        return "mid_scale"
+    return None
+
+
+def screen_all(
+    adapters: Dict[str, ChatAdapter],
+    record: Dict[str, Any],
+    metric_name: str,
+    rubric: str,
+    screen_models: List[str],
+    temperature: float = 0.0,
+    pool: Optional[Executor] = None,
+) -> List[Dict[str, Any]]:
+    """所有 screen judge 给同一条答案打分；给了 pool 就并发跑，结果按 screen_models 的顺序返回。"""
+    if pool is None or len(screen_models) < 2:
+        return [
+            screen_single_answer(adapters[m], m, record, metric_name, rubric, temperature)
+            for m in screen_models
+        ]
+    # copy_context 让 note_attempt / 限流槽位这些 contextvar 跟着进内层线程池
+    futures = [
+        pool.submit(
+            contextvars.copy_context().run,
+            screen_single_answer,
+            adapters[m],
+            m,
+            record,
+            metric_name,
+            rubric,
+            temperature,
+        )
+        for m in screen_models
+    ]
+    return [fut.result() for fut in futures]
+
+
+def screen_tier_label(screen_models: List[str]) -> str:
+    """
+    screen 级给分时写进 eval_meta.model 的 judge 名：分数来自所有 screen judge 一致通过，
+    不能记成其中某一个模型。同一组 screen judge 的标签固定，regression 按它分组。
+    """
+    return "screen:" + "+".join(screen_models)
+
+
+def cascade_evaluate(
+    adapters: Dict[str, ChatAdapter],
+    record: Dict[str, Any],
+    metric_name: str,
+    rubric: str,
+    screen_models: List[str],
+    strong_model: str,
+    config: Dict[str, Any],
+    temperature: float = 0.0,
+    pool: Optional[Executor] = None,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    返回 (eval_data, cascade_meta)。eval_data 来自最终采用的那一级 judge，
+    cascade_meta 记录 tier、升级原因和 screen 分数。pool 用来并发跑多个 screen judge。
+    """
+    screens = screen_all(adapters, record, metric_name, rubric, screen_models, temperature, pool)
+    reason = escalation_reason(screens, config)
+    meta: Dict[str, Any] = {
+        "tier": "screen",
+        "screen_models": screen_models,
+        "screen_scores": [s.get("score") for s in screens],
+        "screen_confidences": [s.get("confidence") for s in screens],
+        "escalation_reason": reason,
+    }
+    if reason is None:
+        return screens[0], meta
+
+    meta["tier"] = "strong"
+    eval_data = evaluate_single_answer(
+        client=adapters[strong_model],
+        model=strong_model,
+        record=record,
+        metric_name=metric_name,
+        rubric=rubric,
+        temperature=temperature,
+    )
+    return eval_data, meta
+
+
+def load_cascade_config(path: str) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        print(f"[WARN] No cascade config at {path}, using defaults {DEFAULT_CASCADE_CONFIG}")
+        return dict(DEFAULT_CASCADE_CONFIG)
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def calibrate_cascade(
+    adapters: Dict[str, ChatAdapter],
+    samples_path: str,
+    screen_models: List[str],
+    target_accuracy: float = 0.9,
+    tolerance: int = 0,
+    temperature: float = 0.0,
+    workers: int = 1,
+) -> Dict[str, Any]:
+    """
+    用 samples 里 "answers": {"1": ..., "5": ...} 的目标分数当标签，
+    先让 screen judge 把所有样本答案打一遍，再搜索阈值组合：
+    在 "不升级的那部分" 准确率 >= target_accuracy 的前提下，升级比例最小。
+    准确率定义为 |screen score - 目标分数| <= tolerance。workers 条样本答案同时打分，每条的 screen judge 也并发。
+    """
+    items: List[Tuple[int, Dict[str, Any], Dict[str, Any]]] = []
+    with open(samples_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            sample = json.loads(line)
+            for level, answer in sample["answers"].items():
+                rec = {
+                    "question_id": sample.get("question_id"),
+                    "question": sample["question"],
+                    "answer": answer,
+                }
+                items.append((int(level), rec, sample))
+
+    # 所有 (样本答案, screen judge) 一起提交，items 之间、同一条的多个 screen judge 之间都并发
+    labeled: List[Tuple[int, List[Dict[str, Any]]]] = []
+    with ThreadPoolExecutor(max_workers=max(workers, 1) * max(len(screen_models), 1)) as pool:
+        futures = [
+            (
+                level,
+                rec,
+                [
+                    pool.submit(
+                        contextvars.copy_context().run,
+                        screen_single_answer,
+                        adapters[m],
+                        m,
+                        rec,
+                        sample["metric"],
+                        sample["rubric"],
+                        temperature,
+                    )
+                    for m in screen_models
+                ],
+            )
+            for level, rec, sample in items
+        ]
+        for level, rec, screen_futures in futures:
+            try:
+                screens = [fut.result() for fut in screen_futures]
+            except Exception as e:
+                print(f"[ERROR] Calibration item failed for question_id={rec['question_id']} level={level}: {e}")
+                continue
+            labeled.append((level, screens))
+    print(f"Screened {len(labeled)} labeled sample answers from {samples_path}")
+    if not labeled:
+        raise RuntimeError(f"No labeled samples could be screened from {samples_path}")
+
+    confidences = sorted(
+        {
+            s["confidence"]
+            for _, screens in labeled
+            for s in screens
+            if s.get("confidence") is not None
+        }
+    )
+    candidate_thresholds = [0.0] + confidences
+    candidate_bands: List[List[int]] = [[], [3], [2, 3, 4], [1, 2, 3, 4, 5]]
+
+    best: Optional[Dict[str, Any]] = None
+    for band in candidate_bands:
+        for thr in candidate_thresholds:
+            config = {
+                "min_confidence": thr,
+                "escalate_scores": band,
+                "escalate_on_disagreement": True,
+            }
+            kept = [
+                (label, screens)
+                for label, screens in labeled
+                if escalation_reason(screens, config) is None
+            ]
+            escalation_rate = 1.0 - len(kept) / len(labeled)
+            if kept:
+                correct = sum(
+                    1 for label, screens in kept if abs(screens[0]["score"] - label) <= tolerance
+                )
+                accuracy = correct / len(kept)
+            else:
+                accuracy = 1.0
+            if accuracy < target_accuracy:
+                continue
+            if best is None or escalation_rate < best["escalation_rate"]:
+                best = dict(config, escalation_rate=escalation_rate, kept_accuracy=accuracy)
+
+    # band 里有 [1..5] 且阈值为 0 时全部升级，准确率按定义恒为 1，所以 best 一定存在
+    best["n_calibration_items"] = len(labeled)
+    best["target_accuracy"] = target_accuracy
+    best["tolerance"] = tolerance
+    best["screen_models"] = screen_models
+    return best
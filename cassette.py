@@ -0,0 +1,332 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Any, List, Optional, Tuple
+
+from records import CODEC, dumps
+
+# provider 流量的 record / replay（"cassette"）。
+#   record: 正常走网络，把每次 (request, response) 连同耗时写进 cassette
+#   replay: 完全离线，按 request 内容找录好的 response 返回，可选按录制耗时 sleep
+#   auto:   能 replay 就 replay，找不到再走网络并录下来
+# cassette 是一个 SQLite 文件，(key, seq) 做主键索引，request / headers / body 用 zlib 压缩。
+# 同一个 request 录了多次（比如 temperature > 0 重复采样），replay 时按次序轮流返回。
+#
+# 开启方式：环境变量 HAB_CASSETTE=<path> HAB_CASSETTE_MODE=record|replay|auto
+# （可选 HAB_CASSETTE_LATENCY=<倍数>，0 = 不模拟延迟），或者在建 client 之前调用 use_cassette()。
+# OpenAI / Anthropic / OpenRouter 在 clients.py 的 transport 层拦截，Gemini 在 generate_content 层拦截。
+
+MODES = ("record", "replay", "auto")
+
+# 进 request key 的 header（其余的鉴权、SDK 版本、重试计数等每次都可能变，不参与匹配）
+_KEY_HEADERS = ("anthropic-version", "anthropic-beta", "openai-organization")
+# 录 response 时不保存的 header
+_DROPPED_RESPONSE_HEADERS = {"set-cookie", "date"}
+
+
+class CassetteMiss(LookupError):
+    """replay 模式下 cassette 里没有这个 request。"""
+
+
+def _pack(obj: Any) -> bytes:
+    return zlib.compress(CODEC.dumps_bytes(obj), 6)
+
+
+def _unpack(blob: bytes) -> Any:
+    return CODEC.loads(zlib.decompress(blob))
+
+
+def request_key(payload: Dict[str, Any]) -> str:
+    """payload 里的 dict 按 key 排序后取 sha256，字段顺序不影响匹配。"""
+
+    def canon(v):
+        if isinstance(v, dict):
+            return {k: canon(v[k]) for k in sorted(v)}
+        if isinstance(v, (list, tuple)):
+            return [canon(x) for x in v]
+        return v
+
+    return hashlib.sha256(dumps(canon(payload)).encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    def __init__(self, path: str, mode: str = "replay", latency_scale: float = 0.0):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cassette mode '{mode}'. Use one of {MODES}.")
+        if mode == "replay" and not os.path.exists(path):
+            raise FileNotFoundError(f"Cassette not found: {path}")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS interactions (
+                key TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                provider TEXT NOT NULL,
+                request BLOB NOT NULL,
+                status INTEGER NOT NULL,
+                headers BLOB NOT NULL,
+                body BLOB NOT NULL,
+                latency REAL NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (key, seq)
+            )
+            """
+        )
+        self.conn.commit()
+        # replay 时每个 key 已经返回过几次
+        self._served: Dict[str, int] = {}
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "recorded": 0}
+
+    def lookup(self, key: str) -> Optional[Tuple[int, List[List[str]], bytes, float]]:
+        """返回 (status, headers, body, latency)；没录过返回 None。"""
+        with self.lock:
+            n = self.conn.execute("SELECT COUNT(*) FROM interactions WHERE key = ?", (key,)).fetchone()[0]
+            if n == 0:
+                self.stats["misses"] += 1
+                return None
+            seq = self._served.get(key, 0)
+            self._served[key] = seq + 1
+            row = self.conn.execute(
+                "SELECT status, headers, body, latency FROM interactions WHERE key = ? ORDER BY seq LIMIT 1 OFFSET ?",
+                (key, seq % n),
+            ).fetchone()
+            self.stats["hits"] += 1
+        status, headers, body, latency = row
+        return status, _unpack(headers), zlib.decompress(body), latency
+
+    def record(
+        self,
+        key: str,
+        provider: str,
+        request: Dict[str, Any],
+        status: int,
+        headers: List[List[str]],
+        body: bytes,
+        latency: float,
+    ) -> None:
+        with self.lock:
+            with self.conn:
+                seq = self.conn.execute(
+                    "SELECT COALESCE(MAX(seq) + 1, 0) FROM interactions WHERE key = ?", (key,)
+                ).fetchone()[0]
+                self.conn.execute(
+                    "INSERT INTO interactions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, seq, provider, _pack(request), status, _pack(headers), zlib.compress(body, 6), latency, time.time()),
+                )
+            self.stats["recorded"] += 1
+
+    def delay(self, latency: float) -> float:
+        return latency * self.latency_scale if self.latency_scale > 0 else 0.0
+
+    def miss(self, key: str, request: Dict[str, Any]) -> CassetteMiss:
+        return CassetteMiss(
+            f"No recorded response in {self.path} for {request.get('method', '')} {request.get('url', request.get('model', ''))} (key={key[:12]})"
+        )
+
+    def summary(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT provider, COUNT(*), COUNT(DISTINCT key), SUM(LENGTH(body)), AVG(latency) "
+                "FROM interactions GROUP BY provider ORDER BY provider"
+            ).fetchall()
+        return [
+            {"provider": p, "interactions": n, "unique_requests": u, "body_bytes": b or 0, "mean_latency": lat or 0.0}
+            for p, n, u, b, lat in rows
+        ]
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+_CASSETTE: Optional[Cassette] = None
+_CASSETTE_LOADED = False
+_CASSETTE_LOCK = threading.Lock()
+
+
+def use_cassette(path: Optional[str], mode: str = "replay", latency_scale: float = 0.0) -> Optional[Cassette]:
+    """进程级开启 / 关闭（path=None）cassette。要在第一次 get_client 之前调用。"""
+    global _CASSETTE, _CASSETTE_LOADED
+    with _CASSETTE_LOCK:
+        _CASSETTE = Cassette(path, mode, latency_scale) if path else None
+        _CASSETTE_LOADED = True
+        return _CASSETTE
+
+
+def get_cassette() -> Optional[Cassette]:
+    """没显式 use_cassette 过就看环境变量。"""
+    global _CASSETTE, _CASSETTE_LOADED
+    if _CASSETTE_LOADED:
+        return _CASSETTE
+    with _CASSETTE_LOCK:
+        if not _CASSETTE_LOADED:
+            path = os.environ.get("HAB_CASSETTE")
+            if path:
+                _CASSETTE = Cassette(
+                    path,
+                    os.environ.get("HAB_CASSETTE_MODE", "replay"),
+                    float(os.environ.get("HAB_CASSETTE_LATENCY", "0")),
+                )
+                print(f"Using cassette {path} (mode={_CASSETTE.mode})")
+            _CASSETTE_LOADED = True
+    return _CASSETTE
+
+
+# ------------------------------
+# httpx transport（OpenAI / Anthropic SDK）
+# ------------------------------
+
+
+def _http_request_payload(request) -> Dict[str, Any]:
+    body = request.read()
+    try:
+        parsed: Any = CODEC.loads(body) if body else None
+    except ValueError:
+        parsed = {"sha256": hashlib.sha256(body).hexdigest()}
+    headers = {
+        k.lower(): v
+        for k, v in request.headers.items()
+        if k.lower() in _KEY_HEADERS
+    }
+    return {"method": request.method, "url": str(request.url), "headers": headers, "body": parsed}
+
+
+def _response_headers(response) -> List[List[str]]:
+    return [[k, v] for k, v in response.headers.items() if k.lower() not in _DROPPED_RESPONSE_HEADERS]
+
+
+def cassette_transport(http, inner, cassette: Cassette, provider: str, is_async: bool):
+    """包在真实 transport 外面；replay 命中时不会碰 inner。"""
+    if is_async:
+        import asyncio
+
+        class CassetteAsyncTransport(http.AsyncBaseTransport):
+            async def handle_async_request(self, request):
+                payload = _http_request_payload(request)
+                key = request_key(payload)
+                if cassette.mode != "record":
+                    hit = cassette.lookup(key)
+                    if hit is not None:
+                        status, headers, body, latency = hit
+                        wait = cassette.delay(latency)
+                        if wait:
+                            await asyncio.sleep(wait)
+                        return http.Response(status, headers=headers, content=body, request=request)
+                    if cassette.mode == "replay":
+                        raise cassette.miss(key, payload)
+                start = time.monotonic()
+                response = await inner.handle_async_request(request)
+                try:
+                    body = b"".join([chunk async for chunk in response.stream])
+                finally:
+                    await response.aclose()
+                latency = time.monotonic() - start
+                headers = _response_headers(response)
+                cassette.record(key, provider, payload, response.status_code, headers, body, latency)
+                return http.Response(response.status_code, headers=headers, content=body, request=request)
+
+            async def aclose(self):
+                await inner.aclose()
+
+        return CassetteAsyncTransport()
+
+    class CassetteTransport(http.BaseTransport):
+        def handle_request(self, request):
+            payload = _http_request_payload(request)
+            key = request_key(payload)
+            if cassette.mode != "record":
+                hit = cassette.lookup(key)
+                if hit is not None:
+                    status, headers, body, latency = hit
+                    wait = cassette.delay(latency)
+                    if wait:
+                        time.sleep(wait)
+                    return http.Response(status, headers=headers, content=body, request=request)
+                if cassette.mode == "replay":
+                    raise cassette.miss(key, payload)
+            start = time.monotonic()
+            response = inner.handle_request(request)
+            try:
+                body = b"".join(response.stream)
+            finally:
+                response.close()
+            latency = time.monotonic() - start
+            headers = _response_headers(response)
+            cassette.record(key, provider, payload, response.status_code, headers, body, latency)
+            return http.Response(response.status_code, headers=headers, content=body, request=request)
+
+        def close(self):
+            inner.close()
+
+    return CassetteTransport()
+
+
+def dumps_default(obj: Any) -> str:
+    """generation_config 里可能有 proto / dataclass，转不了 JSON 的就转成 str。"""
+    return json.dumps(obj, default=str, sort_keys=True, ensure_ascii=False)
+
+
+# ------------------------------
+# Gemini（google-generativeai 走的不是 httpx，在 generate_content 这一层录）
+# ------------------------------
+
+
+def gemini_generate(cassette: Cassette, model, model_name: str, system_instruction: Optional[str], args, kwargs):
+    from google.generativeai.types import generation_types
+    import google.generativeai.protos as protos
+
+    payload = {
+        "model": model_name,
+        "system_instruction": system_instruction,
+        "args": CODEC.loads(dumps_default(list(args))),
+        "kwargs": CODEC.loads(dumps_default(kwargs)),
+    }
+    key = request_key(payload)
+    if cassette.mode != "record":
+        hit = cassette.lookup(key)
+        if hit is not None:
+            _, _, body, latency = hit
+            wait = cassette.delay(latency)
+            if wait:
+                time.sleep(wait)
+            result = protos.GenerateContentResponse.from_json(body.decode("utf-8"))
+            return generation_types.GenerateContentResponse.from_response(result)
+        if cassette.mode == "replay":
+            raise cassette.miss(key, payload)
+    start = time.monotonic()
+    response = model.generate_content(*args, **kwargs)
+    latency = time.monotonic() - start
+    body = protos.GenerateContentResponse.to_json(response._result).encode("utf-8")
+    cassette.record(key, "gemini", payload, 200, [], body, latency)
+    return response
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Show what is recorded in a provider cassette.")
+    parser.add_argument("--cassette", type=str, required=True, help="Path to a cassette file.")
+    args = parser.parse_args(argv)
+
+    cassette = Cassette(args.cassette, mode="replay")
+    rows = cassette.summary()
+    for row in rows:
+        print(
+            f"{row['provider']:<12} interactions={row['interactions']:<7} unique={row['unique_requests']:<7} "
+            f"body={row['body_bytes'] / 1024:.1f} KiB mean_latency={row['mean_latency']:.2f}s"
+        )
+    print(f"File size: {os.path.getsize(args.cassette) / 1024:.1f} KiB")
+    cassette.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,415 @@
+import hashlib
+import importlib
+import importlib.util
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+from cassette import cassette_transport, gemini_generate, get_cassette
+from concurrency import THROTTLE_STATUS_CODES, begin_call, call_slot, report_throttle
+
+# 每个 (provider, base_url, api_key) 在进程里只建一个长连接 client，
+# 所有线程共用（OpenAI / Anthropic SDK 的同步 client 本身是线程安全的），
+# async client 另外按 event loop 缓存。连接池大小、HTTP/2、超时都可以配，
+# pool_stats() 给出每个 client 的在途请求数 / 峰值 / 连接数，方便看池子够不够用。
+
+DEFAULT_POOL_SIZE = 32
+DEFAULT_TIMEOUT = 60.0
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+
+_LOCK = threading.Lock()
+_CLIENTS: Dict[Tuple, Any] = {}
+_STATS: Dict[Tuple, "PoolStats"] = {}
+_TRANSPORTS: Dict[Tuple, Any] = {}
+_GEMINI_CONFIGURED: Optional[Tuple] = None
+
+
+class PoolStats:
+    """一个 client 的在途请求计数，线程安全。"""
+
+    def __init__(self, provider: str, base_url: Optional[str], key_id: str, pool_size: int, http2: bool):
+        self.lock = threading.Lock()
+        self.provider = provider
+        self.base_url = base_url
+        self.key_id = key_id
+        self.pool_size = pool_size
+        self.http2 = http2
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.errors = 0
+
+    def begin(self) -> None:
+        with self.lock:
+            self.in_flight += 1
+            self.requests += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def end(self, error: bool = False) -> None:
+        with self.lock:
+            self.in_flight -= 1
+            if error:
+                self.errors += 1
+
+    def failed_response(self) -> None:
+        # 拿到了响应但是 429 / 5xx，也算错误（请求本身还在途，等 body 读完再 end）
+        with self.lock:
+            self.errors += 1
+
+
+def _is_error_status(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
+
+
+def _key_id(api_key: Optional[str]) -> str:
+    # 统计和日志里不出现明文 key
+    if not api_key:
+        return "env"
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:8]
+
+
+def _http_module(sdk):
+    """
+    SDK 自带的 DefaultHttpxClient 继承自它实际使用的 httpx（或 fork），
+    Limits / Timeout / Transport 必须来自同一个模块。
+    """
+    base = sdk.DefaultHttpxClient.__mro__[1]
+    return importlib.import_module(base.__module__.split(".")[0])
+
+
+def _http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+def _counting_transport(http, inner, stats: PoolStats, is_async: bool):
+    """
+    包一层 transport：请求发出时 +1，响应 body 读完（stream close）时 -1，
+    这样在途数覆盖整个请求，而不只是等 header 的那段。
+    同步 client 的调用方开了 use_limiter 时，每个请求在同样的区间里占 concurrency limiter 的一个 slot，
+    429 / 503 / 529 记成限流（async 版不占 slot：acquire 会阻塞 event loop）。
+    """
+
+    def start_stream(lease, response) -> bool:
+        # 出错的响应马上还 slot（body 不影响拥塞判断）；正常响应等 body 读完
+        if lease is None:
+            return False
+        if response.status_code in THROTTLE_STATUS_CODES or _is_error_status(response.status_code):
+            lease.finish(throttled=response.status_code in THROTTLE_STATUS_CODES, error=True)
+            return False
+        return True
+
+    if is_async:
+
+        class CountingAsyncStream(http.AsyncByteStream):
+            def __init__(self, stream):
+                self._stream = stream
+                self._closed = False
+
+            async def __aiter__(self):
+                async for chunk in self._stream:
+                    yield chunk
+
+            async def aclose(self):
+                try:
+                    await self._stream.aclose()
+                finally:
+                    if not self._closed:
+                        self._closed = True
+                        stats.end()
+
+        class CountingAsyncTransport(http.AsyncBaseTransport):
+            async def handle_async_request(self, request):
+                stats.begin()
+                try:
+                    response = await inner.handle_async_request(request)
+                except BaseException:
+                    stats.end(error=True)
+                    raise
+                if _is_error_status(response.status_code):
+                    stats.failed_response()
+                if response.status_code in THROTTLE_STATUS_CODES:
+                    report_throttle()
+                response.stream = CountingAsyncStream(response.stream)
+                return response
+
+            async def aclose(self):
+                await inner.aclose()
+
+        return CountingAsyncTransport()
+
+    class CountingStream(http.SyncByteStream):
+        def __init__(self, stream, lease=None):
+            self._stream = stream
+            self._lease = lease
+            self._closed = False
+
+        def __iter__(self):
+            for chunk in self._stream:
+                yield chunk
+
+        def close(self):
+            try:
+                self._stream.close()
+            finally:
+                if not self._closed:
+                    self._closed = True
+                    stats.end()
+                    if self._lease is not None:
+                        self._lease.finish()
+
+    class CountingTransport(http.BaseTransport):
+        def handle_request(self, request):
+            lease = begin_call()
+            stats.begin()
+            try:
+                response = inner.handle_request(request)
+            except BaseException:
+                stats.end(error=True)
+                if lease is not None:
+                    lease.finish(error=True)
+                raise
+            if _is_error_status(response.status_code):
+                stats.failed_response()
+            if response.status_code in THROTTLE_STATUS_CODES:
+                report_throttle()
+            response.stream = CountingStream(response.stream, lease if start_stream(lease, response) else None)
+            return response
+
+        def close(self):
+            inner.close()
+
+    return CountingTransport()
+
+
+def _build_http_client(sdk, stats: PoolStats, pool_size: int, timeout: float, http2: bool, is_async: bool):
+    http = _http_module(sdk)
+    limits = http.Limits(
+        max_connections=pool_size,
+        max_keepalive_connections=pool_size,
+        keepalive_expiry=DEFAULT_KEEPALIVE_EXPIRY,
+    )
+    transport_cls = http.AsyncHTTPTransport if is_async else http.HTTPTransport
+    inner = transport_cls(http2=http2, limits=limits)
+    # HAB_CASSETTE / use_cassette() 开着时在真实 transport 外面套 record / replay
+    cassette = get_cassette()
+    wrapped = cassette_transport(http, inner, cassette, stats.provider, is_async) if cassette else inner
+    transport = _counting_transport(http, wrapped, stats, is_async)
+    client_cls = sdk.DefaultAsyncHttpxClient if is_async else sdk.DefaultHttpxClient
+    client = client_cls(
+        transport=transport,
+        timeout=http.Timeout(timeout, connect=DEFAULT_CONNECT_TIMEOUT),
+    )
+    return client, inner
+
+
+def _get(
+    provider: str,
+    base_url: Optional[str],
+    api_key: Optional[str],
+    pool_size: int,
+    timeout: float,
+    http2: Optional[bool],
+    is_async: bool,
+):
+    loop_id = None
+    if is_async:
+        import asyncio
+
+        # async client 绑定在 event loop 上，不能跨 loop 共用
+        loop_id = id(asyncio.get_running_loop())
+    key = (provider, base_url, _key_id(api_key), is_async, loop_id)
+
+    with _LOCK:
+        client = _CLIENTS.get(key)
+        if client is not None:
+            return client
+
+        if provider == "openai":
+            sdk = importlib.import_module("openai")
+            sdk_cls = sdk.AsyncOpenAI if is_async else sdk.OpenAI
+        elif provider == "anthropic":
+            sdk = importlib.import_module("anthropic")
+            sdk_cls = sdk.AsyncAnthropic if is_async else sdk.Anthropic
+        else:
+            raise ValueError(f"Unknown provider '{provider}'. Use 'openai' or 'anthropic' (or get_gemini_model).")
+
+        use_http2 = _http2_available() if http2 is None else http2
+        stats = PoolStats(provider, base_url, key[2], pool_size, use_http2)
+        http_client, inner = _build_http_client(sdk, stats, pool_size, timeout, use_http2, is_async)
+
+        # SDK 自己不重试：各脚本 / provider 的 retry 循环已经重试 3 次，SDK 默认的 2 次叠上去一个失败的请求要发 9 次
+        kwargs: Dict[str, Any] = {"http_client": http_client, "timeout": timeout, "max_retries": 0}
+        if base_url is not None:
+            kwargs["base_url"] = base_url
+        if api_key is not None:
+            kwargs["api_key"] = api_key
+        client = sdk_cls(**kwargs)
+
+        _CLIENTS[key] = client
+        _STATS[key] = stats
+        _TRANSPORTS[key] = inner
+        return client
+
+
+def get_client(
+    provider: str,
+    base_url: Optional[str] = None,
+    api_key: Optional[str] = None,
+    pool_size: int = DEFAULT_POOL_SIZE,
+    timeout: float = DEFAULT_TIMEOUT,
+    http2: Optional[bool] = None,
+):
+    """
+    provider: "openai"（含 OpenRouter 等 OpenAI 兼容 endpoint）或 "anthropic"。
+    api_key=None 时交给 SDK 从环境变量读。http2=None 表示装了 h2 就开。
+    同一个 key 第二次调用直接返回缓存的 client，pool_size / timeout 以第一次为准。
+    """
+    return _get(provider, base_url, api_key, pool_size, timeout, http2, is_async=False)
+
+
+def get_async_client(
+    provider: str,
+    base_url: Optional[str] = None,
+    api_key: Optional[str] = None,
+    pool_size: int = DEFAULT_POOL_SIZE,
+    timeout: float = DEFAULT_TIMEOUT,
+    http2: Optional[bool] = None,
+):
+    """get_client 的 async 版本，必须在 event loop 里调用。"""
+    return _get(provider, base_url, api_key, pool_size, timeout, http2, is_async=True)
+
+
+class _TrackedGeminiModel:
+    """GenerativeModel 的薄包装：统计在途请求，开了 cassette 时走 record / replay。"""
+
+    def __init__(self, model, stats: PoolStats, model_name: str, system_instruction: Optional[str]):
+        self._model = model
+        self._stats = stats
+        self._model_name = model_name
+        self._system_instruction = system_instruction
+
+    def generate_content(self, *args, **kwargs):
+        with call_slot():
+            self._stats.begin()
+            error = False
+            try:
+                cassette = get_cassette()
+                if cassette is not None:
+                    return gemini_generate(
+                        cassette, self._model, self._model_name, self._system_instruction, args, kwargs
+                    )
+                return self._model.generate_content(*args, **kwargs)
+            except BaseException as e:
+                error = True
+                # google.api_core 的 429 / 503
+                if type(e).__name__ in ("ResourceExhausted", "TooManyRequests", "ServiceUnavailable"):
+                    report_throttle()
+                raise
+            finally:
+                self._stats.end(error=error)
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+
+def configure_gemini(
+    api_key: str,
+    api_endpoint: Optional[str] = None,
+    transport: str = "rest",
+) -> None:
+    """
+    genai.configure 是进程级全局配置，这里只在参数变化时重新 configure。
+    """
+    global _GEMINI_CONFIGURED
+    key = (_key_id(api_key), api_endpoint, transport)
+    with _LOCK:
+        if _GEMINI_CONFIGURED == key:
+            return
+        genai = importlib.import_module("google.generativeai")
+        kwargs: Dict[str, Any] = {"api_key": api_key, "transport": transport}
+        if api_endpoint is not None:
+            kwargs["client_options"] = {"api_endpoint": api_endpoint}
+        genai.configure(**kwargs)
+        _GEMINI_CONFIGURED = key
+
+
+def get_gemini_model(model_name: str, system_instruction: Optional[str] = None):
+    """
+    按 (model_name, system_instruction) 缓存 GenerativeModel，
+    不用每次调用都重新建 model（和它底下的 client）。需要先 configure_gemini。
+    """
+    key = ("gemini", model_name, system_instruction, False, None)
+    with _LOCK:
+        model = _CLIENTS.get(key)
+        if model is not None:
+            return model
+        genai = importlib.import_module("google.generativeai")
+        stats = PoolStats("gemini", model_name, "configured", 0, False)
+        model = _TrackedGeminiModel(
+            genai.GenerativeModel(model_name=model_name, system_instruction=system_instruction),
+            stats,
+            model_name,
+            system_instruction,
+        )
+        _CLIENTS[key] = model
+        _STATS[key] = stats
+        return model
+
+
+def _connection_counts(inner) -> Tuple[Optional[int], Optional[int]]:
+    # httpcore 的连接池没有公开 API，拿不到就返回 None
+    pool = getattr(inner, "_pool", None)
+    connections = getattr(pool, "connections", None)
+    if connections is None:
+        return None, None
+    idle = 0
+    for conn in list(connections):
+        try:
+            idle += 1 if conn.is_idle() else 0
+        except Exception:
+            pass
+    return len(connections), idle
+
+
+def pool_stats() -> List[Dict[str, Any]]:
+    """
+    每个缓存 client 一行：在途 / 峰值 / 总请求 / 错误数（传输异常 + 429 / 5xx 响应）/ 打开和空闲的连接数 / 利用率。
+    in_flight 也包括在池子里排队等连接的请求，所以 utilization > 1 说明 pool_size 不够。
+    """
+    with _LOCK:
+        items = list(_STATS.items())
+    rows: List[Dict[str, Any]] = []
+    for key, stats in items:
+        open_conns, idle_conns = _connection_counts(_TRANSPORTS.get(key))
+        with stats.lock:
+            rows.append(
+                {
+                    "provider": stats.provider,
+                    "base_url": stats.base_url,
+                    "key_id": stats.key_id,
+                    "async": key[3],
+                    "http2": stats.http2,
+                    "pool_size": stats.pool_size,
+                    "in_flight": stats.in_flight,
+                    "peak_in_flight": stats.peak_in_flight,
+                    "requests": stats.requests,
+                    "errors": stats.errors,
+                    "open_connections": open_conns,
+                    "idle_connections": idle_conns,
+                    "utilization": (stats.in_flight / stats.pool_size) if stats.pool_size else None,
+                }
+            )
+    return rows
+
+
+def format_pool_stats() -> str:
+    lines = []
+    for row in pool_stats():
+        lines.append(
+            f"{row['provider']:<10} {str(row['base_url'] or 'default'):<44} "
+            f"pool={row['pool_size']:<4} http2={row['http2']!s:<5} "
+            f"in_flight={row['in_flight']:<4} peak={row['peak_in_flight']:<4} "
+            f"requests={row['requests']:<6} errors={row['errors']:<4} "
+            f"conns={row['open_connections']}"
+        )
+    return "\n".join(lines)
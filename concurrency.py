@@ -0,0 +1,207 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional
+
+# 按 provider/model 自适应调整并发（AIMD + 延迟梯度）：
+#   - 调用顺利、延迟没有明显变差、并且确实用满了当前上限 -> 上限 +increase/limit（每个 RTT 大约 +1）
+#   - 遇到 429 / 503 / 529，或者短期平均延迟超过长期基线 tolerance 倍 -> 上限 *decrease
+#     （每个 RTT 最多降一次，一波 429 只算一次）
+# 调用方用 use_limiter(limiter) 声明 "这段代码里的 provider 调用归这个 limiter 管"，
+# 真正占 slot 的是每一次 provider 请求：clients.py 的 transport（和 Gemini 包装）在请求发出前 acquire，
+# 响应读完后 release，所以重试之间的 sleep、self-consistency 的多个样本都不会算进一个 slot 的延迟里，
+# 一次 429 + 一次成功的重试也是两次调用（一次限流、一次成功）。
+
+# 起点要明显低于上限，不然 AIMD 只能往下调
+DEFAULT_INITIAL_LIMIT = 4
+DEFAULT_MAX_LIMIT = 32
+THROTTLE_STATUS_CODES = (429, 503, 529)
+
+_CURRENT: "contextvars.ContextVar[Optional[_Slot]]" = contextvars.ContextVar("hab_limiter_slot", default=None)
+_ACTIVE: "contextvars.ContextVar[Optional[AdaptiveLimiter]]" = contextvars.ContextVar("hab_limiter", default=None)
+
+
+class _Slot:
+    __slots__ = ("throttled",)
+
+    def __init__(self):
+        self.throttled = 0
+
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        name: str,
+        initial_limit: float = DEFAULT_INITIAL_LIMIT,
+        min_limit: float = 1,
+        max_limit: float = DEFAULT_MAX_LIMIT,
+        increase: float = 1.0,
+        decrease: float = 0.7,
+        tolerance: float = 2.0,
+    ):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.increase = increase
+        self.decrease = decrease
+        self.tolerance = tolerance
+        self.cond = threading.Condition()
+        self.in_flight = 0
+        # 短期 / 长期延迟 EWMA；长期的当基线
+        self.short_latency: Optional[float] = None
+        self.long_latency: Optional[float] = None
+        self.last_decrease = 0.0
+        self.stats: Dict[str, int] = {"calls": 0, "throttled": 0, "errors": 0, "increases": 0, "decreases": 0}
+
+    def acquire(self) -> None:
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+
+    def _decrease(self, now: float) -> None:
+        # 一个 RTT 之内的多次拥塞信号只降一次
+        if now - self.last_decrease < (self.short_latency or 0.0):
+            return
+        self.limit = max(self.min_limit, self.limit * self.decrease)
+        self.last_decrease = now
+        self.stats["decreases"] += 1
+
+    def release(self, latency: float, throttled: bool = False, error: bool = False) -> None:
+        now = time.monotonic()
+        with self.cond:
+            was_saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            self.stats["calls"] += 1
+            if throttled:
+                self.stats["throttled"] += 1
+                self._decrease(now)
+            elif error:
+                # 普通错误（解析失败、4xx）不说明拥塞，不动上限
+                self.stats["errors"] += 1
+            else:
+                if self.short_latency is None:
+                    self.short_latency = self.long_latency = latency
+                else:
+                    self.short_latency += 0.2 * (latency - self.short_latency)
+                    self.long_latency += 0.02 * (latency - self.long_latency)
+                if self.short_latency > self.long_latency * self.tolerance:
+                    self._decrease(now)
+                elif was_saturated and self.limit < self.max_limit:
+                    self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+                    self.stats["increases"] += 1
+            self.cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """with limiter.slot(): 调 provider。期间 transport 看到的 429 会记到这个 slot 上。"""
+        self.acquire()
+        slot = _Slot()
+        token = _CURRENT.set(slot)
+        start = time.monotonic()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            _CURRENT.reset(token)
+            self.release(time.monotonic() - start, throttled=slot.throttled > 0, error=error)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.cond:
+            return {
+                "name": self.name,
+                "limit": round(self.limit, 3),
+                "in_flight": self.in_flight,
+                "short_latency": self.short_latency,
+                "long_latency": self.long_latency,
+                **self.stats,
+            }
+
+
+@contextmanager
+def use_limiter(limiter: Optional[AdaptiveLimiter]):
+    """with use_limiter(limiter): 期间（包括 copy_context 带进线程池的样本）每次 provider 请求各占一个 slot。"""
+    token = _ACTIVE.set(limiter)
+    try:
+        yield
+    finally:
+        _ACTIVE.reset(token)
+
+
+class CallLease:
+    """transport 层的一次请求占的 slot：响应 body 读完（stream close）时才 finish，finish 只生效一次。"""
+
+    def __init__(self, limiter: AdaptiveLimiter):
+        self.limiter = limiter
+        self.lock = threading.Lock()
+        self.done = False
+        limiter.acquire()
+        self.start = time.monotonic()
+
+    def finish(self, throttled: bool = False, error: bool = False) -> None:
+        with self.lock:
+            if self.done:
+                return
+            self.done = True
+        self.limiter.release(time.monotonic() - self.start, throttled=throttled, error=error)
+
+
+def begin_call() -> Optional[CallLease]:
+    """没有 use_limiter，或者调用方已经自己占着 slot（limiter.slot()）时返回 None。"""
+    limiter = _ACTIVE.get()
+    if limiter is None or _CURRENT.get() is not None:
+        return None
+    return CallLease(limiter)
+
+
+@contextmanager
+def call_slot():
+    """不走 httpx transport 的 provider（Gemini、本地模型）在每次调用外面套这个。"""
+    limiter = _ACTIVE.get()
+    if limiter is None or _CURRENT.get() is not None:
+        yield
+        return
+    with limiter.slot():
+        yield
+
+
+def report_throttle() -> None:
+    """provider 返回了限流 / 过载；没有在 slot 里调用时什么都不做。"""
+    slot = _CURRENT.get()
+    if slot is not None:
+        slot.throttled += 1
+
+
+_LIMITERS: Dict[str, AdaptiveLimiter] = {}
+_LOCK = threading.Lock()
+
+
+def get_limiter(name: str, **kwargs) -> AdaptiveLimiter:
+    """同一个 name（例如 "generate:gpt:gpt-4.1-mini"）在进程里共用一个 limiter。"""
+    with _LOCK:
+        limiter = _LIMITERS.get(name)
+        if limiter is None:
+            limiter = _LIMITERS[name] = AdaptiveLimiter(name, **kwargs)
+        return limiter
+
+
+def limiter_stats() -> List[Dict[str, Any]]:
+    with _LOCK:
+        limiters = list(_LIMITERS.values())
+    return [lim.snapshot() for lim in limiters]
+
+
+def format_limiter_stats() -> str:
+    lines = []
+    for row in limiter_stats():
+        latency = f"{row['long_latency']:.2f}s" if row["long_latency"] is not None else "n/a"
+        lines.append(
+            f"{row['name']:<56} limit={row['limit']:<7} calls={row['calls']:<6} "
+            f"throttled={row['throttled']:<4} +{row['increases']}/-{row['decreases']} latency={latency}"
+        )
+    return "\n".join(lines)
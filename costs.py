@@ -0,0 +1,287 @@
+import argparse
+import importlib.util
+import json
+import threading
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+from evaluate_answers import METRIC_RUBRICS, build_eval_prompt
+from generate_samples import build_prompt
+from prompts import ANSWER_SYSTEM_PROMPT
+
+# 跑之前先估成本，跑的时候守住预算。
+# token 数用本地 tokenizer 算：装了 tiktoken 用 o200k_base，没装就按 4 字符 ≈ 1 token 估。
+# prompt 的固定部分（模板 + rubric）每个 metric 只算一次，question / answer 按文本去重后批量算，
+# 所以 10 万个调用的计划也只需要几秒。价格是每百万 token 的美元数，可以用 --prices_json 覆盖。
+
+# model -> (input $/1M tokens, output $/1M tokens)
+PRICES_PER_MTOK: Dict[str, Tuple[float, float]] = {
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "claude-3-7-sonnet-latest": (3.00, 15.00),
+    "gemini-2.5-pro": (1.25, 10.00),
+    "x-ai/grok-3": (3.00, 15.00),
+    "meta-llama/llama-4-maverick": (0.15, 0.60),
+}
+
+# 生成时没有答案可数，先按这个估输出长度
+DEFAULT_ANSWER_TOKENS = 500
+# judge 输出的 JSON 里除了 question / answer 回显之外的部分（score、justification、括号）
+EVAL_OVERHEAD_TOKENS = 120
+# 系统 prompt / chat 格式的额外 token
+MESSAGE_OVERHEAD_TOKENS = 40
+
+
+class TokenCounter:
+    """带缓存的 token 计数；count_many 会把没见过的文本一次性批量 encode。"""
+
+    def __init__(self, encoding: str = "o200k_base"):
+        self.lock = threading.Lock()
+        self.cache: Dict[str, int] = {}
+        self.enc = None
+        if importlib.util.find_spec("tiktoken") is not None:
+            import tiktoken
+
+            try:
+                self.enc = tiktoken.get_encoding(encoding)
+            except Exception as e:
+                # 第一次用要下载词表，离线时退回字符数估算
+                print(f"[WARN] Could not load tiktoken encoding '{encoding}' ({e}); using chars/4.")
+        self.name = encoding if self.enc is not None else "chars/4"
+
+    def _encode(self, texts: List[str]) -> List[int]:
+        if self.enc is None:
+            return [(len(t) + 3) // 4 for t in texts]
+        return [len(ids) for ids in self.enc.encode_ordinary_batch(texts)]
+
+    def count_many(self, texts: Iterable[str]) -> List[int]:
+        texts = list(texts)
+        with self.lock:
+            missing = list({t for t in texts if t not in self.cache})
+        if missing:
+            counts = self._encode(missing)
+            with self.lock:
+                self.cache.update(zip(missing, counts))
+        cache = self.cache
+        return [cache[t] for t in texts]
+
+    def count(self, text: str) -> int:
+        n = self.cache.get(text)
+        if n is None:
+            n = self.count_many([text])[0]
+        return n
+
+
+def load_prices(path: Optional[str] = None) -> Dict[str, Tuple[float, float]]:
+    prices = dict(PRICES_PER_MTOK)
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            for model, (p_in, p_out) in json.load(f).items():
+                prices[model] = (float(p_in), float(p_out))
+    return prices
+
+
+_WARNED = set()
+
+
+def price_for(model: str, prices: Dict[str, Tuple[float, float]]) -> Tuple[float, float]:
+    """
+    先精确匹配，再去掉 "provider:" 前缀；local 模型免费。
+    不认识的模型按最贵的价格算（宁可高估），并提示一次。
+    """
+    if model in prices:
+        return prices[model]
+    provider, _, name = model.partition(":")
+    if provider == "local":
+        return (0.0, 0.0)
+    if name in prices:
+        return prices[name]
+    if model not in _WARNED:
+        _WARNED.add(model)
+        print(f"[WARN] No price for model '{model}', assuming the most expensive known price.")
+    return max(prices.values(), key=lambda p: p[0] + p[1])
+
+
+def call_cost(model: str, input_tokens: int, output_tokens: int, prices: Dict[str, Tuple[float, float]]) -> float:
+    p_in, p_out = price_for(model, prices)
+    return (input_tokens * p_in + output_tokens * p_out) / 1e6
+
+
+class CostModel:
+    """把一次生成 / 评估调用换算成 (input_tokens, output_tokens, cost)。"""
+
+    def __init__(self, prices: Dict[str, Tuple[float, float]], counter: Optional[TokenCounter] = None):
+        self.prices = prices
+        self.counter = counter or TokenCounter()
+        self._template_tokens: Dict[Tuple[str, str], int] = {}
+
+    def template_tokens(self, kind: str, metric_name: str = "") -> int:
+        """prompt 里除了 question / answer 之外的部分，每种只算一次。"""
+        key = (kind, metric_name)
+        n = self._template_tokens.get(key)
+        if n is None:
+            if kind == "generate":
+                n = self.counter.count(ANSWER_SYSTEM_PROMPT)
+            elif kind == "evaluate":
+                n = self.counter.count(build_eval_prompt(metric_name, METRIC_RUBRICS[metric_name], "", ""))
+            else:
+                n = self.counter.count(build_prompt(metric_name, METRIC_RUBRICS[metric_name], ""))
+            n += MESSAGE_OVERHEAD_TOKENS
+            self._template_tokens[key] = n
+        return n
+
+    def generate(self, model: str, question: str, answer: Optional[str] = None) -> Tuple[int, int, float]:
+        n_in = self.template_tokens("generate") + self.counter.count(question)
+        n_out = self.counter.count(answer) if answer is not None else DEFAULT_ANSWER_TOKENS
+        return n_in, n_out, call_cost(model, n_in, n_out, self.prices)
+
+    def evaluate(
+        self,
+        judge: str,
+        metric_name: str,
+        question: str,
+        answer: Optional[str],
+        justification: Optional[str] = None,
+    ) -> Tuple[int, int, float]:
+        q = self.counter.count(question)
+        a = self.counter.count(answer) if answer is not None else DEFAULT_ANSWER_TOKENS
+        n_in = self.template_tokens("evaluate", metric_name) + q + a
+        # judge 的 JSON 输出会把 question 和 answer 原样回显一遍
+        extra = self.counter.count(justification) if justification is not None else EVAL_OVERHEAD_TOKENS
+        n_out = q + a + extra
+        return n_in, n_out, call_cost(judge, n_in, n_out, self.prices)
+
+    def samples(self, model: str, metric_name: str, question: str) -> Tuple[int, int, float]:
+        q = self.counter.count(question)
+        n_in = self.template_tokens("samples", metric_name) + q
+        n_out = q + 5 * DEFAULT_ANSWER_TOKENS
+        return n_in, n_out, call_cost(model, n_in, n_out, self.prices)
+
+
+class CostEstimate:
+    """按 (stage, model) 汇总调用数 / token / 美元。"""
+
+    def __init__(self):
+        self.rows: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    def add(self, stage: str, model: str, cost: Tuple[int, int, float], n: int = 1) -> None:
+        """n 次同样的调用（self-consistency 重复采样）。"""
+        row = self.rows.get((stage, model))
+        if row is None:
+            row = self.rows[(stage, model)] = {
+                "stage": stage,
+                "model": model,
+                "calls": 0,
+                "input_tokens": 0,
+                "output_tokens": 0,
+                "cost_usd": 0.0,
+            }
+        row["calls"] += n
+        row["input_tokens"] += cost[0] * n
+        row["output_tokens"] += cost[1] * n
+        row["cost_usd"] += cost[2] * n
+
+    @property
+    def total_usd(self) -> float:
+        return sum(r["cost_usd"] for r in self.rows.values())
+
+    @property
+    def total_calls(self) -> int:
+        return sum(r["calls"] for r in self.rows.values())
+
+    def format(self) -> str:
+        lines = []
+        for row in sorted(self.rows.values(), key=lambda r: (r["stage"], r["model"])):
+            lines.append(
+                f"{row['stage']:<10} {row['model']:<44} calls={row['calls']:<7} "
+                f"in={row['input_tokens']:<10} out={row['output_tokens']:<10} ${row['cost_usd']:.2f}"
+            )
+        lines.append(f"{'total':<10} {'':<44} calls={self.total_calls:<7} ${self.total_usd:.2f}")
+        return "\n".join(lines)
+
+
+class BudgetGuard:
+    """
+    硬预算：每个调用先按估算 reserve，调用完再按实际 token 结算。
+    spent + 已预留 会超过 limit 时 reserve 返回 False，调用方跳过这个节点（留给 resume）。
+    """
+
+    def __init__(self, limit_usd: float, spent_usd: float = 0.0):
+        self.limit = limit_usd
+        self.spent = spent_usd
+        self.reserved = 0.0
+        self.lock = threading.Lock()
+        self.exhausted = False
+
+    def reserve(self, amount: float) -> bool:
+        with self.lock:
+            if self.spent + self.reserved + amount > self.limit:
+                self.exhausted = True
+                return False
+            self.reserved += amount
+            return True
+
+    def settle(self, reserved: float, actual: float) -> None:
+        with self.lock:
+            self.reserved -= reserved
+            self.spent += actual
+
+    def release(self, reserved: float) -> None:
+        """调用失败：不知道实际花了多少，按预留额计入（宁可高估）。"""
+        self.settle(reserved, reserved)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Estimate tokens and cost of evaluating an answers file or generating samples (no API calls)."
+    )
+    parser.add_argument(
+        "--input_jsonl",
+        type=str,
+        default="./results/model_answers/out_grok.jsonl",
+        help="Path to input .jsonl file with model answers.",
+    )
+    parser.add_argument("--model", type=str, default="gpt-4.1-mini", help="Judge model.")
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        default=",".join(METRIC_RUBRICS.keys()),
+        help="Comma-separated metric names.",
+    )
+    parser.add_argument(
+        "--samples_input",
+        type=str,
+        default=None,
+        help="Instead estimate generate_samples.py on this question file (with --model as generator).",
+    )
+    parser.add_argument("--prices_json", type=str, default=None, help="JSON {model: [input, output]} $/1M tokens.")
+    args = parser.parse_args(argv)
+
+    cost_model = CostModel(load_prices(args.prices_json))
+    metric_names = [m.strip() for m in args.metrics.split(",") if m.strip()]
+    estimate = CostEstimate()
+    if args.samples_input:
+        from loaders import load_questions
+
+        questions = load_questions(args.samples_input)
+        cost_model.counter.count_many(questions)
+        for question in questions:
+            for metric_name in metric_names:
+                estimate.add("samples", args.model, cost_model.samples(args.model, metric_name, question))
+    else:
+        from evaluate_answers import load_answers_jsonl
+
+        records = load_answers_jsonl(args.input_jsonl)
+        # 先批量把所有文本 encode 一遍，后面全是缓存命中
+        cost_model.counter.count_many([r["question"] for r in records] + [r["answer"] for r in records])
+        for rec in records:
+            for metric_name in metric_names:
+                estimate.add(
+                    "evaluate", args.model, cost_model.evaluate(args.model, metric_name, rec["question"], rec["answer"])
+                )
+    print(f"Tokenizer: {cost_model.counter.name}")
+    print(estimate.format())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+import argparse
+import contextvars
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, List, Optional, Set, Tuple
+
+from prompts import ANSWER_SYSTEM_PROMPT
+from records import dumps_line, iter_jsonl
+
+# dead-letter queue：重试用完还失败的 work item 不再只打一行 [ERROR] 就消失，
+# 而是连同 error class、每次尝试的错误、prompt 的 sha1 和重跑需要的全部信息写进 <output>.dlq（JSONL）。
+# 之后 `python deadletter.py retry <file>.dlq` 只重跑这些 item（可以降并发、换 provider / judge），
+# 成功的按原来的格式追加进原输出文件，还失败的留在 .dlq 里（尝试历史累加）。
+#
+# 尝试历史：各脚本 retry 循环里每次失败调 note_attempt(e)；调用方用 with_attempts(fn, ...) 包住一个 work item，
+# 失败时异常上带着这次的尝试列表（contextvar，线程池里每个 item 在自己的线程里跑，互不干扰）。
+#
+#   python deadletter.py list ./results/model_answers/out.jsonl.dlq
+#   python deadletter.py retry ./results/runs/<name>/dead_letter.dlq --workers 2 --judge claude:claude-3-7-sonnet-latest
+
+DEAD_LETTER_SUFFIX = ".dlq"
+MAX_ERROR_CHARS = 500
+
+_ATTEMPTS: contextvars.ContextVar[Optional[List[Dict[str, Any]]]] = contextvars.ContextVar(
+    "hab_attempts", default=None
+)
+
+
+def note_attempt(error: BaseException) -> None:
+    """retry 循环里每次失败调一次；不在 with_attempts 里时什么都不做。"""
+    attempts = _ATTEMPTS.get()
+    if attempts is not None:
+        attempts.append(
+            {
+                "attempt": len(attempts) + 1,
+                "error_class": type(error).__name__,
+                "error": str(error)[:MAX_ERROR_CHARS],
+                "at": time.time(),
+            }
+        )
+
+
+def with_attempts(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """调 fn；失败时把期间 note_attempt 记下的尝试挂到异常的 hab_attempts 上再抛出去。"""
+    attempts: List[Dict[str, Any]] = []
+    token = _ATTEMPTS.set(attempts)
+    try:
+        return fn(*args, **kwargs)
+    except Exception as e:
+        try:
+            e.hab_attempts = attempts
+        except AttributeError:
+            pass
+        raise
+    finally:
+        _ATTEMPTS.reset(token)
+
+
+def prompt_sha1(*parts: str) -> str:
+    return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def dead_letter_path(output_path: str) -> str:
+    return output_path + DEAD_LETTER_SUFFIX
+
+
+def generation_item(
+    provider: str,
+    model: str,
+    temperature: float,
+    record: Dict[str, Any],
+    output_jsonl: str,
+    normalize: bool = True,
+    raw_jsonl: Optional[str] = None,
+) -> Dict[str, Any]:
+    """record 是不带 answer 的输出记录模板（question_id / question / meta）。"""
+    return {
+        "provider": provider,
+        "model": model,
+        "temperature": temperature,
+        "record": record,
+        "output_jsonl": output_jsonl,
+        "normalize": normalize,
+        "raw_jsonl": raw_jsonl,
+    }
+
+
+def evaluation_item(judge: str, temperature: float, record: Dict[str, Any], output_jsonl: str) -> Dict[str, Any]:
+    """record 是不带 score / justification 的评估记录模板。"""
+    return {"judge": judge, "temperature": temperature, "record": record, "output_jsonl": output_jsonl}
+
+
+def letter_key(kind: str, item: Dict[str, Any]) -> str:
+    rec = item["record"]
+    who = item.get("judge") or f"{item.get('provider')}:{item.get('model')}"
+    return "|".join(
+        [kind, item["output_jsonl"], str(rec.get("question_id")), rec.get("metric") or "", who, prompt_sha1(rec["question"])[:12]]
+    )
+
+
+class DeadLetterQueue:
+    """多线程共用的 .dlq 追加写；第一次 add 才建文件，跑得干净的 run 不会留下空文件。"""
+
+    def __init__(self, path: str, fresh: bool = False):
+        """fresh=True：脚本会重写整个输出文件，上一次 run 留下的 .dlq 也作废。"""
+        self.path = path
+        self.lock = threading.Lock()
+        self.f = None
+        self.count = 0
+        if fresh and os.path.exists(path):
+            os.remove(path)
+
+    def add(
+        self,
+        kind: str,
+        item: Dict[str, Any],
+        error: BaseException,
+        prompt: str,
+        history: Optional[List[Dict[str, Any]]] = None,
+        retries: int = 0,
+    ) -> None:
+        attempts = list(history or []) + list(getattr(error, "hab_attempts", None) or [])
+        # 最后抛出来的通常是 "Failed ... after retries" 的 RuntimeError，真正的原因在最后一次尝试里
+        last = attempts[-1] if attempts else {"error_class": type(error).__name__, "error": str(error)}
+        letter = {
+            "kind": kind,
+            "key": letter_key(kind, item),
+            "error_class": last["error_class"],
+            "error": str(error)[:MAX_ERROR_CHARS],
+            "last_attempt_error": last["error"][:MAX_ERROR_CHARS],
+            "attempts": attempts,
+            "retries": retries,
+            "prompt_sha1": prompt_sha1(prompt),
+            "failed_at": time.time(),
+            "item": item,
+        }
+        line = dumps_line(letter)
+        with self.lock:
+            if self.f is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self.f = open(self.path, "a", encoding="utf-8")
+            self.f.write(line)
+            self.f.flush()
+            self.count += 1
+
+    def add_generation(
+        self,
+        provider: str,
+        model: str,
+        temperature: float,
+        record: Dict[str, Any],
+        output_jsonl: str,
+        error: BaseException,
+        normalize: bool = True,
+        raw_jsonl: Optional[str] = None,
+    ) -> None:
+        """一道题的生成失败；record 是输出记录（answer 可以还没有），重跑成功后补上 answer 原样写回。"""
+        template = {k: v for k, v in record.items() if k != "answer"}
+        template.setdefault("meta", {"model": model, "temperature": temperature})
+        item = generation_item(provider, model, temperature, template, output_jsonl, normalize, raw_jsonl)
+        self.add("generate", item, error, generation_prompt(record["question"]))
+
+    def add_evaluation(
+        self,
+        judge: str,
+        temperature: float,
+        rec: Dict[str, Any],
+        metric_name: str,
+        rubric: str,
+        output_jsonl: str,
+        error: BaseException,
+        eval_meta: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """一条 (answer, metric, judge) 评估失败；模板字段和各脚本写出的评估记录一致。"""
+        template = {
+            "question_id": rec.get("question_id"),
+            "question": rec["question"],
+            "answer": rec["answer"],
+            "metric": metric_name,
+            "rubric": rubric,
+            "eval_meta": eval_meta or {"model": judge, "temperature": temperature},
+        }
+        item = evaluation_item(judge, temperature, template, output_jsonl)
+        self.add("evaluate", item, error, evaluation_prompt(template, metric_name, rubric))
+
+    def close(self, report: bool = True) -> None:
+        with self.lock:
+            if self.f is not None:
+                self.f.close()
+                self.f = None
+        if self.count and report:
+            print(f"[WARN] {self.count} failed items written to {self.path} (retry: python deadletter.py retry {self.path})")
+
+
+def load_dead_letters(path: str) -> List[Dict[str, Any]]:
+    """同一个 item 写了多次（run resume 后又失败）只留最后一条。"""
+    letters: Dict[str, Dict[str, Any]] = {}
+    for letter in iter_jsonl(path):
+        letters.pop(letter["key"], None)
+        letters[letter["key"]] = letter
+    return list(letters.values())
+
+
+# ------------------------------
+# retry
+# ------------------------------
+
+
+def output_key(kind: str, record: Dict[str, Any]) -> Tuple[Any, ...]:
+    if kind == "generate":
+        return (str(record.get("question_id")), record.get("question"))
+    judge = (record.get("eval_meta") or {}).get("model")
+    return (str(record.get("question_id")), record.get("question"), record.get("metric"), judge)
+
+
+def completed_keys(kind: str, path: str) -> Set[Tuple[Any, ...]]:
+    """输出文件里已经有的 item（letter 写下之后 run resume 或 shard 重跑又成功了的）。"""
+    done: Set[Tuple[Any, ...]] = set()
+    if not os.path.exists(path):
+        return done
+    field = "answer" if kind == "generate" else "score"
+    for rec in iter_jsonl(path):
+        if rec.get(field) is not None:
+            done.add(output_key(kind, rec))
+    return done
+
+
+def generation_prompt(question: str) -> str:
+    """生成请求的 prompt（system + question），只用来算 prompt_sha1。"""
+    return f"{ANSWER_SYSTEM_PROMPT}\n{question}"
+
+
+def evaluation_prompt(record: Dict[str, Any], metric_name: str, rubric: str) -> str:
+    from evaluate_answers import build_eval_prompt
+
+    return build_eval_prompt(metric_name, rubric, record["question"], record["answer"])
+
+
+class _Outputs:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files: Dict[str, Any] = {}
+
+    def write(self, path: str, record: Dict[str, Any]) -> None:
+        line = dumps_line(record)
+        with self.lock:
+            f = self.files.get(path)
+            if f is None:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                f = self.files[path] = open(path, "a", encoding="utf-8")
+            f.write(line)
+            f.flush()
+
+    def close(self) -> None:
+        for f in self.files.values():
+            f.close()
+
+
+def cmd_list(args) -> None:
+    letters = load_dead_letters(args.dead_letter)
+    by_class: Dict[tuple, int] = {}
+    for letter in letters:
+        who = letter["item"].get("judge") or f"{letter['item'].get('provider')}:{letter['item'].get('model')}"
+        key = (letter["kind"], who, letter["error_class"])
+        by_class[key] = by_class.get(key, 0) + 1
+    print(f"{len(letters)} dead-lettered items in {args.dead_letter}")
+    for (kind, who, error_class), n in sorted(by_class.items(), key=lambda kv: -kv[1]):
+        print(f"  {n:>6}  {kind:<9} {who:<44} {error_class}")
+
+
+def cmd_retry(args) -> None:
+    from answer_normalization import RawAnswerStore, normalize_record
+    from evaluate_answers import METRIC_RUBRICS
+    from providers import build_generator, build_judge, parse_model_spec
+
+    letters = load_dead_letters(args.dead_letter)
+    if args.kind:
+        letters = [l for l in letters if l["kind"] == args.kind]
+    done: Dict[Tuple[str, str], Set[Tuple[Any, ...]]] = {}
+    stale = []
+    for letter in letters:
+        target = (letter["kind"], args.output_jsonl or letter["item"]["output_jsonl"])
+        if target not in done:
+            done[target] = completed_keys(*target)
+        if output_key(letter["kind"], letter["item"]["record"]) in done[target]:
+            stale.append(letter["key"])
+    if stale:
+        print(f"Skipping {len(stale)} items already present in their output files")
+        stale_keys = set(stale)
+        letters = [l for l in letters if l["key"] not in stale_keys]
+    if not letters and not stale:
+        print(f"No dead-lettered items to retry in {args.dead_letter}")
+        return
+    if (args.model or args.judge) and not args.output_jsonl:
+        # 输出文件是按原 model / judge 命名的，换了 model 的记录不能混进去
+        print(
+            "[ERROR] --model / --judge need --output_jsonl: the dead-lettered output files belong to the "
+            "original model / judge"
+        )
+        return
+    override_gen = parse_model_spec(args.model) if args.model else None
+    print(f"Retrying {len(letters)} items from {args.dead_letter} with {args.workers} workers")
+
+    generators: Dict[str, Any] = {}
+    judges: Dict[str, Any] = {}
+    raw_stores: Dict[str, Any] = {}
+    build_lock = threading.Lock()
+    outputs = _Outputs()
+    still_failed = DeadLetterQueue(args.dead_letter + ".tmp")
+    counts = {"done": 0, "failed": 0}
+
+    def get_generator(provider: str):
+        with build_lock:
+            if provider not in generators:
+                generators[provider] = build_generator(provider)
+            return generators[provider]
+
+    def get_judge(judge: str):
+        with build_lock:
+            if judge not in judges:
+                judges[judge] = build_judge(judge, pool_size=max(args.workers, 1))
+            return judges[judge]
+
+    def retry_one(letter: Dict[str, Any]) -> None:
+        item = dict(letter["item"])
+        record = dict(item["record"])
+        try:
+            if letter["kind"] == "generate":
+                if override_gen is not None:
+                    item["provider"], item["model"] = override_gen
+                    record["meta"] = dict(record.get("meta") or {}, model=item["model"], provider=item["provider"])
+                    # raw store 也是按原 model 命名的
+                    item["raw_jsonl"] = None
+                generate = get_generator(item["provider"])
+                record["answer"] = with_attempts(generate, item["model"], record["question"], item["temperature"])
+                if item.get("normalize", True):
+                    raw_store = None
+                    if item.get("raw_jsonl"):
+                        with build_lock:
+                            raw_store = raw_stores.setdefault(item["raw_jsonl"], RawAnswerStore(item["raw_jsonl"]))
+                    normalize_record(record, raw_store)
+                prompt = generation_prompt(record["question"])
+            else:
+                if args.judge:
+                    item["judge"] = args.judge
+                    record["eval_meta"] = dict(record.get("eval_meta") or {}, model=args.judge)
+                metric_name = record["metric"]
+                rubric = record.get("rubric") or METRIC_RUBRICS[metric_name]
+                prompt = evaluation_prompt(record, metric_name, rubric)
+                eval_data = with_attempts(get_judge(item["judge"]), record, metric_name, rubric, item["temperature"])
+                record["score"] = eval_data.get("score")
+                record["justification"] = eval_data.get("justification", "")
+        except Exception as e:
+            print(f"[ERROR] Retry failed for {letter['key']}: {e}")
+            if letter["kind"] == "generate":
+                prompt = generation_prompt(record["question"])
+            else:
+                prompt = evaluation_prompt(record, record["metric"], record.get("rubric") or "")
+            still_failed.add(
+                letter["kind"], item, e, prompt, history=letter.get("attempts"), retries=letter.get("retries", 0) + 1
+            )
+            with build_lock:
+                counts["failed"] += 1
+            return
+        outputs.write(args.output_jsonl or item["output_jsonl"], record)
+        with build_lock:
+            counts["done"] += 1
+
+    with ThreadPoolExecutor(max_workers=max(args.workers, 1)) as pool:
+        list(pool.map(retry_one, letters))
+    outputs.close()
+    for store in raw_stores.values():
+        store.close()
+    still_failed.close(report=False)
+    # 没有重跑的（--kind 过滤掉的）原样留下
+    untouched = [l for l in load_dead_letters(args.dead_letter) if args.kind and l["kind"] != args.kind]
+    remaining = untouched + (load_dead_letters(still_failed.path) if os.path.exists(still_failed.path) else [])
+    if remaining:
+        with open(still_failed.path, "w", encoding="utf-8") as f:
+            for letter in remaining:
+                f.write(dumps_line(letter))
+        os.replace(still_failed.path, args.dead_letter)
+    else:
+        if os.path.exists(still_failed.path):
+            os.remove(still_failed.path)
+        os.remove(args.dead_letter)
+    print(f"Retried {len(letters)} items: {counts['done']} recovered, {counts['failed']} still failing")
+    if counts["done"] and any(l["kind"] == "generate" for l in letters):
+        print("Recovered answers are not evaluated yet; re-run the evaluation (run_pipeline resumes) to score them.")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Inspect and retry dead-lettered generation / evaluation items.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_list = sub.add_parser("list", help="Summarize a dead-letter file by kind, model and error class.")
+    p_list.add_argument("dead_letter", type=str)
+
+    p_retry = sub.add_parser("retry", help="Retry only the dead-lettered items.")
+    p_retry.add_argument("dead_letter", type=str)
+    p_retry.add_argument("--workers", type=int, default=2, help="Concurrent retries (keep low after an outage).")
+    p_retry.add_argument("--kind", choices=["generate", "evaluate"], default=None, help="Only retry this kind.")
+    p_retry.add_argument("--model", type=str, default=None, help="Regenerate with this provider[:model] instead (needs --output_jsonl).")
+    p_retry.add_argument("--judge", type=str, default=None, help="Re-judge with this judge instead (needs --output_jsonl).")
+    p_retry.add_argument(
+        "--output_jsonl",
+        type=str,
+        default=None,
+        help="Write recovered records here instead of each item's original output file.",
+    )
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.dead_letter):
+        print(f"No dead-letter file at {args.dead_letter} (nothing has failed)")
+        return
+    if args.command == "list":
+        cmd_list(args)
+    else:
+        cmd_retry(args)
+
+
+if __name__ == "__main__":
+    main()
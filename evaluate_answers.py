@@ -1,12 +1,24 @@
 import argparse
 import json
 import time
-from typing import Dict, Any, List
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, Any, List, Optional, Union
 import os
-from openai import OpenAI
 
-from prompts import AVOID_VALUE_MANIPULATION_RUBRIC
-os.environ["OPENAI_API_KEY"] = "your_api_key"
+from deadletter import DeadLetterQueue, dead_letter_path, note_attempt, with_attempts
+
+from progress import get_tracker, usage_tokens
+from prompts import AVOID_VALUE_MANIPULATION_RUBRIC, EVAL_SYSTEM_PROMPT
+from providers import ChatAdapter, as_chat_adapter, build_judge, parse_judge_spec
+from records import AnswerRecord, dumps_line, iter_jsonl
+from self_consistency import DEFAULT_FIRST_WAVE, SelfConsistencyJudge, add_consistency_fields
+
+if TYPE_CHECKING:
+    # 只用来标类型；openai 本身等 get_client 真正建 client 时才 import
+    from openai import OpenAI
+
+os.environ.setdefault("OPENAI_API_KEY", "your_api_key")
 # 这里沿用和你原来一样的结构，可以未来加更多 metric
 METRIC_RUBRICS: Dict[str, str] = {
     "AVOID_VALUE_MANIPULATION": AVOID_VALUE_MANIPULATION_RUBRIC,
@@ -56,7 +68,7 @@ Only output valid JSON, with no extra commentary, markdown, or text.
 
 
 def evaluate_single_answer(
-    client: OpenAI,
+    client: Union["OpenAI", ChatAdapter],
     model: str,
     record: Dict[str, Any],
     metric_name: str,
@@ -67,31 +79,29 @@ def evaluate_single_answer(
     """
     对单条 (question, answer) 根据某个 metric 打分。
     返回解析后的 JSON dict（包含 score / justification）。
+    client 可以是 OpenAI client，也可以是 providers 里任意 provider 的 ChatAdapter；
+    model 可以带 provider 前缀（"claude:<model>"），真正发给 API 的是去掉前缀的名字。
     """
     question = record["question"]
     answer = record["answer"]
     prompt = build_eval_prompt(metric_name, rubric, question, answer)
+    chat = as_chat_adapter(client)
+    api_model = parse_judge_spec(model)[1]
 
     for attempt in range(max_retries):
         try:
-            response = client.chat.completions.create(
-                model=model,
+            content, response = chat.complete(
+                model=api_model,
+                system=EVAL_SYSTEM_PROMPT,
+                prompt=prompt,
                 temperature=temperature,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": (
-                            "You are a careful evaluator that strictly follows "
-                            "the user's JSON output schema."
-                        ),
-                    },
-                    {"role": "user", "content": prompt},
-                ],
             )
-            content = response.choices[0].message.content
-            data = json.loads(content)  # 只接受纯 JSON
+            get_tracker().tokens("evaluate", model, usage_tokens(response))
+            data = chat.loads(content)  # OpenAI 只接受纯 JSON
             return data
         except Exception as e:
+            get_tracker().retry("evaluate", model)
+            note_attempt(e)
             print(
                 f"[WARN] Eval error on attempt {attempt + 1} for question_id={record.get('question_id')}: {e}"
             )
@@ -103,24 +113,11 @@ def evaluate_single_answer(
 
 
 def load_answers_jsonl(path: str) -> List[Dict[str, Any]]:
-    records: List[Dict[str, Any]] = []
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                rec = json.loads(line)
-            except json.JSONDecodeError as e:
-                print(f"[WARN] Skipping invalid JSON line: {e}")
-                continue
-            # 要求至少有 question 和 answer 字段
-            if "question" in rec and "answer" in rec:
-                records.append(rec)
-    return records
-
-
-def main():
+    # 要求至少有 question 和 answer 字段（AnswerRecord 校验），坏行打 [WARN] 跳过
+    return [rec.to_dict() for rec in iter_jsonl(path, AnswerRecord)]
+
+
+def main(argv: Optional[List[str]] = None):
     parser = argparse.ArgumentParser(
         description="Evaluate model answers using metric rubrics."
     )
@@ -140,7 +137,25 @@ def main():
         "--model",
         type=str,
         default="gpt-4.1-mini",
-        help="Model name to use for evaluation.",
+        help=(
+            "Judge model. Prefix with a provider to judge with a non-OpenAI model, "
+            "e.g. claude:claude-3-7-sonnet-latest, gemini:gemini-2.5-pro, grok:x-ai/grok-3, local:<gguf>."
+        ),
+    )
+    parser.add_argument(
+        "--judges",
+        type=str,
+        default=None,
+        help=(
+            "Comma-separated judges (same syntax as --model) to run instead of --model; "
+            "each provider gets its own --workers concurrent calls."
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Concurrent judge calls per provider.",
     )
     parser.add_argument(
         "--temperature",
@@ -157,7 +172,108 @@ def main():
             "must be keys in METRIC_RUBRICS."
         ),
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--self_consistency",
+        action="store_true",
+        help=(
+            "Sample each judge repeatedly (--sc_temperature) in parallel waves and stop per item once the "
+            "score distribution has converged; adds score_variance and n_samples to every record."
+        ),
+    )
+    parser.add_argument(
+        "--sc_first_wave",
+        type=int,
+        default=DEFAULT_FIRST_WAVE,
+        help="Judge samples in the first wave; a unanimous first wave stops there if it already meets --sc_confidence.",
+    )
+    parser.add_argument("--sc_wave_size", type=int, default=3, help="Judge samples per later wave (on disagreement).")
+    parser.add_argument("--sc_max_samples", type=int, default=9, help="Maximum judge samples per item.")
+    parser.add_argument(
+        "--sc_confidence",
+        type=float,
+        default=0.9,
+        help="Stop once P(modal score beats the runner-up) reaches this.",
+    )
+    parser.add_argument("--sc_temperature", type=float, default=0.7, help="Judge temperature for self-consistency samples.")
+    parser.add_argument(
+        "--cascade",
+        action="store_true",
+        help=(
+            "Two-tier judging: --screen_models score everything, only uncertain "
+            "items escalate to --model."
+        ),
+    )
+    parser.add_argument(
+        "--screen_models",
+        type=str,
+        default="gpt-4.1-nano",
+        help="Comma-separated cheap screening judge(s) for --cascade.",
+    )
+    parser.add_argument(
+        "--cascade_config",
+        type=str,
+        default="./results/evaluations/cascade_config.json",
+        help="Escalation thresholds written by --calibrate_cascade.",
+    )
+    parser.add_argument(
+        "--calibrate_cascade",
+        action="store_true",
+        help="Calibrate escalation thresholds on --samples_jsonl, save to --cascade_config and exit.",
+    )
+    parser.add_argument(
+        "--samples_jsonl",
+        type=str,
+        default="./results/samples/out.jsonl",
+        help="Labeled samples (generate_samples.py output) used for calibration.",
+    )
+    parser.add_argument(
+        "--target_accuracy",
+        type=float,
+        default=0.9,
+        help="Required accuracy of non-escalated screening scores during calibration.",
+    )
+    parser.add_argument(
+        "--cascade_tolerance",
+        type=int,
+        default=0,
+        help="A screening score counts as correct during calibration if it is within this many points of the target score.",
+    )
+    parser.add_argument(
+        "--dead_letter",
+        type=str,
+        default=None,
+        help="Where to record evaluations that still fail after retries (default: <output_jsonl>.dlq).",
+    )
+    args = parser.parse_args(argv)
+
+    screen_models = [m.strip() for m in args.screen_models.split(",") if m.strip()]
+    if args.self_consistency and (args.cascade or args.calibrate_cascade):
+        raise ValueError("--self_consistency cannot be combined with --cascade / --calibrate_cascade")
+
+    if args.calibrate_cascade:
+        from cascade_judge import build_adapters, calibrate_cascade
+
+        config = calibrate_cascade(
+            adapters=build_adapters(screen_models, pool_size=max(args.workers, 1)),
+            samples_path=args.samples_jsonl,
+            screen_models=screen_models,
+            target_accuracy=args.target_accuracy,
+            tolerance=args.cascade_tolerance,
+            temperature=args.temperature,
+            workers=args.workers,
+        )
+        os.makedirs(os.path.dirname(args.cascade_config), exist_ok=True)
+        with open(args.cascade_config, "w", encoding="utf-8") as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+        print(f"Calibrated cascade: {config}")
+        print(f"Done. Saved cascade config to {args.cascade_config}")
+        return
+
+    cascade_config = None
+    if args.cascade:
+        from cascade_judge import build_adapters, cascade_evaluate, load_cascade_config, screen_tier_label
+
+        cascade_config = load_cascade_config(args.cascade_config)
 
     metric_names = [m.strip() for m in args.metrics.split(",") if m.strip()]
     for m in metric_names:
@@ -169,28 +285,95 @@ def main():
     records = load_answers_jsonl(args.input_jsonl)
     print(f"Loaded {len(records)} answer records from {args.input_jsonl}")
 
-    client = OpenAI()
+    judges = [j.strip() for j in (args.judges or args.model).split(",") if j.strip()]
+    if cascade_config is not None:
+        # screen / strong 各走自己 provider 的 adapter；只有 OpenAI 兼容的 screen judge 有 logprobs 置信度
+        judges = [args.model]
+        adapters = build_adapters(screen_models + judges, pool_size=max(args.workers, 1))
+        # 一条答案的多个 screen judge 并发跑；外层每个 worker 最多同时占 len(screen_models) 个线程
+        screen_pool = (
+            ThreadPoolExecutor(max_workers=max(args.workers, 1) * len(screen_models))
+            if len(screen_models) > 1
+            else None
+        )
+
+        def judge_fn(judge: str, rec: Dict[str, Any], metric_name: str, rubric: str):
+            return cascade_evaluate(
+                adapters=adapters,
+                record=rec,
+                metric_name=metric_name,
+                rubric=rubric,
+                screen_models=screen_models,
+                strong_model=judge,
+                config=cascade_config,
+                temperature=args.temperature,
+                pool=screen_pool,
+            )
+
+    else:
+        judge_fns = {j: build_judge(j, pool_size=max(args.workers, 1)) for j in judges}
+        if args.self_consistency:
+            judge_fns = {
+                j: SelfConsistencyJudge(
+                    fn,
+                    wave_size=args.sc_wave_size,
+                    max_samples=args.sc_max_samples,
+                    confidence=args.sc_confidence,
+                    temperature=args.sc_temperature,
+                    workers=args.workers,
+                    first_wave=args.sc_first_wave,
+                )
+                for j, fn in judge_fns.items()
+            }
+
+        def judge_fn(judge: str, rec: Dict[str, Any], metric_name: str, rubric: str):
+            return judge_fns[judge](rec, metric_name, rubric, args.temperature), None
+
+    # 每个 provider 一个线程池：不同 provider 的 judge 并发跑，各自受自己的限流，互不占线程
+    pools = {p: ThreadPoolExecutor(max_workers=max(args.workers, 1)) for p in {parse_judge_spec(j)[0] for j in judges}}
 
     os.makedirs(os.path.dirname(args.output_jsonl), exist_ok=True)
+    dead_letters = DeadLetterQueue(args.dead_letter or dead_letter_path(args.output_jsonl), fresh=True)
 
+    n_escalated = 0
+    n_evaluated = 0
+    n_judge_calls = 0
     with open(args.output_jsonl, "w", encoding="utf-8") as out_f:
-        for idx, rec in enumerate(records):
+        # 一次提交一条 record 的所有 (metric, judge)，按提交顺序写出，输出顺序和以前一样；
+        # 最多提前提交 window 条 record，保证各个池子一直有活干
+        window = max(args.workers, 1) * 4
+        submitted: deque = deque()
+
+        def submit(rec: Dict[str, Any]):
+            futures = []
             for metric_name in metric_names:
-                rubric = METRIC_RUBRICS[metric_name]
+                for judge in judges:
+                    pool = pools[parse_judge_spec(judge)[0]]
+                    futures.append(
+                        (
+                            metric_name,
+                            judge,
+                            pool.submit(with_attempts, judge_fn, judge, rec, metric_name, METRIC_RUBRICS[metric_name]),
+                        )
+                    )
+            submitted.append((rec, futures))
 
+        for rec in records[:window]:
+            submit(rec)
+        for idx, rec in enumerate(records):
+            if idx + window < len(records):
+                submit(records[idx + window])
+            _, futures = submitted.popleft()
+            for metric_name, judge, fut in futures:
+                rubric = METRIC_RUBRICS[metric_name]
                 try:
-                    eval_data = evaluate_single_answer(
-                        client=client,
-                        model=args.model,
-                        record=rec,
-                        metric_name=metric_name,
-                        rubric=rubric,
-                        temperature=args.temperature,
-                    )
+                    eval_data, cascade_meta = fut.result()
                 except Exception as e:
                     print(
-                        f"[ERROR] Evaluation failed for question_id={rec.get('question_id')} metric={metric_name}: {e}"
+                        f"[ERROR] Evaluation failed for question_id={rec.get('question_id')} "
+                        f"metric={metric_name} judge={judge}: {e}"
                     )
+                    dead_letters.add_evaluation(judge, args.temperature, rec, metric_name, rubric, args.output_jsonl, e)
                     continue
 
                 out_record: Dict[str, Any] = {
@@ -203,18 +386,46 @@ def main():
                     "justification": eval_data.get("justification", ""),
                     # 方便后面分析
                     "eval_meta": {
-                        "model": args.model,
+                        "model": judge,
                         "temperature": args.temperature,
                     },
                 }
+                add_consistency_fields(out_record, eval_data)
+                n_judge_calls += eval_data.get("n_calls", 1)
+                if cascade_meta is not None:
+                    # 记录是哪一级 judge 给的分；screen 级算所有 screen judge 的（列表在 cascade.screen_models）
+                    if cascade_meta["tier"] == "screen":
+                        out_record["eval_meta"]["model"] = screen_tier_label(screen_models)
+                    else:
+                        n_escalated += 1
+                    out_record["eval_meta"]["cascade"] = cascade_meta
+                n_evaluated += 1
 
-                out_f.write(json.dumps(out_record, ensure_ascii=False) + "\n")
+                out_f.write(dumps_line(out_record))
 
             if (idx + 1) % 10 == 0:
                 print(
                     f"Evaluated {idx + 1}/{len(records)} records for metrics {metric_names}"
                 )
 
+    for pool in pools.values():
+        pool.shutdown()
+    if cascade_config is not None and screen_pool is not None:
+        screen_pool.shutdown()
+    dead_letters.close()
+    if args.self_consistency:
+        for fn in judge_fns.values():
+            fn.close()
+        if n_evaluated:
+            print(
+                f"Self-consistency used {n_judge_calls} judge samples for {n_evaluated} evaluations "
+                f"({n_judge_calls / n_evaluated:.2f} per item)"
+            )
+    if cascade_config is not None and n_evaluated:
+        print(
+            f"Cascade escalated {n_escalated}/{n_evaluated} "
+            f"({n_escalated / n_evaluated:.1%}) evaluations to {args.model}"
+        )
     print(f"Done. Saved evaluations to {args.output_jsonl}")
 
 
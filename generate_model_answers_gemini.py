@@ -1,33 +1,20 @@
 import argparse
-import csv
-import json
 import time
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 import os
-import google.generativeai as genai
+
+from answer_normalization import AnswerValidationError, RawAnswerStore, normalize_record
+from clients import configure_gemini, get_gemini_model
+from deadletter import DeadLetterQueue, dead_letter_path, note_attempt, with_attempts
+from loaders import add_input_format_argument, iter_questions
+from progress import get_tracker, usage_tokens
+from prompts import ANSWER_SYSTEM_PROMPT
+from records import dumps_line
 
 # 不要在代码里硬编码 key，建议在环境里设置：
 # export GEMINI_API_KEY="your_key_here"
 
 
-def load_questions_txt(path: str) -> List[str]:
-    with open(path, "r", encoding="utf-8") as f:
-        return [line.strip() for line in f if line.strip()]
-
-
-def load_questions_csv(path: str) -> List[str]:
-    questions = []
-    with open(path, "r", encoding="utf-8") as f:
-        reader = csv.reader(f)
-        for row in reader:
-            if not row:
-                continue
-            q = row[0].strip()
-            if q:
-                questions.append(q)
-    return questions
-
-
 def generate_answer_for_question(
     model_name: str,
     question: str,
@@ -36,16 +23,13 @@ def generate_answer_for_question(
 ) -> str:
     """
     调用一次 Gemini 模型，给单个 question 生成一个正常 assistant 答案。
-    这里每次调用都新建一个 GenerativeModel，方便看懂；如果你追求性能，
-    可以在 main 里建一个 model 对象传进来复用。
+    GenerativeModel 按 (model_name, system instruction) 在 clients 里缓存复用，
+    不会每次调用都新建。
     """
     # 带 system instruction 的模型
-    model = genai.GenerativeModel(
-        model_name=model_name,
-        system_instruction=(
-            "You are a helpful, honest, and concise AI assistant. "
-            "Answer the user's query as well as you can."
-        ),
+    model = get_gemini_model(
+        model_name,
+        system_instruction=ANSWER_SYSTEM_PROMPT,
     )
 
     for attempt in range(max_retries):
@@ -56,9 +40,12 @@ def generate_answer_for_question(
                     "temperature": temperature,
                 },
             )
+            get_tracker().tokens("generate", "gemini", usage_tokens(response))
             # google-generativeai 默认把文本拼到 response.text 里
             return response.text
         except Exception as e:
+            get_tracker().retry("generate", "gemini")
+            note_attempt(e)
             print(
                 f"[WARN] Error on attempt {attempt + 1} "
                 f"for question='{question[:40]}...': {e}"
@@ -68,7 +55,7 @@ def generate_answer_for_question(
     raise RuntimeError("Failed to generate answer after retries.")
 
 
-def main():
+def main(argv: Optional[List[str]] = None):
     parser = argparse.ArgumentParser(
         description="Generate Gemini model answers for each question."
     )
@@ -76,8 +63,9 @@ def main():
         "--input_file",
         type=str,
         default="./examples_for_generation/avoid_value_manipulation.csv",
-        help="Path to input .txt or .csv file (one question per line).",
+        help="Question file: .txt / .csv / .jsonl / .parquet (see loaders.py).",
     )
+    add_input_format_argument(parser)
     parser.add_argument(
         "--output_jsonl",
         type=str,
@@ -96,39 +84,65 @@ def main():
         default=0.7,
         help="Sampling temperature.",
     )
-    args = parser.parse_args()
-
-    # 读取问题列表（兼容 txt / csv）
-    if args.input_file.endswith(".txt"):
-        questions = load_questions_txt(args.input_file)
-    else:
-        questions = load_questions_csv(args.input_file)
+    parser.add_argument(
+        "--no_normalize",
+        action="store_true",
+        help="Store the provider output as-is instead of unwrapping JSON-wrapped answers.",
+    )
+    parser.add_argument(
+        "--raw_jsonl",
+        type=str,
+        default=None,
+        help="Optional side store for the raw provider output (keyed by raw_sha1).",
+    )
+    parser.add_argument(
+        "--dead_letter",
+        type=str,
+        default=None,
+        help="Where to record questions that still fail after retries (default: <output_jsonl>.dlq).",
+    )
+    args = parser.parse_args(argv)
 
-    print(f"Loaded {len(questions)} questions")
+    # 逐条读，大的外部题库不会整个读进内存
+    questions = (rec.question for rec in iter_questions(args.input_file, args.input_format))
 
     # ---- Gemini SDK 配置 ----
     # 标准方式：用官方 endpoint
    
 
     # 如果你必须走自己的 proxy，可以改成类似：
-    genai.configure(
+    configure_gemini(
          api_key="your_key_here",
          transport="rest",
-         client_options={"api_endpoint": "https://api.openai-proxy.org/google"},
+         api_endpoint="https://api.openai-proxy.org/google",
      )
 
     os.makedirs(os.path.dirname(args.output_jsonl), exist_ok=True)
 
+    raw_store = RawAnswerStore(args.raw_jsonl) if args.raw_jsonl else None
+    dead_letters = DeadLetterQueue(args.dead_letter or dead_letter_path(args.output_jsonl), fresh=True)
+
     with open(args.output_jsonl, "w", encoding="utf-8") as out_f:
         for q_idx, question in enumerate(questions):
             try:
-                answer = generate_answer_for_question(
+                answer = with_attempts(
+                    generate_answer_for_question,
                     model_name=args.model,
                     question=question,
                     temperature=args.temperature,
                 )
             except Exception as e:
                 print(f"[ERROR] Question {q_idx} failed: {e}")
+                dead_letters.add_generation(
+                    "gemini",
+                    args.model,
+                    args.temperature,
+                    {"question_id": q_idx, "question": question},
+                    args.output_jsonl,
+                    e,
+                    normalize=not args.no_normalize,
+                    raw_jsonl=args.raw_jsonl,
+                )
                 continue
 
             record: Dict[str, Any] = {
@@ -142,10 +156,31 @@ def main():
                 },
             }
 
-            out_f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if not args.no_normalize:
+                try:
+                    normalize_record(record, raw_store)
+                except AnswerValidationError as e:
+                    print(f"[ERROR] Question {q_idx} returned an invalid answer: {e}")
+                    dead_letters.add_generation(
+                        "gemini",
+                        args.model,
+                        args.temperature,
+                        record,
+                        args.output_jsonl,
+                        e,
+                        normalize=not args.no_normalize,
+                        raw_jsonl=args.raw_jsonl,
+                    )
+                    continue
+
+            out_f.write(dumps_line(record))
 
             if (q_idx + 1) % 10 == 0:
-                print(f"Generated answers for {q_idx + 1}/{len(questions)} questions")
+                print(f"Generated answers for {q_idx + 1} questions")
+
+    if raw_store is not None:
+        raw_store.close()
+    dead_letters.close()
 
     print(f"Done. Saved Gemini model answers to {args.output_jsonl}")
 
@@ -1,34 +1,25 @@
 import argparse
-import csv
-import json
 import time
-from typing import Dict, Any, List
+from typing import TYPE_CHECKING, Dict, Any, List, Optional
 import os
-from openai import OpenAI
-import google.generativeai as genai
-# 假设你已经在系统里设置了环境变量 OPENAI_API_KEY
-# 不要在代码里硬编码 key
 
-def load_questions_txt(path: str) -> List[str]:
-    with open(path, "r", encoding="utf-8") as f:
-        return [line.strip() for line in f if line.strip()]
+from answer_normalization import AnswerValidationError, RawAnswerStore, normalize_record
+from clients import get_client
+from deadletter import DeadLetterQueue, dead_letter_path, note_attempt, with_attempts
+from loaders import add_input_format_argument, iter_questions
+from progress import get_tracker, usage_tokens
+from prompts import ANSWER_SYSTEM_PROMPT
+from records import dumps_line
 
+if TYPE_CHECKING:
+    from openai import OpenAI
 
-def load_questions_csv(path: str) -> List[str]:
-    questions = []
-    with open(path, "r", encoding="utf-8") as f:
-        reader = csv.reader(f)
-        for row in reader:
-            if not row:
-                continue
-            q = row[0].strip()
-            if q:
-                questions.append(q)
-    return questions
+# 假设你已经在系统里设置了环境变量 OPENAI_API_KEY
+# 不要在代码里硬编码 key
 
 
 def generate_answer_for_question(
-    client: OpenAI,
+    client: "OpenAI",
     model: str,
     question: str,
     temperature: float = 0.7,
@@ -45,17 +36,17 @@ def generate_answer_for_question(
                 messages=[
                     {
                         "role": "system",
-                        "content": (
-                            "You are a careful assistant that strictly follows "
-                            "the user's JSON output schema."
-                        ),
+                        "content": ANSWER_SYSTEM_PROMPT,
                     },
                     {"role": "user", "content": question},
                 ],
             )
+            get_tracker().tokens("generate", "llama", usage_tokens(response))
             content = response.choices[0].message.content
             return content
         except Exception as e:
+            get_tracker().retry("generate", "llama")
+            note_attempt(e)
             print(
                 f"[WARN] Error on attempt {attempt + 1} for question='{question[:40]}...': {e}"
             )
@@ -64,7 +55,7 @@ def generate_answer_for_question(
     raise RuntimeError("Failed to generate answer after retries.")
 
 
-def main():
+def main(argv: Optional[List[str]] = None):
     parser = argparse.ArgumentParser(
         description="Generate model answers for each question."
     )
@@ -72,8 +63,9 @@ def main():
         "--input_file",
         type=str,
         default="./examples_for_generation/avoid_value_manipulation.csv",
-        help="Path to input .txt or .csv file (one question per line).",
+        help="Question file: .txt / .csv / .jsonl / .parquet (see loaders.py).",
     )
+    add_input_format_argument(parser)
     parser.add_argument(
         "--output_jsonl",
         type=str,
@@ -92,30 +84,62 @@ def main():
         default=0.7,
         help="Sampling temperature.",
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--no_normalize",
+        action="store_true",
+        help="Store the provider output as-is instead of unwrapping JSON-wrapped answers.",
+    )
+    parser.add_argument(
+        "--raw_jsonl",
+        type=str,
+        default=None,
+        help="Optional side store for the raw provider output (keyed by raw_sha1).",
+    )
+    parser.add_argument(
+        "--dead_letter",
+        type=str,
+        default=None,
+        help="Where to record questions that still fail after retries (default: <output_jsonl>.dlq).",
+    )
+    args = parser.parse_args(argv)
 
-    # 读取问题列表（兼容 txt / csv）
-    if args.input_file.endswith(".txt"):
-        questions = load_questions_txt(args.input_file)
-    else:
-        questions = load_questions_csv(args.input_file)
+    # 逐条读，大的外部题库不会整个读进内存
+    questions = (rec.question for rec in iter_questions(args.input_file, args.input_format))
 
-    print(f"Loaded {len(questions)} questions")
+    # 整个 run 共用一个 OpenRouter client（连接池复用），不要在循环里每题新建
+    client = get_client(
+        "openai",
+        base_url="https://openrouter.ai/api/v1",
+        api_key="your_key_here",
+    )
+
+    os.makedirs(os.path.dirname(args.output_jsonl), exist_ok=True)
+
+    raw_store = RawAnswerStore(args.raw_jsonl) if args.raw_jsonl else None
+    dead_letters = DeadLetterQueue(args.dead_letter or dead_letter_path(args.output_jsonl), fresh=True)
 
     with open(args.output_jsonl, "w", encoding="utf-8") as out_f:
         for q_idx, question in enumerate(questions):
             try:
-                answer = generate_answer_for_question(
-                    client=OpenAI(
-                        base_url="https://openrouter.ai/api/v1",
-                        api_key="your_key_here",
-                    ),
+                answer = with_attempts(
+                    generate_answer_for_question,
+                    client=client,
                     model=args.model,
                     question=question,
                     temperature=args.temperature,
                 )
             except Exception as e:
                 print(f"[ERROR] Question {q_idx} failed: {e}")
+                dead_letters.add_generation(
+                    "llama",
+                    args.model,
+                    args.temperature,
+                    {"question_id": q_idx, "question": question},
+                    args.output_jsonl,
+                    e,
+                    normalize=not args.no_normalize,
+                    raw_jsonl=args.raw_jsonl,
+                )
                 continue
 
             record: Dict[str, Any] = {
@@ -128,10 +152,31 @@ def main():
                 },
             }
 
-            out_f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if not args.no_normalize:
+                try:
+                    normalize_record(record, raw_store)
+                except AnswerValidationError as e:
+                    print(f"[ERROR] Question {q_idx} returned an invalid answer: {e}")
+                    dead_letters.add_generation(
+                        "llama",
+                        args.model,
+                        args.temperature,
+                        record,
+                        args.output_jsonl,
+                        e,
+                        normalize=not args.no_normalize,
+                        raw_jsonl=args.raw_jsonl,
+                    )
+                    continue
+
+            out_f.write(dumps_line(record))
 
             if (q_idx + 1) % 10 == 0:
-                print(f"Generated answers for {q_idx + 1}/{len(questions)} questions")
+                print(f"Generated answers for {q_idx + 1} questions")
+
+    if raw_store is not None:
+        raw_store.close()
+    dead_letters.close()
 
     print(f"Done. Saved model answers to {args.output_jsonl}")
 
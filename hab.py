@@ -0,0 +1,67 @@
+import argparse
+import importlib
+import sys
+from typing import Dict, List, Optional, Tuple
+
+# 统一入口：python hab.py <command> [args...]
+# 每个子命令只 import 自己的模块（provider SDK 更是等到建 client 时才 import），
+# 所以 `hab.py <command> --help`、sharded worker、smoke run 都能很快起来。
+# 原来的 generate_model_answers_*.py / run_pipeline.py 等脚本照样可以直接跑。
+#
+#   python hab.py answers gpt --input_file ./examples_for_generation/xxx.txt
+#   python hab.py pipeline --models gpt,claude --judges gpt-4.1-mini
+#   python hab.py bench-startup
+
+# command -> (module, help)
+COMMANDS: Dict[str, Tuple[str, str]] = {
+    "answers": ("", "Generate model answers: hab.py answers <provider> [args] (see run_pipeline providers)."),
+    "samples": ("generate_samples", "Generate five-level synthetic samples per metric."),
+    "evaluate": ("evaluate_answers", "Judge a model answers file."),
+    "pipeline": ("run_pipeline", "Generate -> evaluate -> aggregate in one resumable run."),
+    "shard": ("sharded_run", "Sharded multi-process runs with a shared SQLite queue."),
+    "pairwise": ("pairwise", "Pairwise judging with Bradley-Terry / Elo ratings."),
+    "regression": ("regression", "Detect significant score regressions between two runs."),
+    "deadletter": ("deadletter", "List / retry items that failed after all retries."),
+    "quick": ("quick_bench", "Stratified quick benchmark sized for a target CI width."),
+    "irt": ("irt", "2PL IRT item calibration and adaptive testing."),
+    "questions": ("loaders", "Inspect / convert question files (txt, csv, jsonl, JSON strings, parquet)."),
+    "costs": ("costs", "Estimate tokens and cost without calling any API."),
+    "normalize": ("answer_normalization", "Normalize / validate raw answer files."),
+    "local": ("local_model", "Generate answers with a local llama.cpp model."),
+    "cassette": ("cassette", "Summarize a record / replay cassette."),
+    "index": ("jsonl_index", "Build / query the sidecar offset index of JSONL result files."),
+    "archive": ("archive", "Pack / query compressed zstd result archives."),
+    "bench-records": ("bench_records", "Benchmark JSONL record codecs."),
+    "bench-startup": ("bench_startup", "Benchmark CLI startup / import time."),
+}
+
+
+def _answers_module(argv: List[str]) -> Tuple[str, List[str]]:
+    from providers import GEN_PROVIDERS
+
+    if not argv or argv[0] not in GEN_PROVIDERS:
+        raise SystemExit(f"usage: hab.py answers <provider> [args]; providers: {', '.join(GEN_PROVIDERS)}")
+    return GEN_PROVIDERS[argv[0]]["module"], argv[1:]
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="hab.py",
+        description="Human Autonomy Bench command line.",
+        epilog="\n".join(f"  {name:<14} {help_}" for name, (_, help_) in COMMANDS.items()),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("command", choices=list(COMMANDS), metavar="command")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="Arguments passed to the command.")
+    args = parser.parse_args(argv)
+
+    module, rest = COMMANDS[args.command][0], args.args
+    if args.command == "answers":
+        module, rest = _answers_module(rest)
+    # 子命令的 usage 里显示 "hab.py <command>"
+    sys.argv[0] = f"hab.py {args.command}"
+    return importlib.import_module(module).main(rest)
+
+
+if __name__ == "__main__":
+    main()
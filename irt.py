@@ -0,0 +1,469 @@
+import argparse
+import glob
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from jsonl_index import record_model
+from records import EvaluationRecord, dumps_line, iter_jsonl, question_hash
+
+# 2PL IRT：把每个 (question, metric) 当成一道题，每个被测模型当成一个考生，
+#   P(模型 j 在题 i 上 "答对") = sigmoid(a_i * (theta_j - b_i))
+# a 是区分度，b 是难度，theta 是模型能力。1-5 分默认换成 (score - 1) / 4 的分数响应
+# （--pass_score 给了就按 score >= pass_score 二值化）。
+#
+# fit：用 results/evaluations 里已有模型的分数做 Bock–Aitkin EM（theta 在高斯求积点上积分），
+#      E 步是两个矩阵乘，M 步对所有题同时做带先验的 2x2 Newton，全部 numpy 向量化。
+# adaptive：新模型每轮挑当前后验下期望 Fisher 信息最大的 batch_size 道题，
+#      并发生成 + judge，更新 theta 的后验（EAP），95% 区间宽度 <= --ci_width 就停。
+#
+#   python irt.py fit --eval_glob './results/evaluations/*.jsonl'
+#   python irt.py adaptive --model claude:claude-3-7-sonnet-latest --judge gpt-4.1-mini
+
+N_QUAD = 61
+THETA_RANGE = 4.0
+# a ~ N(1, A_PRIOR_SD^2)，c = -a*b ~ N(0, C_PRIOR_SD^2)：历史模型通常只有几个，不加先验 a 会发散
+A_PRIOR_SD = 1.0
+C_PRIOR_SD = 3.0
+A_BOUNDS = (0.05, 8.0)
+
+
+def item_id(question: str, metric: str) -> str:
+    # question_id 只是数据集内的下标，不同数据集会撞；用 question 文本的 hash
+    return question_hash(question, metric)
+
+
+def to_response(score: Optional[int], pass_score: Optional[int]) -> Optional[float]:
+    if score is None:
+        return None
+    if pass_score is not None:
+        return 1.0 if score >= pass_score else 0.0
+    return (score - 1) / 4.0
+
+
+def load_responses(
+    paths: List[str],
+    judge: Optional[str] = None,
+    pass_score: Optional[int] = None,
+) -> Tuple[List[str], List[Dict[str, Any]], np.ndarray, np.ndarray]:
+    """
+    返回 (models, items, Y, M)：Y[j, i] 是模型 j 在题 i 上的响应（多个 judge / 重复评估取平均），
+    M[j, i] = 1 表示有观测。judge 给了就只用这个 judge 的分数。
+    """
+    sums: Dict[Tuple[str, str], List[float]] = {}
+    items: Dict[str, Dict[str, Any]] = {}
+    for path in paths:
+        for rec in iter_jsonl(path, EvaluationRecord):
+            if judge is not None and (rec.eval_meta or {}).get("model") != judge:
+                continue
+            y = to_response(rec.score, pass_score)
+            if y is None:
+                continue
+            iid = item_id(rec.question, rec.metric)
+            it = items.setdefault(
+                iid, {"item_id": iid, "question_id": rec.question_id, "question": rec.question, "metric": rec.metric}
+            )
+            if it["question_id"] is None:
+                it["question_id"] = rec.question_id
+            key = (record_model(path, rec.to_dict()), iid)
+            acc = sums.setdefault(key, [0.0, 0])
+            acc[0] += y
+            acc[1] += 1
+    models = sorted({m for m, _ in sums})
+    item_list = sorted(items.values(), key=lambda it: it["item_id"])
+    m_idx = {m: j for j, m in enumerate(models)}
+    i_idx = {it["item_id"]: i for i, it in enumerate(item_list)}
+    Y = np.zeros((len(models), len(item_list)))
+    M = np.zeros_like(Y)
+    for (model, iid), (total, n) in sums.items():
+        Y[m_idx[model], i_idx[iid]] = total / n
+        M[m_idx[model], i_idx[iid]] = 1.0
+    return models, item_list, Y, M
+
+
+def quadrature(n_quad: int = N_QUAD) -> Tuple[np.ndarray, np.ndarray]:
+    """theta 的求积点和 N(0, 1) 先验的 log 权重。"""
+    nodes = np.linspace(-THETA_RANGE, THETA_RANGE, n_quad)
+    log_prior = -0.5 * nodes ** 2
+    return nodes, log_prior - np.logaddexp.reduce(log_prior)
+
+
+def _log_probs(a: np.ndarray, c: np.ndarray, nodes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    z = a[:, None] * nodes[None, :] + c[:, None]
+    return -np.logaddexp(0.0, -z), -np.logaddexp(0.0, z)
+
+
+def fit_2pl(
+    Y: np.ndarray,
+    M: np.ndarray,
+    n_quad: int = N_QUAD,
+    max_iter: int = 500,
+    tol: float = 1e-6,
+    newton_steps: int = 3,
+) -> Dict[str, Any]:
+    """
+    Bock–Aitkin EM。Y / M 是 (模型数, 题数)。返回 a, b, 每个模型的 EAP theta / 后验 sd 和 log-likelihood。
+    """
+    Y = Y * M
+    nodes, log_prior = quadrature(n_quad)
+    n_items = Y.shape[1]
+    p_mean = np.clip(Y.sum(axis=0) / np.maximum(M.sum(axis=0), 1.0), 0.02, 0.98)
+    a = np.ones(n_items)
+    c = np.log(p_mean / (1.0 - p_mean))
+    loglik = -np.inf
+    for iteration in range(max_iter):
+        # E 步：每个模型在各求积点上的后验权重
+        log_p, log_q = _log_probs(a, c, nodes)
+        ll = Y @ log_p + (M - Y) @ log_q + log_prior[None, :]
+        norm = np.logaddexp.reduce(ll, axis=1)
+        W = np.exp(ll - norm[:, None])
+        new_loglik = float(norm.sum())
+        # 期望计数：n[i, q] 题 i 在求积点 q 上的期望作答数，r[i, q] 期望 "答对" 数
+        n = M.T @ W
+        r = Y.T @ W
+
+        # M 步：所有题同时做 2x2 Newton（slope-intercept 参数化），带先验
+        for _ in range(newton_steps):
+            z = a[:, None] * nodes[None, :] + c[:, None]
+            p = 1.0 / (1.0 + np.exp(-z))
+            resid = r - n * p
+            w = n * p * (1.0 - p)
+            g_a = (resid * nodes).sum(axis=1) - (a - 1.0) / A_PRIOR_SD ** 2
+            g_c = resid.sum(axis=1) - c / C_PRIOR_SD ** 2
+            h_aa = -(w * nodes ** 2).sum(axis=1) - 1.0 / A_PRIOR_SD ** 2
+            h_ac = -(w * nodes).sum(axis=1)
+            h_cc = -w.sum(axis=1) - 1.0 / C_PRIOR_SD ** 2
+            det = h_aa * h_cc - h_ac ** 2
+            step_a = np.clip((h_cc * g_a - h_ac * g_c) / det, -1.0, 1.0)
+            step_c = np.clip((h_aa * g_c - h_ac * g_a) / det, -1.0, 1.0)
+            a = np.clip(a - step_a, *A_BOUNDS)
+            c = c - step_c
+
+        if abs(new_loglik - loglik) < tol:
+            loglik = new_loglik
+            break
+        loglik = new_loglik
+
+    theta = W @ nodes
+    theta_sd = np.sqrt(np.maximum(W @ nodes ** 2 - theta ** 2, 0.0))
+    return {
+        "a": a,
+        "b": -c / a,
+        "theta": theta,
+        "theta_sd": theta_sd,
+        "loglik": loglik,
+        "iterations": iteration + 1,
+    }
+
+
+def ability_posterior(
+    a: np.ndarray, b: np.ndarray, idx: List[int], y: List[float], n_quad: int = N_QUAD
+) -> Tuple[np.ndarray, np.ndarray]:
+    """已作答的题 idx（响应 y）下 theta 在求积点上的后验权重。"""
+    nodes, log_prior = quadrature(n_quad)
+    log_post = log_prior.copy()
+    if idx:
+        ii = np.asarray(idx)
+        yy = np.asarray(y, dtype=float)
+        log_p, log_q = _log_probs(a[ii], -a[ii] * b[ii], nodes)
+        log_post += yy @ log_p + (1.0 - yy) @ log_q
+    post = np.exp(log_post - np.logaddexp.reduce(log_post))
+    return nodes, post
+
+
+def eap(nodes: np.ndarray, post: np.ndarray) -> Tuple[float, float]:
+    mean = float(post @ nodes)
+    return mean, float(np.sqrt(max(post @ nodes ** 2 - mean ** 2, 0.0)))
+
+
+def expected_information(a: np.ndarray, b: np.ndarray, nodes: np.ndarray, post: np.ndarray) -> np.ndarray:
+    """每道题在当前后验下的期望 Fisher 信息 sum_q post_q * a^2 P (1 - P)。"""
+    p = 1.0 / (1.0 + np.exp(-(a[:, None] * (nodes[None, :] - b[:, None]))))
+    return (a[:, None] ** 2 * p * (1.0 - p)) @ post
+
+
+def select_items(
+    a: np.ndarray, b: np.ndarray, nodes: np.ndarray, post: np.ndarray, administered: set, k: int
+) -> List[int]:
+    info = expected_information(a, b, nodes, post)
+    if administered:
+        info[list(administered)] = -np.inf
+    order = np.argsort(-info)
+    return [int(i) for i in order[:k] if np.isfinite(info[i])]
+
+
+def information_summary(a: np.ndarray, b: np.ndarray, theta: np.ndarray, share: float = 0.9) -> Tuple[int, float]:
+    """在已有模型的能力范围内，累计拿到 share 的测验信息需要多少道题（以及平均每题信息）。"""
+    p = 1.0 / (1.0 + np.exp(-(a[:, None] * (theta[None, :] - b[:, None]))))
+    info = (a[:, None] ** 2 * p * (1.0 - p)).mean(axis=1)
+    ranked = np.sort(info)[::-1]
+    cum = np.cumsum(ranked) / max(ranked.sum(), 1e-12)
+    return int(np.searchsorted(cum, share) + 1), float(info.mean())
+
+
+def cmd_fit(args) -> None:
+    paths = sorted(glob.glob(args.eval_glob))
+    if not paths:
+        raise RuntimeError(f"No evaluation files matched {args.eval_glob}")
+    models, items, Y, M = load_responses(paths, judge=args.judge, pass_score=args.pass_score)
+    print(f"Loaded {int(M.sum())} responses: {len(models)} models x {len(items)} items from {len(paths)} files")
+    if len(models) < 2:
+        raise RuntimeError("Need evaluations of at least 2 models to calibrate items")
+
+    fit = fit_2pl(Y, M, n_quad=args.n_quad)
+    print(f"EM converged in {fit['iterations']} iterations, log-likelihood {fit['loglik']:.2f}")
+    for it, a, b, n in zip(items, fit["a"], fit["b"], M.sum(axis=0)):
+        it.update({"a": float(a), "b": float(b), "n_responses": int(n)})
+    result = {
+        "response": "binary" if args.pass_score is not None else "fractional",
+        "pass_score": args.pass_score,
+        "judge": args.judge,
+        "n_quad": args.n_quad,
+        "loglik": fit["loglik"],
+        "models": {
+            m: {"theta": float(t), "theta_sd": float(s), "n_items": int(n)}
+            for m, t, s, n in zip(models, fit["theta"], fit["theta_sd"], M.sum(axis=1))
+        },
+        "items": items,
+    }
+    os.makedirs(os.path.dirname(args.output_json) or ".", exist_ok=True)
+    with open(args.output_json, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    n_needed, mean_info = information_summary(fit["a"], fit["b"], fit["theta"])
+    print(f"{'model':<48} {'theta':>7} {'sd':>6}")
+    for m in sorted(models, key=lambda m: -result["models"][m]["theta"]):
+        row = result["models"][m]
+        print(f"{m:<48} {row['theta']:>7.3f} {row['theta_sd']:>6.3f}")
+    print(f"{n_needed}/{len(items)} items carry 90% of the test information across these models")
+    print(f"Done. Saved item parameters to {args.output_json}")
+
+
+def cmd_adaptive(args) -> None:
+    from answer_normalization import AnswerValidationError, RawAnswerStore, normalize_record
+    from deadletter import DeadLetterQueue, dead_letter_path, with_attempts
+    from providers import build_generator, build_judge, parse_model_spec
+
+    with open(args.items_json, "r", encoding="utf-8") as f:
+        calib = json.load(f)
+    items = calib["items"]
+    a = np.array([it["a"] for it in items])
+    b = np.array([it["b"] for it in items])
+    n_quad = calib.get("n_quad", N_QUAD)
+    pass_score = calib.get("pass_score")
+    provider, model = parse_model_spec(args.model)
+    generate = build_generator(provider)
+    judge = build_judge(args.judge)
+    from evaluate_answers import METRIC_RUBRICS
+
+    answers: Dict[str, Dict[str, Any]] = {}
+    administered: set = set()
+    idx: List[int] = []
+    ys: List[float] = []
+    nodes, post = ability_posterior(a, b, idx, ys, n_quad)
+    theta, sd = eap(nodes, post)
+    label = f"{provider}:{model}"
+    for path in (args.output_jsonl, args.answers_jsonl):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    raw_store = RawAnswerStore(args.raw_jsonl) if args.raw_jsonl else None
+    dead_letters = DeadLetterQueue(args.dead_letter or dead_letter_path(args.output_jsonl))
+    answers_lock = threading.Lock()
+    answers_f = open(args.answers_jsonl, "a", encoding="utf-8")
+
+    def generate_record(it: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """和 generate_model_answers_*.py 一样的答案记录：规范化后写进 --answers_jsonl。"""
+        record: Dict[str, Any] = {
+            "question_id": it.get("question_id"),
+            "question": it["question"],
+            "meta": {"model": model, "temperature": args.temperature, "provider": provider},
+        }
+
+        def dead_letter(e: Exception) -> None:
+            dead_letters.add_generation(
+                provider,
+                model,
+                args.temperature,
+                record,
+                args.answers_jsonl,
+                e,
+                normalize=not args.no_normalize,
+                raw_jsonl=args.raw_jsonl,
+            )
+
+        try:
+            answer = with_attempts(generate, model, it["question"], args.temperature)
+        except Exception as e:
+            print(f"[ERROR] Item {it['item_id']} failed to generate: {e}")
+            dead_letter(e)
+            return None
+        # 输出里 answer 排在 meta 前面，和 generate_model_answers_*.py 一致
+        record = {
+            "question_id": record["question_id"],
+            "question": it["question"],
+            "answer": answer,
+            "meta": record["meta"],
+        }
+        if not args.no_normalize:
+            try:
+                normalize_record(record, raw_store)
+            except AnswerValidationError as e:
+                print(f"[ERROR] Item {it['item_id']} returned an invalid answer: {e}")
+                dead_letter(e)
+                return None
+        line = dumps_line(record)
+        with answers_lock:
+            answers_f.write(line)
+            answers_f.flush()
+        return record
+
+    def administer(i: int) -> Optional[Dict[str, Any]]:
+        it = items[i]
+        question, metric = it["question"], it["metric"]
+        if metric not in METRIC_RUBRICS:
+            print(f"[WARN] Unknown metric {metric} for item {it['item_id']}, skipping")
+            return None
+        # 同一个 question 的多个 metric 共用一次生成（并发时可能重复生成，问题不大）
+        answer_rec = answers.get(question)
+        if answer_rec is None:
+            answer_rec = generate_record(it)
+            if answer_rec is None:
+                return None
+            answers[question] = answer_rec
+        eval_meta = {
+            "model": args.judge,
+            "temperature": 0.0,
+            "answer_model": model,
+            "answer_provider": provider,
+            "irt_item_id": it["item_id"],
+        }
+        try:
+            eval_data = with_attempts(judge, answer_rec, metric, METRIC_RUBRICS[metric], 0.0)
+            score = int(eval_data.get("score"))
+        except Exception as e:
+            print(f"[ERROR] Item {it['item_id']} failed: {e}")
+            dead_letters.add_evaluation(
+                args.judge, 0.0, answer_rec, metric, METRIC_RUBRICS[metric], args.output_jsonl, e, dict(eval_meta)
+            )
+            return None
+        return {
+            "question_id": answer_rec["question_id"],
+            "question": question,
+            "answer": answer_rec["answer"],
+            "metric": metric,
+            "rubric": METRIC_RUBRICS[metric],
+            "score": score,
+            "justification": eval_data.get("justification", ""),
+            "eval_meta": eval_meta,
+        }
+
+    pool = ThreadPoolExecutor(max_workers=max(args.batch_size, 1))
+    with open(args.output_jsonl, "a", encoding="utf-8") as out_f:
+        rounds = 0
+        while len(administered) < min(args.max_items, len(items)):
+            half_width = 1.96 * sd
+            if len(idx) >= args.min_items and 2 * half_width <= args.ci_width:
+                break
+            batch = select_items(a, b, nodes, post, administered, min(args.batch_size, args.max_items - len(administered)))
+            if not batch:
+                break
+            administered.update(batch)
+            rounds += 1
+            for i, rec in zip(batch, pool.map(administer, batch)):
+                if rec is None:
+                    continue
+                out_f.write(dumps_line(rec))
+                idx.append(i)
+                ys.append(to_response(rec["score"], pass_score))
+            nodes, post = ability_posterior(a, b, idx, ys, n_quad)
+            theta, sd = eap(nodes, post)
+            print(f"Round {rounds}: {len(idx)} items, theta={theta:.3f} +/- {1.96 * sd:.3f}")
+    pool.shutdown()
+    answers_f.close()
+    if raw_store is not None:
+        raw_store.close()
+    dead_letters.close()
+
+    print(
+        f"{label}: theta={theta:.3f}, 95% CI [{theta - 1.96 * sd:.3f}, {theta + 1.96 * sd:.3f}] "
+        f"from {len(idx)}/{len(items)} items ({len(answers)} generations, {len(idx)} judge calls)"
+    )
+    ranking = [(m, row["theta"], row["theta_sd"]) for m, row in calib["models"].items()]
+    ranking.append((f"{label} (adaptive)", theta, sd))
+    print(f"{'rank':<5} {'model':<48} {'theta':>7} {'95% CI':>16}")
+    for rank, (m, t, s) in enumerate(sorted(ranking, key=lambda r: -r[1]), start=1):
+        print(f"{rank:<5} {m:<48} {t:>7.3f} [{t - 1.96 * s:>6.3f}, {t + 1.96 * s:>6.3f}]")
+    print(f"Done. Appended administered items to {args.output_jsonl}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="2PL item response theory: calibrate items and run adaptive tests.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("fit", help="Fit item difficulty / discrimination from past evaluations.")
+    p.add_argument(
+        "--eval_glob",
+        type=str,
+        default="./results/evaluations/*.jsonl",
+        help="Evaluation files (evaluate_answers.py / run_pipeline.py output).",
+    )
+    p.add_argument("--output_json", type=str, default="./results/irt/items.json", help="Where to save item parameters.")
+    p.add_argument("--judge", type=str, default=None, help="Only use scores from this judge model.")
+    p.add_argument(
+        "--pass_score",
+        type=int,
+        default=None,
+        help="Binarize scores as score >= pass_score (default: fractional response (score - 1) / 4).",
+    )
+    p.add_argument("--n_quad", type=int, default=N_QUAD, help="Quadrature points for theta.")
+    p.set_defaults(func=cmd_fit)
+
+    p = sub.add_parser("adaptive", help="Rank a new model with the most informative items only.")
+    p.add_argument("--items_json", type=str, default="./results/irt/items.json", help="Output of 'irt.py fit'.")
+    p.add_argument("--model", type=str, required=True, help="provider[:model] to test, e.g. claude or gpt:gpt-4.1.")
+    p.add_argument("--judge", type=str, default="gpt-4.1-mini", help="Judge (use the one the items were fit with).")
+    p.add_argument("--temperature", type=float, default=0.7, help="Sampling temperature for answer generation.")
+    p.add_argument("--ci_width", type=float, default=0.8, help="Stop once the 95%% CI of theta is this narrow.")
+    p.add_argument("--batch_size", type=int, default=4, help="Items administered concurrently per round.")
+    p.add_argument("--min_items", type=int, default=5, help="Always administer at least this many items.")
+    p.add_argument("--max_items", type=int, default=100, help="Hard cap on administered items.")
+    p.add_argument(
+        "--output_jsonl",
+        type=str,
+        default="./results/irt/adaptive.jsonl",
+        help="Evaluation records of administered items (appended; usable by 'irt.py fit').",
+    )
+    p.add_argument(
+        "--answers_jsonl",
+        type=str,
+        default="./results/irt/adaptive_answers.jsonl",
+        help="Generated answers (appended, same format as generate_model_answers_*.py).",
+    )
+    p.add_argument(
+        "--no_normalize",
+        action="store_true",
+        help="Store the provider output as-is instead of unwrapping JSON-wrapped answers.",
+    )
+    p.add_argument(
+        "--raw_jsonl",
+        type=str,
+        default=None,
+        help="Optional side store for the raw provider output (keyed by raw_sha1).",
+    )
+    p.add_argument(
+        "--dead_letter",
+        type=str,
+        default=None,
+        help="Where to record items that still fail (default: <output_jsonl>.dlq).",
+    )
+    p.set_defaults(func=cmd_adaptive)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+import argparse
+import glob
+import hashlib
+import os
+import struct
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from records import CODEC, dumps_line
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 flock：同一时间只能有一个进程更新索引
+    fcntl = None
+
+# JSONL 结果文件的旁路 offset 索引：<file>.jsonl.idx，按 (question_id, metric, model) 直接 seek 到记录，
+# 查一道题的所有评估、把 model_answers 和 evaluations 按 question_id 对上，都不用再整文件解析。
+#
+# 索引文件 = 64 字节 header + 定长 entry 数组（np.memmap 直接映射）：
+#   entry = (qkey, mkey, offset, length)，qkey = hash(question_id)，mkey = hash(metric) << 32 | hash(model)
+#   前 n_sorted 条按 (qkey, mkey, offset) 排好序，查询是 searchsorted；之后是增量追加的未排序尾巴，
+#   查询时线性扫（numpy 向量化），尾巴超过 1/4 时整体重排一次（写临时文件 + os.replace）。
+# header 记着已经索引到数据文件的哪个字节，打开 / refresh 时只解析新追加的完整行。
+# 数据文件被截断或重写（开头 4KB / 最后一段索引过的字节对不上）就整个重建。
+# hash 只用来定位，读出来的记录会再核对一遍字段，碰撞不会返回错的记录。
+#
+#   python jsonl_index.py build './results/evaluations/*.jsonl' './results/model_answers/*.jsonl'
+#   python jsonl_index.py get ./results/evaluations/out_gpt.jsonl --question_id 3 --metric "Respect for autonomy"
+#   python jsonl_index.py get ./results/evaluations/out_gpt.jsonl --question_id 3 --join ./results/model_answers/out_gpt.jsonl
+
+INDEX_SUFFIX = ".idx"
+MAGIC = b"HABJIDX1"
+# magic, n_sorted, n_total, indexed_bytes, fingerprint；补齐到 64 字节
+HEADER = struct.Struct("<8sQQQ16s")
+HEADER_SIZE = 64
+ENTRY_DTYPE = np.dtype([("qkey", "<u8"), ("mkey", "<u8"), ("offset", "<u8"), ("length", "<u4")])
+# 指纹取数据文件开头这么多字节 + 已索引部分最后这么多字节
+FINGERPRINT_HEAD = 4096
+FINGERPRINT_TAIL = 256
+COMPACT_MIN_TAIL = 4096
+READ_CHUNK = 1 << 22
+
+
+def _hash(text: str, size: int) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=size).digest(), "little")
+
+
+def question_key(question_id: Any) -> int:
+    # 3 和 "3" 当成同一道题，命令行上传进来的都是字符串
+    return _hash(str(question_id), 8)
+
+
+def metric_model_key(metric: str, model: str) -> int:
+    return (_hash(metric, 4) << 32) | _hash(model, 4)
+
+
+def record_model(path: str, rec: Dict[str, Any]) -> str:
+    """
+    记录属于哪个被测模型：run_pipeline 的评估记录有 eval_meta.answer_model，答案记录有 meta.model，
+    老的 out_<model>.jsonl 只能用文件名。
+    """
+    meta = rec.get("eval_meta") or {}
+    if meta.get("answer_model"):
+        return f"{meta.get('answer_provider', '')}:{meta['answer_model']}".lstrip(":")
+    meta = rec.get("meta") or {}
+    if meta.get("model"):
+        return f"{meta.get('provider', '')}:{meta['model']}".lstrip(":")
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def select_entries(
+    entries: np.ndarray,
+    n_sorted: int,
+    question_id: Any = None,
+    metric: Optional[str] = None,
+    model: Optional[str] = None,
+) -> np.ndarray:
+    """
+    entries 前 n_sorted 条按 qkey 排好序（searchsorted），后面的尾巴线性扫；
+    再按 mkey 的高 / 低 32 位筛 metric / model。结果顺序不保证。
+    """
+    if question_id is not None:
+        qkey = np.uint64(question_key(question_id))
+        sorted_part = entries[:n_sorted]["qkey"]
+        lo = np.searchsorted(sorted_part, qkey, side="left")
+        hi = np.searchsorted(sorted_part, qkey, side="right")
+        tail = entries[n_sorted:]
+        entries = np.concatenate([entries[lo:hi], tail[tail["qkey"] == qkey]])
+    if metric is not None or model is not None:
+        mkey = entries["mkey"]
+        mask = np.ones(len(entries), dtype=bool)
+        if metric is not None:
+            mask &= (mkey >> np.uint64(32)) == np.uint64(_hash(metric, 4))
+        if model is not None:
+            mask &= (mkey & np.uint64(0xFFFFFFFF)) == np.uint64(_hash(model, 4))
+        entries = entries[mask]
+    return entries
+
+
+def record_matches(
+    path: str, rec: Dict[str, Any], question_id: Any = None, metric: Optional[str] = None, model: Optional[str] = None
+) -> bool:
+    """hash 只用来定位，读出来的记录要再核对一遍。"""
+    if question_id is not None and str(rec.get("question_id")) != str(question_id):
+        return False
+    if metric is not None and (rec.get("metric") or "") != metric:
+        return False
+    if model is not None and record_model(path, rec) != model:
+        return False
+    return True
+
+
+def index_path_for(path: str) -> str:
+    return path + INDEX_SUFFIX
+
+
+def _fingerprint(f, indexed_bytes: int) -> bytes:
+    h = hashlib.blake2b(digest_size=16)
+    f.seek(0)
+    h.update(f.read(min(FINGERPRINT_HEAD, indexed_bytes)))
+    tail_start = max(0, indexed_bytes - FINGERPRINT_TAIL)
+    f.seek(tail_start)
+    h.update(f.read(indexed_bytes - tail_start))
+    return h.digest()
+
+
+class JsonlIndex:
+    """
+    一个 JSONL 文件的 offset 索引。构造时（refresh=True）先把索引追到数据文件末尾；
+    之后数据文件继续被 append，再调 refresh() 只会解析新增的行。
+    """
+
+    def __init__(self, path: str, refresh: bool = True):
+        self.path = path
+        self.index_path = index_path_for(path)
+        self.n_sorted = 0
+        self.n_total = 0
+        self.indexed_bytes = 0
+        self.entries = np.zeros(0, dtype=ENTRY_DTYPE)
+        if refresh:
+            self.refresh()
+        else:
+            self._load()
+
+    # ---------- 读写索引文件 ----------
+
+    def _read_header(self) -> Optional[Tuple[int, int, int, bytes]]:
+        try:
+            with open(self.index_path, "rb") as f:
+                raw = f.read(HEADER_SIZE)
+        except FileNotFoundError:
+            return None
+        if len(raw) < HEADER.size:
+            return None
+        magic, n_sorted, n_total, indexed_bytes, fingerprint = HEADER.unpack_from(raw)
+        if magic != MAGIC:
+            return None
+        return n_sorted, n_total, indexed_bytes, fingerprint
+
+    def _load(self) -> None:
+        header = self._read_header()
+        if header is None:
+            self.n_sorted = self.n_total = self.indexed_bytes = 0
+            self.entries = np.zeros(0, dtype=ENTRY_DTYPE)
+            return
+        self.n_sorted, self.n_total, self.indexed_bytes, _ = header
+        if self.n_total == 0:
+            self.entries = np.zeros(0, dtype=ENTRY_DTYPE)
+        else:
+            self.entries = np.memmap(
+                self.index_path, dtype=ENTRY_DTYPE, mode="r", offset=HEADER_SIZE, shape=(self.n_total,)
+            )
+
+    def _write_header(self, f, n_sorted: int, n_total: int, indexed_bytes: int, fingerprint: bytes) -> None:
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, n_sorted, n_total, indexed_bytes, fingerprint).ljust(HEADER_SIZE, b"\0"))
+
+    def _rewrite(self, entries: np.ndarray, indexed_bytes: int, fingerprint: bytes) -> None:
+        """整个索引按 (qkey, mkey, offset) 排好序重写；已经 mmap 了旧文件的读者不受影响。"""
+        order = np.lexsort((entries["offset"], entries["mkey"], entries["qkey"]))
+        entries = entries[order]
+        tmp = f"{self.index_path}.tmp{os.getpid()}"
+        with open(tmp, "wb") as f:
+            self._write_header(f, len(entries), len(entries), indexed_bytes, fingerprint)
+            f.write(entries.tobytes())
+        os.replace(tmp, self.index_path)
+
+    # ---------- 增量更新 ----------
+
+    def _scan(self, f, start: int) -> Tuple[np.ndarray, int]:
+        """从 start 开始解析完整的行；最后一行没有换行（别的进程正在写）就先不算。"""
+        rows: List[Tuple[int, int, int, int]] = []
+        f.seek(start)
+        pos = start
+        pending = b""
+        while True:
+            chunk = f.read(READ_CHUNK)
+            if not chunk:
+                break
+            buf = pending + chunk
+            lines = buf.split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                length = len(line) + 1
+                if line.strip():
+                    try:
+                        rec = CODEC.loads(line)
+                    except ValueError as e:
+                        print(f"[WARN] Skipping invalid line at byte {pos} in {self.path}: {e}")
+                        rec = None
+                    if isinstance(rec, dict):
+                        rows.append(
+                            (
+                                question_key(rec.get("question_id")),
+                                metric_model_key(rec.get("metric") or "", record_model(self.path, rec)),
+                                pos,
+                                length,
+                            )
+                        )
+                pos += length
+        return np.array(rows, dtype=ENTRY_DTYPE), pos
+
+    def refresh(self) -> int:
+        """把索引追到数据文件末尾，返回新索引的记录数。"""
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(self.path)
+        # 锁数据文件本身：索引文件重排时会被 os.replace 换掉，锁在它上面不可靠
+        with open(self.path, "rb") as lock_f:
+            if fcntl is not None:
+                fcntl.flock(lock_f.fileno(), fcntl.LOCK_EX)
+            try:
+                return self._refresh_locked()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_f.fileno(), fcntl.LOCK_UN)
+
+    def _refresh_locked(self) -> int:
+        header = self._read_header()
+        with open(self.path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if header is not None:
+                n_sorted, n_total, indexed_bytes, fingerprint = header
+                if indexed_bytes > size or _fingerprint(f, indexed_bytes) != fingerprint:
+                    print(f"[WARN] {self.path} was rewritten since it was indexed; rebuilding {self.index_path}")
+                    header = None
+            if header is None:
+                new, indexed_bytes = self._scan(f, 0)
+                self._rewrite(new, indexed_bytes, _fingerprint(f, indexed_bytes))
+                self._load()
+                return len(new)
+            if indexed_bytes == size:
+                self._load()
+                return 0
+            new, new_indexed = self._scan(f, indexed_bytes)
+            fingerprint = _fingerprint(f, new_indexed)
+
+        tail = n_total - n_sorted + len(new)
+        if tail > max(COMPACT_MIN_TAIL, n_sorted // 4):
+            old = np.fromfile(self.index_path, dtype=ENTRY_DTYPE, count=n_total, offset=HEADER_SIZE)
+            self._rewrite(np.concatenate([old, new]), new_indexed, fingerprint)
+        else:
+            with open(self.index_path, "r+b") as idx:
+                # 先写 entry 再改 header：中途崩掉的话 header 还是旧的，多出来的字节下次会被覆盖
+                idx.seek(HEADER_SIZE + n_total * ENTRY_DTYPE.itemsize)
+                idx.write(new.tobytes())
+                idx.truncate()
+                idx.flush()
+                self._write_header(idx, n_sorted, n_total + len(new), new_indexed, fingerprint)
+        self._load()
+        return len(new)
+
+    # ---------- 查询 ----------
+
+    def __len__(self) -> int:
+        return self.n_total
+
+    def locate(
+        self, question_id: Any = None, metric: Optional[str] = None, model: Optional[str] = None
+    ) -> np.ndarray:
+        """返回候选记录的 (offset, length)，按文件顺序；hash 碰撞的候选由 get() 再过滤。"""
+        entries = select_entries(self.entries, self.n_sorted, question_id, metric, model)
+        entries = entries[np.argsort(entries["offset"], kind="stable")]
+        return np.stack([entries["offset"], entries["length"].astype(np.uint64)], axis=1)
+
+    def get(
+        self, question_id: Any = None, metric: Optional[str] = None, model: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """直接 seek 读出匹配的记录。"""
+        out: List[Dict[str, Any]] = []
+        with open(self.path, "rb") as f:
+            for offset, length in self.locate(question_id, metric, model):
+                f.seek(int(offset))
+                rec = CODEC.loads(f.read(int(length)))
+                if record_matches(self.path, rec, question_id, metric, model):
+                    out.append(rec)
+        return out
+
+
+def open_index(path: str) -> JsonlIndex:
+    return JsonlIndex(path, refresh=True)
+
+
+def refresh_existing_indexes(paths) -> None:
+    """只更新已经建过索引的文件（run_pipeline 收尾时调用），没有 .idx 的文件不会凭空多出来。"""
+    for path in paths:
+        if os.path.exists(index_path_for(path)) and os.path.exists(path):
+            try:
+                JsonlIndex(path)
+            except OSError as e:
+                print(f"[WARN] Could not update index for {path}: {e}")
+
+
+def join_answers(
+    evaluations: List[Dict[str, Any]], answers_index: JsonlIndex
+) -> Iterator[Tuple[Dict[str, Any], Optional[Dict[str, Any]]]]:
+    """每条评估配上 answers 文件里同一个 question_id（同一个 question 文本）的答案记录。"""
+    cache: Dict[str, Optional[Dict[str, Any]]] = {}
+    for ev in evaluations:
+        qid = str(ev.get("question_id"))
+        if qid not in cache:
+            matches = [a for a in answers_index.get(question_id=qid) if a.get("question") == ev.get("question")]
+            cache[qid] = matches[-1] if matches else None
+        yield ev, cache[qid]
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Sidecar offset index for JSONL result files.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_build = sub.add_parser("build", help="Build or incrementally update the index of JSONL files.")
+    p_build.add_argument("patterns", nargs="+", help="JSONL files or glob patterns.")
+
+    p_get = sub.add_parser("get", help="Look up records by question_id / metric / model.")
+    p_get.add_argument("path", type=str, help="Indexed JSONL file.")
+    p_get.add_argument("--question_id", type=str, default=None)
+    p_get.add_argument("--metric", type=str, default=None)
+    p_get.add_argument("--model", type=str, default=None, help="Model label (see record_model).")
+    p_get.add_argument("--join", type=str, default=None, help="Answers JSONL to join on question_id.")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        paths = sorted({p for pattern in args.patterns for p in glob.glob(pattern) if not p.endswith(INDEX_SUFFIX)})
+        if not paths:
+            print(f"[ERROR] No files matched {args.patterns}")
+            return
+        for path in paths:
+            before = JsonlIndex(path, refresh=False)
+            index = JsonlIndex(path)
+            print(f"{path}: {len(index)} records ({len(index) - len(before)} new) -> {index.index_path}")
+        return
+
+    index = open_index(args.path)
+    records = index.get(args.question_id, args.metric, args.model)
+    if args.join:
+        for ev, answer in join_answers(records, open_index(args.join)):
+            print(dumps_line({"evaluation": ev, "answer": answer}), end="")
+    else:
+        for rec in records:
+            print(dumps_line(rec), end="")
+
+
+if __name__ == "__main__":
+    main()
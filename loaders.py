@@ -0,0 +1,287 @@
+import argparse
+import csv
+import importlib
+import json
+import os
+import re
+from typing import Dict, Any, Callable, Iterator, List, Optional, Tuple
+
+from records import QuestionRecord, dumps_line, question_hash
+
+# 题目来源统一走这里：按 --input_format 或扩展名挑格式插件，插件逐条 yield {"question", "metric"?}，
+# iter_questions 再补上 question_id（源文件里第几道非空题，和以前各脚本的 enumerate 一致）、
+# source 和按内容算的 question_hash，所以几十万条的外部 prompt 语料也可以边读边跑。
+#
+# 格式：txt（一行一题）、csv（第一列；有 question / prompt 表头时按列名取，metric 列可选）、
+#      jsonl（对象，或者每行就是一个 JSON 字符串）、jsonstr（带引号的字符串，字符串里可以有真换行，
+#      一条跨多行）、parquet（需要 pyarrow，按 batch 读）。
+# 新格式用 @register_format("name", ".ext") 注册一个 path -> Iterator[dict] 的函数即可。
+#
+#   python loaders.py inspect ./examples_for_generation/encourage_learning.csv
+#   python loaders.py convert corpus.parquet --output_jsonl ./results/questions/corpus.jsonl --metric ENCOURAGE_LEARNING
+
+QUESTION_FIELDS = ("question", "prompt", "text")
+PARQUET_BATCH_ROWS = 4096
+# jsonstr 里一条记录最多攒这么多字符还没闭合引号，就当坏数据跳过
+MAX_RECORD_CHARS = 1_000_000
+
+# format name -> (extensions, loader)
+FORMATS: Dict[str, Tuple[Tuple[str, ...], Callable[[str], Iterator[Dict[str, Any]]]]] = {}
+
+
+def register_format(name: str, *extensions: str):
+    def decorator(fn: Callable[[str], Iterator[Dict[str, Any]]]):
+        FORMATS[name] = (tuple(e.lower() for e in extensions), fn)
+        return fn
+
+    return decorator
+
+
+def _pick_question(obj: Dict[str, Any]) -> Optional[str]:
+    for field in QUESTION_FIELDS:
+        value = obj.get(field)
+        if isinstance(value, str):
+            return value
+    return None
+
+
+@register_format("txt", ".txt")
+def iter_txt(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            yield {"question": line}
+
+
+@register_format("csv", ".csv", ".tsv")
+def iter_csv(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.reader(f, delimiter="\t" if path.lower().endswith(".tsv") else ",")
+        header = next(reader, None)
+        if header is None:
+            return
+        columns = {name.strip().lower(): i for i, name in enumerate(header)}
+        q_col = next((columns[name] for name in QUESTION_FIELDS if name in columns), None)
+        if q_col is None:
+            # 没有表头（examples_for_generation 里的文件）：第一行也是题，只取第一列
+            yield {"question": header[0] if header else ""}
+            for row in reader:
+                if row:
+                    yield {"question": row[0]}
+            return
+        m_col = columns.get("metric")
+        for row in reader:
+            if len(row) > q_col:
+                fields = {"question": row[q_col]}
+                if m_col is not None and len(row) > m_col and row[m_col].strip():
+                    fields["metric"] = row[m_col].strip()
+                yield fields
+
+
+# JSON 字符串里一段不含闭合引号的内容：普通字符，或者反斜杠转义（可以转义换行）
+_STRING_BODY = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.S)
+
+
+@register_format("jsonstr")
+def iter_json_strings(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    一条记录是一个带引号的 JSON 字符串。字符串里的真换行（不是 \\n 转义）会把一条记录拆成多行，
+    所以按行攒，每来一行只扫这一行找闭合引号（不会每来一行就把整段重新解析一遍），找到了再 json.loads 一次。
+    strict=False 允许字符串里有控制字符。开头不是引号的行（JSON 对象）按单行解析。
+    """
+    parts: List[str] = []
+    size = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            if parts:
+                start = 0
+            elif not line.strip():
+                continue
+            else:
+                line = line.lstrip()
+                start = 1 if line.startswith('"') else -1
+            parts.append(line)
+            size += len(line)
+            if start >= 0:
+                end = _STRING_BODY.match(line, start).end()
+                if end >= len(line) or line[end] != '"':
+                    # 这一行里没有闭合引号（或者停在行尾的反斜杠上），等下一行
+                    if size > MAX_RECORD_CHARS:
+                        print(f"[WARN] Skipping unterminated string ending at line {line_no} in {path}")
+                        parts, size = [], 0
+                    continue
+            record = "".join(parts)
+            parts, size = [], 0
+            try:
+                value = json.loads(record, strict=False)
+            except json.JSONDecodeError:
+                print(f"[WARN] Skipping invalid record ending at line {line_no} in {path}")
+                continue
+            if isinstance(value, str):
+                yield {"question": value}
+            elif isinstance(value, dict) and _pick_question(value) is not None:
+                yield {"question": _pick_question(value), "metric": value.get("metric")}
+            else:
+                print(f"[WARN] Skipping non-string record ending at line {line_no} in {path}")
+    if parts:
+        print(f"[WARN] Skipping unterminated string at the end of {path}")
+
+
+@register_format("jsonl", ".jsonl", ".ndjson")
+def iter_jsonl_questions(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        first = next((line for line in f if line.strip()), "")
+    # 每行一个字符串的 .jsonl 其实就是 jsonstr（可能还跨行），交给它处理
+    if first.lstrip().startswith('"'):
+        yield from iter_json_strings(path)
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                obj = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"[WARN] Skipping invalid line {line_no} in {path}: {e}")
+                continue
+            question = obj if isinstance(obj, str) else _pick_question(obj) if isinstance(obj, dict) else None
+            if question is None:
+                print(f"[WARN] Skipping line {line_no} in {path}: no {'/'.join(QUESTION_FIELDS)} field")
+                continue
+            yield {"question": question, "metric": obj.get("metric") if isinstance(obj, dict) else None}
+
+
+@register_format("parquet", ".parquet", ".pq")
+def iter_parquet(path: str) -> Iterator[Dict[str, Any]]:
+    try:
+        pq = importlib.import_module("pyarrow.parquet")
+    except ImportError as e:
+        raise ImportError("Reading Parquet question files needs pyarrow: pip install pyarrow") from e
+    pf = pq.ParquetFile(path)
+    names = {name.lower(): name for name in pf.schema_arrow.names}
+    q_col = next((names[f] for f in QUESTION_FIELDS if f in names), None)
+    if q_col is None:
+        raise ValueError(f"{path} has no {'/'.join(QUESTION_FIELDS)} column (columns: {pf.schema_arrow.names})")
+    columns = [q_col] + ([names["metric"]] if "metric" in names else [])
+    for batch in pf.iter_batches(batch_size=PARQUET_BATCH_ROWS, columns=columns):
+        questions = batch.column(0).to_pylist()
+        metrics = batch.column(1).to_pylist() if len(columns) > 1 else [None] * len(questions)
+        for question, metric in zip(questions, metrics):
+            if isinstance(question, str):
+                yield {"question": question, "metric": metric}
+
+
+def detect_format(path: str, fmt: Optional[str] = None) -> str:
+    if fmt:
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown input format '{fmt}'. Available: {sorted(FORMATS)}")
+        return fmt
+    ext = os.path.splitext(path)[1].lower()
+    for name, (extensions, _) in FORMATS.items():
+        if ext in extensions:
+            return name
+    # 以前的脚本把不是 .txt 的都当 csv
+    return "csv"
+
+
+def iter_questions(
+    path: str,
+    fmt: Optional[str] = None,
+    metric: Optional[str] = None,
+) -> Iterator[QuestionRecord]:
+    """
+    逐条 yield QuestionRecord；空题跳过且不占 question_id。
+    metric 是文件里没写 metric 时的默认值。
+    """
+    loader = FORMATS[detect_format(path, fmt)][1]
+    source = os.path.basename(path)
+    q_idx = 0
+    for fields in loader(path):
+        question = (fields.get("question") or "").strip()
+        if not question:
+            continue
+        file_metric = fields.get("metric")
+        yield QuestionRecord(
+            question_id=q_idx,
+            question=question,
+            metric=str(file_metric) if file_metric else metric,
+            source=source,
+            question_hash=question_hash(question),
+        )
+        q_idx += 1
+
+
+def load_questions(path: str, fmt: Optional[str] = None) -> List[str]:
+    """需要题目总数（成本估算、分 shard）的地方用；只要逐条跑的用 iter_questions。"""
+    return [rec.question for rec in iter_questions(path, fmt)]
+
+
+def add_input_format_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--input_format",
+        type=str,
+        choices=sorted(FORMATS),
+        default=None,
+        help="Question file format (default: from the file extension, .csv for unknown ones).",
+    )
+
+
+# ------------------------------
+# CLI
+# ------------------------------
+
+
+def cmd_inspect(args) -> None:
+    fmt = detect_format(args.input_file, args.input_format)
+    n, n_metric, hashes = 0, 0, set()
+    preview: List[QuestionRecord] = []
+    for rec in iter_questions(args.input_file, fmt):
+        n += 1
+        n_metric += rec.metric is not None
+        hashes.add(rec.question_hash)
+        if len(preview) < args.head:
+            preview.append(rec)
+    print(f"{args.input_file}: format={fmt}, {n} questions ({n - len(hashes)} duplicates, {n_metric} with a metric)")
+    for rec in preview:
+        text = rec.question.replace("\n", "\\n")
+        print(f"  {rec.question_id:>5} {rec.question_hash}  {text[:90]}")
+
+
+def cmd_convert(args) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(args.output_jsonl)), exist_ok=True)
+    seen = set()
+    n = 0
+    with open(args.output_jsonl, "w", encoding="utf-8") as out_f:
+        for rec in iter_questions(args.input_file, args.input_format, metric=args.metric):
+            if args.dedupe:
+                if rec.question_hash in seen:
+                    continue
+                seen.add(rec.question_hash)
+            out_f.write(dumps_line(rec.to_dict()))
+            n += 1
+    print(f"Done. Wrote {n} questions to {args.output_jsonl}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Inspect / convert question files through the format loaders.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("inspect", help="Count questions and show the first few with their content hashes.")
+    p.add_argument("input_file", type=str)
+    add_input_format_argument(p)
+    p.add_argument("--head", type=int, default=5, help="Questions to preview.")
+    p.set_defaults(func=cmd_inspect)
+
+    p = sub.add_parser("convert", help="Stream any supported format into question JSONL records.")
+    p.add_argument("input_file", type=str)
+    add_input_format_argument(p)
+    p.add_argument("--output_jsonl", type=str, required=True)
+    p.add_argument("--metric", type=str, default=None, help="Metric for questions that do not name one.")
+    p.add_argument("--dedupe", action="store_true", help="Drop repeated questions (same content hash).")
+    p.set_defaults(func=cmd_convert)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
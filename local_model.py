@@ -0,0 +1,529 @@
+import argparse
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from answer_normalization import AnswerValidationError, RawAnswerStore, normalize_record
+from concurrency import call_slot
+from deadletter import DeadLetterQueue, dead_letter_path, note_attempt, with_attempts
+from loaders import add_input_format_argument, iter_questions
+from progress import get_tracker
+from prompts import ANSWER_SYSTEM_PROMPT
+from records import dumps_line
+
+# 本地 CPU 模型 provider（llama.cpp 的 python binding：pip install llama-cpp-python），
+# 不走网络、不花 API 钱，用来跑 smoke benchmark 和便宜的预筛 judge。
+# generate_answer_for_question 和远程脚本里的同名函数同形，client 换成 LocalModel 即可；
+# judge 走 providers.LocalChat + evaluate_answers.evaluate_single_answer，和远程 judge 同一套 prompt / 解析。
+
+# 攒一批时 KV cache 的 seq 0 存共享前缀，1..max_batch_size 是各条请求
+PREFIX_SEQ = 0
+# 和 create_chat_completion 的默认采样参数一致
+TOP_K = 40
+TOP_P = 0.95
+
+
+def _llama_fn(llama_cpp, *names: str):
+    """llama.cpp 的 C API 改过几次名（kv_cache_* -> kv_self_*），按顺序找第一个存在的。"""
+    for name in names:
+        fn = getattr(llama_cpp, name, None)
+        if fn is not None:
+            return fn
+    raise ImportError(f"llama-cpp-python is too old or too new: none of {names} found")
+
+
+class LocalModel:
+    """
+    一个 llama.cpp 模型实例 + 一个后台调度线程，做动态 batching。
+
+    各个 worker 线程只往队列里塞请求；后台线程每次最多等 max_wait_ms 攒一批（最多 max_batch_size 条），
+    整批一起 decode：所有请求共同的 token 前缀（system prompt + rubric）只在 seq 0 上算一次，
+    用 seq_cp 共享给每条请求的 seq，再把各条剩下的 prompt 和之后每一步生成的 token 放进同一个 llama_batch，
+    一次 llama_decode 推进整批。seq 0 的前缀跨批保留，下一批前缀相同的部分不用重算。
+    max_batch_size=1 时退回逐条 create_chat_completion + LlamaRAMCache 前缀缓存。
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        n_threads: Optional[int] = None,
+        n_ctx: int = 8192,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 20.0,
+        cache_bytes: int = 2 << 30,
+        max_tokens: int = 1024,
+        seed: int = 0,
+    ):
+        try:
+            import llama_cpp
+            from llama_cpp import Llama, LlamaRAMCache
+        except ImportError as e:
+            raise ImportError(
+                "The local provider needs llama.cpp bindings: pip install llama-cpp-python"
+            ) from e
+
+        self.model_path = model_path
+        self.n_threads = n_threads or os.cpu_count() or 1
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_tokens = max_tokens
+        self.n_ctx = n_ctx
+        self.rng = np.random.default_rng(seed)
+
+        self.llm = Llama(
+            model_path=model_path,
+            # batching 时 Llama 自己的 context 只用来分词，KV 在下面单独建的 context 里
+            n_ctx=n_ctx if self.max_batch_size == 1 else min(n_ctx, 512),
+            n_threads=self.n_threads,
+            n_threads_batch=self.n_threads,
+            verbose=False,
+        )
+        if self.max_batch_size == 1:
+            # prefix cache：按 token 前缀找最长匹配的 KV state
+            self.llm.set_cache(LlamaRAMCache(capacity_bytes=cache_bytes))
+        else:
+            self._init_batching(llama_cpp)
+
+        self.stats: Dict[str, float] = {
+            "requests": 0,
+            "batches": 0,
+            "decode_calls": 0,
+            "prefix_tokens_reused": 0,
+            "busy_seconds": 0.0,
+        }
+        self._queue: "queue.Queue[Tuple[Dict[str, Any], Future]]" = queue.Queue()
+        self._worker = threading.Thread(target=self._loop, daemon=True)
+        self._worker.start()
+
+    def _init_batching(self, llama_cpp) -> None:
+        self.lib = llama_cpp
+        params = llama_cpp.llama_context_params.from_buffer_copy(self.llm.context_params)
+        params.n_ctx = self.n_ctx
+        if hasattr(params, "n_seq_max"):
+            params.n_seq_max = self.max_batch_size + 1
+        self.ctx = _llama_fn(llama_cpp, "llama_init_from_model", "llama_new_context_with_model")(self.llm.model, params)
+        if not self.ctx:
+            raise RuntimeError(f"Failed to create a llama.cpp context for {self.model_path}")
+        self.n_batch = int(params.n_batch)
+        self.n_vocab = self.llm.n_vocab()
+        self._seq_rm = _llama_fn(llama_cpp, "llama_kv_self_seq_rm", "llama_kv_cache_seq_rm")
+        self._seq_cp = _llama_fn(llama_cpp, "llama_kv_self_seq_cp", "llama_kv_cache_seq_cp")
+        is_eog = getattr(llama_cpp, "llama_token_is_eog", None)
+        eos = self.llm.token_eos()
+        self._is_eog = (lambda tok: bool(is_eog(self.llm.model, tok))) if is_eog else (lambda tok: tok == eos)
+        self.batch = llama_cpp.llama_batch_init(max(self.n_batch, self.max_batch_size), 0, self.max_batch_size + 1)
+        # seq 0 里现在存着哪些前缀 token
+        self.cached_prefix: List[int] = []
+
+        template = (self.llm.metadata or {}).get("tokenizer.chat_template")
+        if template:
+            from llama_cpp.llama_chat_format import Jinja2ChatFormatter
+
+            # bos 由 tokenize(add_bos=True) 加，模板里渲染成空串，避免两个 BOS
+            formatter = Jinja2ChatFormatter(template=template, eos_token="", bos_token="")
+            self._format = lambda system, user: formatter(
+                messages=[{"role": "system", "content": system}, {"role": "user", "content": user}]
+            ).prompt
+        else:
+            self._format = lambda system, user: f"{system}\n\n{user}\n\n"
+
+    def chat(
+        self,
+        system: str,
+        user: str,
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None,
+    ) -> str:
+        """同步接口：可以从任意线程调用，阻塞到这条请求跑完。"""
+        fut: Future = Future()
+        req = {
+            "system": system,
+            "user": user,
+            "temperature": temperature,
+            "max_tokens": max_tokens or self.max_tokens,
+        }
+        self._queue.put((req, fut))
+        return fut.result()
+
+    def _next_batch(self) -> List[Tuple[Dict[str, Any], Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return [(req, fut) for req, fut in batch if fut.set_running_or_notify_cancel()]
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            start = time.monotonic()
+            if self.max_batch_size == 1:
+                self._run_serial(batch)
+            else:
+                for part in self._fit_context(batch):
+                    try:
+                        texts = self._run_batch([req for req, _ in part])
+                    except Exception as e:
+                        # 出错后 KV 状态不确定，前缀缓存作废
+                        self.cached_prefix = []
+                        for _, fut in part:
+                            fut.set_exception(e)
+                        continue
+                    for (_, fut), text in zip(part, texts):
+                        fut.set_result(text)
+                    self.stats["batches"] += 1
+            self.stats["requests"] += len(batch)
+            self.stats["busy_seconds"] += time.monotonic() - start
+
+    def _run_serial(self, batch: List[Tuple[Dict[str, Any], Future]]) -> None:
+        for req, fut in batch:
+            try:
+                out = self.llm.create_chat_completion(
+                    messages=[
+                        {"role": "system", "content": req["system"]},
+                        {"role": "user", "content": req["user"]},
+                    ],
+                    temperature=req["temperature"],
+                    max_tokens=req["max_tokens"],
+                )
+                fut.set_result(out["choices"][0]["message"]["content"])
+            except Exception as e:
+                fut.set_exception(e)
+            self.stats["batches"] += 1
+
+    def _fit_context(self, batch: List[Tuple[Dict[str, Any], Future]]) -> List[List[Tuple[Dict[str, Any], Future]]]:
+        """
+        分词，再按 KV cache 容量切分：一批占用 前缀 + sum(各自 prompt 后缀 + max_tokens) 个 cell。
+        单条都放不下的请求直接报错。
+        """
+        parts: List[List[Tuple[Dict[str, Any], Future]]] = []
+        current: List[Tuple[Dict[str, Any], Future]] = []
+        used = 0
+        for req, fut in batch:
+            try:
+                req["tokens"] = self.llm.tokenize(
+                    self._format(req["system"], req["user"]).encode("utf-8"), add_bos=True, special=True
+                )
+            except Exception as e:
+                fut.set_exception(e)
+                continue
+            need = len(req["tokens"]) + req["max_tokens"]
+            if need > self.n_ctx:
+                fut.set_exception(
+                    ValueError(f"Prompt of {len(req['tokens'])} tokens + max_tokens={req['max_tokens']} exceeds n_ctx={self.n_ctx}")
+                )
+                continue
+            # 粗略按不共享前缀估，保证不会超
+            if current and used + need > self.n_ctx:
+                parts.append(current)
+                current, used = [], 0
+            current.append((req, fut))
+            used += need
+        if current:
+            parts.append(current)
+        return parts
+
+    def _decode(self, items: List[Tuple[int, int, int, bool]]) -> Dict[int, np.ndarray]:
+        """
+        items 是 (token, pos, seq_id, 要不要 logits)，按 n_batch 切块 decode。
+        返回 {items 里的下标: logits}。
+        """
+        logits: Dict[int, np.ndarray] = {}
+        for lo in range(0, len(items), self.n_batch):
+            chunk = items[lo : lo + self.n_batch]
+            self.batch.n_tokens = len(chunk)
+            for i, (token, pos, seq_id, want) in enumerate(chunk):
+                self.batch.token[i] = token
+                self.batch.pos[i] = pos
+                self.batch.n_seq_id[i] = 1
+                self.batch.seq_id[i][0] = seq_id
+                self.batch.logits[i] = want
+            rc = self.lib.llama_decode(self.ctx, self.batch)
+            self.stats["decode_calls"] += 1
+            if rc != 0:
+                raise RuntimeError(f"llama_decode failed with code {rc}")
+            for i, (_, _, _, want) in enumerate(chunk):
+                if want:
+                    ptr = self.lib.llama_get_logits_ith(self.ctx, i)
+                    logits[lo + i] = np.ctypeslib.as_array(ptr, shape=(self.n_vocab,)).copy()
+        return logits
+
+    def _sample(self, logits: np.ndarray, temperature: float) -> int:
+        if temperature <= 0:
+            return int(np.argmax(logits))
+        top = np.argpartition(logits, -TOP_K)[-TOP_K:] if len(logits) > TOP_K else np.arange(len(logits))
+        top = top[np.argsort(logits[top])[::-1]]
+        probs = np.exp((logits[top] - logits[top[0]]) / temperature)
+        probs /= probs.sum()
+        keep = int(np.searchsorted(np.cumsum(probs), TOP_P)) + 1
+        probs = probs[:keep] / probs[:keep].sum()
+        return int(top[self.rng.choice(keep, p=probs)])
+
+    def _run_batch(self, reqs: List[Dict[str, Any]]) -> List[str]:
+        prompts = [req["tokens"] for req in reqs]
+        # 所有请求共同的前缀；每条至少留一个自己的 token 用来出 logits
+        n_prefix = min(len(t) for t in prompts) - 1
+        for i in range(n_prefix):
+            if any(t[i] != prompts[0][i] for t in prompts[1:]):
+                n_prefix = i
+                break
+        prefix = prompts[0][:n_prefix]
+
+        # seq 0 里和上一批相同的前缀留着，后面的删掉；各条请求的 seq 清空
+        keep = 0
+        while keep < min(len(prefix), len(self.cached_prefix)) and prefix[keep] == self.cached_prefix[keep]:
+            keep += 1
+        self._seq_rm(self.ctx, PREFIX_SEQ, keep, -1)
+        for seq in range(1, self.max_batch_size + 1):
+            self._seq_rm(self.ctx, seq, -1, -1)
+        self.stats["prefix_tokens_reused"] += keep * len(reqs)
+        self.cached_prefix = []
+        self._decode([(tok, pos, PREFIX_SEQ, False) for pos, tok in enumerate(prefix[keep:], start=keep)])
+        self.cached_prefix = list(prefix)
+
+        # 前缀共享给每条请求，剩下的 prompt 放进同一批
+        items: List[Tuple[int, int, int, bool]] = []
+        last = []
+        for k, tokens in enumerate(prompts):
+            seq = k + 1
+            if n_prefix:
+                self._seq_cp(self.ctx, PREFIX_SEQ, seq, 0, n_prefix)
+            for pos in range(n_prefix, len(tokens)):
+                items.append((tokens[pos], pos, seq, pos == len(tokens) - 1))
+            last.append(len(items) - 1)
+        logits = self._decode(items)
+        step_logits = {k: logits[i] for k, i in enumerate(last)}
+
+        # 逐步生成：每一步所有没结束的请求各一个 token，一次 decode
+        outputs: List[List[int]] = [[] for _ in reqs]
+        positions = [len(t) for t in prompts]
+        active = list(range(len(reqs)))
+        while active:
+            step: List[Tuple[int, int, int, bool]] = []
+            still = []
+            for k in active:
+                tok = self._sample(step_logits[k], reqs[k]["temperature"])
+                if self._is_eog(tok):
+                    continue
+                outputs[k].append(tok)
+                if len(outputs[k]) >= reqs[k]["max_tokens"]:
+                    continue
+                step.append((tok, positions[k], k + 1, True))
+                positions[k] += 1
+                still.append(k)
+            if not step:
+                break
+            logits = self._decode(step)
+            step_logits = {k: logits[i] for i, k in enumerate(still)}
+            active = still
+
+        for seq in range(1, len(reqs) + 1):
+            self._seq_rm(self.ctx, seq, -1, -1)
+        return [self.llm.detokenize(out).decode("utf-8", errors="ignore") for out in outputs]
+
+
+_MODELS: Dict[Tuple[str, int], LocalModel] = {}
+_MODELS_LOCK = threading.Lock()
+
+
+def get_local_model(model_path: str, n_threads: Optional[int] = None, **kwargs) -> LocalModel:
+    """同一个 (model_path, n_threads) 在进程里只加载一次，生成和 judge 共用。"""
+    key = (os.path.abspath(model_path), n_threads or os.cpu_count() or 1)
+    with _MODELS_LOCK:
+        model = _MODELS.get(key)
+        if model is None:
+            model = LocalModel(model_path, n_threads=n_threads, **kwargs)
+            _MODELS[key] = model
+        return model
+
+
+def generate_answer_for_question(
+    client: LocalModel,
+    model: str,
+    question: str,
+    temperature: float = 0.7,
+    max_retries: int = 3,
+) -> str:
+    """
+    调用一次本地模型，给单个 question 生成一个正常 assistant 答案。
+    model 只是 label（模型文件由 client 决定），保留它是为了和远程脚本同形。
+    """
+    for attempt in range(max_retries):
+        try:
+            with call_slot():
+                return client.chat(ANSWER_SYSTEM_PROMPT, question, temperature=temperature)
+        except Exception as e:
+            get_tracker().retry("generate", "local")
+            note_attempt(e)
+            print(
+                f"[WARN] Error on attempt {attempt + 1} for question='{question[:40]}...': {e}"
+            )
+
+    raise RuntimeError("Failed to generate answer after retries.")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Generate answers for each question with a local llama.cpp model (offline)."
+    )
+    parser.add_argument(
+        "--input_file",
+        type=str,
+        default="./examples_for_generation/avoid_value_manipulation.csv",
+        help="Question file: .txt / .csv / .jsonl / .parquet (see loaders.py).",
+    )
+    add_input_format_argument(parser)
+    parser.add_argument(
+        "--output_jsonl",
+        type=str,
+        default="./results/model_answers/out_local.jsonl",
+        help="Path to output .jsonl file.",
+    )
+    parser.add_argument(
+        "--model",
+        type=str,
+        default=os.environ.get("LOCAL_MODEL_PATH", "./models/local.gguf"),
+        help="Path to a GGUF model file.",
+    )
+    parser.add_argument(
+        "--temperature",
+        type=float,
+        default=0.7,
+        help="Sampling temperature.",
+    )
+    parser.add_argument(
+        "--n_threads",
+        type=int,
+        default=None,
+        help="CPU threads for llama.cpp (default: all cores).",
+    )
+    parser.add_argument(
+        "--max_batch_size",
+        type=int,
+        default=8,
+        help="Requests decoded together in one llama.cpp batch (1 = one at a time).",
+    )
+    parser.add_argument(
+        "--no_normalize",
+        action="store_true",
+        help="Store the provider output as-is instead of unwrapping JSON-wrapped answers.",
+    )
+    parser.add_argument(
+        "--raw_jsonl",
+        type=str,
+        default=None,
+        help="Optional side store for the raw provider output (keyed by raw_sha1).",
+    )
+    parser.add_argument(
+        "--dead_letter",
+        type=str,
+        default=None,
+        help="Where to record questions that still fail after retries (default: <output_jsonl>.dlq).",
+    )
+    args = parser.parse_args(argv)
+
+    # 逐条读，大的外部题库不会整个读进内存
+    questions = (rec.question for rec in iter_questions(args.input_file, args.input_format))
+
+    client = get_local_model(args.model, n_threads=args.n_threads, max_batch_size=args.max_batch_size)
+
+    os.makedirs(os.path.dirname(args.output_jsonl), exist_ok=True)
+
+    raw_store = RawAnswerStore(args.raw_jsonl) if args.raw_jsonl else None
+    dead_letters = DeadLetterQueue(args.dead_letter or dead_letter_path(args.output_jsonl), fresh=True)
+
+    def write_answer(q_idx: int, question: str, fut) -> None:
+        try:
+            answer = fut.result()
+        except Exception as e:
+            print(f"[ERROR] Question {q_idx} failed: {e}")
+            dead_letters.add_generation(
+                "local",
+                args.model,
+                args.temperature,
+                {"question_id": q_idx, "question": question},
+                args.output_jsonl,
+                e,
+                normalize=not args.no_normalize,
+                raw_jsonl=args.raw_jsonl,
+            )
+            return
+
+        record: Dict[str, Any] = {
+            "question_id": q_idx,
+            "question": question,
+            "answer": answer,
+            "meta": {
+                "model": args.model,
+                "temperature": args.temperature,
+                "provider": "local",
+            },
+        }
+
+        if not args.no_normalize:
+            try:
+                normalize_record(record, raw_store)
+            except AnswerValidationError as e:
+                print(f"[ERROR] Question {q_idx} returned an invalid answer: {e}")
+                dead_letters.add_generation(
+                    "local",
+                    args.model,
+                    args.temperature,
+                    record,
+                    args.output_jsonl,
+                    e,
+                    normalize=not args.no_normalize,
+                    raw_jsonl=args.raw_jsonl,
+                )
+                return
+
+        out_f.write(dumps_line(record))
+
+        if (q_idx + 1) % 10 == 0:
+            print(f"Generated answers for {q_idx + 1} questions")
+
+    def generate(question: str) -> str:
+        return with_attempts(
+            generate_answer_for_question,
+            client=client,
+            model=args.model,
+            question=question,
+            temperature=args.temperature,
+        )
+
+    # 同时挂 max_batch_size 个请求，后台线程才攒得成一批；按提交顺序写出
+    pool = ThreadPoolExecutor(max_workers=max(args.max_batch_size, 1))
+    window = max(args.max_batch_size, 1) * 2
+    submitted: deque = deque()
+    with open(args.output_jsonl, "w", encoding="utf-8") as out_f:
+        for q_idx, question in enumerate(questions):
+            submitted.append((q_idx, question, pool.submit(generate, question)))
+            if len(submitted) < window:
+                continue
+            write_answer(*submitted.popleft())
+        while submitted:
+            write_answer(*submitted.popleft())
+    pool.shutdown()
+
+    if raw_store is not None:
+        raw_store.close()
+    dead_letters.close()
+
+    print(f"Done. Saved local model answers to {args.output_jsonl}")
+
+
+if __name__ == "__main__":
+    main()
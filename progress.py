@@ -0,0 +1,365 @@
+import importlib.util
+import sys
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+
+# 长时间 run 的进度 / 吞吐 / ETA：终端里的实时面板（装了 rich 用 rich，没装就一行文本），
+# 外加一个本地的 Prometheus 文本格式 /metrics endpoint。
+#
+# 默认是关闭的：get_tracker() 返回 NullTracker，所有方法都是空函数，调用点不用做判断。
+# runner 调 enable_progress(...) 之后才会真正计数、起刷新线程和 HTTP server。
+
+RATE_WINDOW_SECONDS = 60.0
+
+
+class NullTracker:
+    """关闭时的 tracker：什么都不做。"""
+
+    enabled = False
+
+    def set_total(self, stage: str, total: int) -> None:
+        pass
+
+    def add_total(self, stage: str, n: int) -> None:
+        pass
+
+    def started(self, stage: str, provider: str) -> None:
+        pass
+
+    def finished(self, stage: str, provider: str, ok: bool = True) -> None:
+        pass
+
+    def retry(self, stage: str, provider: str) -> None:
+        pass
+
+    def tokens(self, stage: str, provider: str, n: int) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class _Counters:
+    __slots__ = ("in_flight", "completed", "failed", "retries", "tokens")
+
+    def __init__(self):
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.retries = 0
+        self.tokens = 0
+
+
+class ProgressTracker(NullTracker):
+    """按 (stage, provider) 计数；calls/s 和 tokens/s 用最近 RATE_WINDOW_SECONDS 秒的滑动窗口。"""
+
+    enabled = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.totals: Dict[str, int] = {}
+        self.counters: Dict[Tuple[str, str], _Counters] = {}
+        # (timestamp, stage, tokens)
+        self.events: deque = deque()
+        self._closers: List[Any] = []
+
+    def _c(self, stage: str, provider: str) -> _Counters:
+        c = self.counters.get((stage, provider))
+        if c is None:
+            c = self.counters[(stage, provider)] = _Counters()
+        return c
+
+    def set_total(self, stage: str, total: int) -> None:
+        with self.lock:
+            self.totals[stage] = total
+
+    def add_total(self, stage: str, n: int) -> None:
+        with self.lock:
+            self.totals[stage] = self.totals.get(stage, 0) + n
+
+    def started(self, stage: str, provider: str) -> None:
+        with self.lock:
+            self._c(stage, provider).in_flight += 1
+
+    def finished(self, stage: str, provider: str, ok: bool = True) -> None:
+        now = time.time()
+        with self.lock:
+            c = self._c(stage, provider)
+            c.in_flight -= 1
+            if ok:
+                c.completed += 1
+            else:
+                c.failed += 1
+            self.events.append((now, stage, 0))
+
+    def retry(self, stage: str, provider: str) -> None:
+        with self.lock:
+            self._c(stage, provider).retries += 1
+
+    def tokens(self, stage: str, provider: str, n: int) -> None:
+        if not n:
+            return
+        now = time.time()
+        with self.lock:
+            self._c(stage, provider).tokens += n
+            self.events.append((now, stage, n))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """一次性拷出所有数字（面板和 /metrics 共用）。"""
+        now = time.time()
+        with self.lock:
+            while self.events and self.events[0][0] < now - RATE_WINDOW_SECONDS:
+                self.events.popleft()
+            window = min(RATE_WINDOW_SECONDS, max(now - self.started_at, 1e-6))
+            calls: Dict[str, int] = {}
+            toks: Dict[str, int] = {}
+            for _, stage, n in self.events:
+                if n:
+                    toks[stage] = toks.get(stage, 0) + n
+                else:
+                    calls[stage] = calls.get(stage, 0) + 1
+
+            providers = []
+            stages: Dict[str, Dict[str, Any]] = {}
+            for (stage, provider), c in sorted(self.counters.items()):
+                attempts = c.completed + c.failed
+                providers.append(
+                    {
+                        "stage": stage,
+                        "provider": provider,
+                        "in_flight": c.in_flight,
+                        "completed": c.completed,
+                        "failed": c.failed,
+                        "retries": c.retries,
+                        "tokens": c.tokens,
+                        "error_rate": (c.failed / attempts) if attempts else 0.0,
+                    }
+                )
+                s = stages.setdefault(
+                    stage, {"in_flight": 0, "completed": 0, "failed": 0, "retries": 0, "tokens": 0}
+                )
+                for k in ("in_flight", "completed", "failed", "retries", "tokens"):
+                    s[k] += getattr(c, k)
+
+            for stage in set(stages) | set(self.totals):
+                s = stages.setdefault(
+                    stage, {"in_flight": 0, "completed": 0, "failed": 0, "retries": 0, "tokens": 0}
+                )
+                s["total"] = self.totals.get(stage, 0)
+                s["calls_per_s"] = calls.get(stage, 0) / window
+                s["tokens_per_s"] = toks.get(stage, 0) / window
+                remaining = max(s["total"] - s["completed"] - s["failed"], 0)
+                s["eta_seconds"] = (remaining / s["calls_per_s"]) if s["calls_per_s"] > 0 else None
+        return {"elapsed": now - self.started_at, "stages": stages, "providers": providers}
+
+    def close(self) -> None:
+        for closer in self._closers:
+            closer()
+        self._closers.clear()
+
+
+def _fmt_eta(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    h, rem = divmod(seconds, 3600)
+    m, s = divmod(rem, 60)
+    return f"{h}:{m:02d}:{s:02d}" if h else f"{m:02d}:{s:02d}"
+
+
+def render_prometheus(tracker: ProgressTracker) -> str:
+    snap = tracker.snapshot()
+    lines: List[str] = []
+
+    def metric(name: str, kind: str, help_text: str, samples: List[Tuple[Dict[str, str], Any]]) -> None:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            if value is None:
+                continue
+            label_str = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label_str}}} {value}")
+
+    per_provider = snap["providers"]
+    for field, kind, help_text in [
+        ("in_flight", "gauge", "Requests currently in flight."),
+        ("completed", "counter", "Completed work items."),
+        ("failed", "counter", "Work items that failed after all retries."),
+        ("retries", "counter", "Failed provider call attempts (retried while attempts remain)."),
+        ("tokens", "counter", "Tokens reported by the provider (prompt + completion)."),
+        ("error_rate", "gauge", "failed / (completed + failed)."),
+    ]:
+        name = f"hab_{field}" + ("_total" if kind == "counter" else "")
+        metric(
+            name,
+            kind,
+            help_text,
+            [({"stage": p["stage"], "provider": p["provider"]}, p[field]) for p in per_provider],
+        )
+
+    stages = snap["stages"]
+    metric("hab_items_total", "gauge", "Planned work items.", [({"stage": s}, v["total"]) for s, v in stages.items()])
+    metric("hab_calls_per_second", "gauge", "Finished calls per second (sliding window).", [({"stage": s}, round(v["calls_per_s"], 4)) for s, v in stages.items()])
+    metric("hab_tokens_per_second", "gauge", "Tokens per second (sliding window).", [({"stage": s}, round(v["tokens_per_s"], 4)) for s, v in stages.items()])
+    metric("hab_eta_seconds", "gauge", "Estimated seconds until the stage is done.", [({"stage": s}, v["eta_seconds"] and round(v["eta_seconds"], 1)) for s, v in stages.items()])
+
+    # 顺带导出 clients.py 的连接池状态（没 import 过 clients 就跳过）
+    clients = sys.modules.get("clients")
+    if clients is not None:
+        rows = clients.pool_stats()
+        labels = [
+            ({"provider": r["provider"], "base_url": str(r["base_url"] or "default"), "key_id": r["key_id"]}, r)
+            for r in rows
+        ]
+        metric("hab_pool_in_flight", "gauge", "In-flight requests per client pool.", [(l, r["in_flight"]) for l, r in labels])
+        metric("hab_pool_utilization", "gauge", "in_flight / pool_size per client pool.", [(l, r["utilization"]) for l, r in labels])
+        metric("hab_pool_requests_total", "counter", "HTTP requests per client pool.", [(l, r["requests"]) for l, r in labels])
+        metric("hab_pool_errors_total", "counter", "Transport errors per client pool.", [(l, r["errors"]) for l, r in labels])
+
+    # concurrency.py 的自适应并发上限（开了 --adaptive_concurrency 才有）
+    concurrency = sys.modules.get("concurrency")
+    if concurrency is not None:
+        rows = concurrency.limiter_stats()
+        metric("hab_concurrency_limit", "gauge", "Current adaptive concurrency limit.", [({"limiter": r["name"]}, r["limit"]) for r in rows])
+        metric("hab_concurrency_in_flight", "gauge", "Calls holding a limiter slot.", [({"limiter": r["name"]}, r["in_flight"]) for r in rows])
+        metric("hab_concurrency_throttled_total", "counter", "Calls that saw a 429/503/529.", [({"limiter": r["name"]}, r["throttled"]) for r in rows])
+        metric("hab_concurrency_increases_total", "counter", "Additive limit increases.", [({"limiter": r["name"]}, r["increases"]) for r in rows])
+        metric("hab_concurrency_decreases_total", "counter", "Multiplicative limit decreases.", [({"limiter": r["name"]}, r["decreases"]) for r in rows])
+        metric("hab_concurrency_latency_baseline_seconds", "gauge", "Long-window latency EWMA.", [({"limiter": r["name"]}, r["long_latency"]) for r in rows])
+    return "\n".join(lines) + "\n"
+
+
+def _start_metrics_server(tracker: ProgressTracker, port: int, host: str = "127.0.0.1"):
+    # http.server 要 ~30ms，只有开了 --metrics_port 才 import
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") not in ("/metrics", ""):
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = render_prometheus(tracker).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving metrics on http://{host}:{server.server_port}/metrics")
+    return server
+
+
+def _plain_line(snap: Dict[str, Any]) -> str:
+    parts = []
+    for stage, s in sorted(snap["stages"].items()):
+        parts.append(
+            f"{stage}: {s['completed']}/{s['total']} done, {s['failed']} failed, "
+            f"{s['in_flight']} in flight, {s['calls_per_s']:.2f} calls/s, "
+            f"{s['tokens_per_s']:.0f} tok/s, ETA {_fmt_eta(s['eta_seconds'])}"
+        )
+    return " | ".join(parts)
+
+
+def _rich_table(snap: Dict[str, Any]):
+    from rich.table import Table
+
+    table = Table(title=f"elapsed {_fmt_eta(snap['elapsed'])}", expand=False)
+    for col in ("stage", "provider", "done", "failed", "in flight", "retries", "err rate", "calls/s", "tok/s", "ETA"):
+        table.add_column(col, justify="right" if col not in ("stage", "provider") else "left")
+    stages = snap["stages"]
+    for p in snap["providers"]:
+        table.add_row(
+            p["stage"], p["provider"], str(p["completed"]), str(p["failed"]), str(p["in_flight"]),
+            str(p["retries"]), f"{p['error_rate']:.1%}", "", "", "",
+        )
+    for stage, s in sorted(stages.items()):
+        table.add_row(
+            stage, "[bold]all[/bold]", f"{s['completed']}/{s['total']}", str(s["failed"]),
+            str(s["in_flight"]), str(s["retries"]), "", f"{s['calls_per_s']:.2f}",
+            f"{s['tokens_per_s']:.0f}", _fmt_eta(s["eta_seconds"]),
+        )
+    return table
+
+
+def _start_display(tracker: ProgressTracker, refresh_seconds: float):
+    stop = threading.Event()
+
+    if importlib.util.find_spec("rich") is not None:
+        from rich.live import Live
+
+        live = Live(_rich_table(tracker.snapshot()), refresh_per_second=max(1, int(1 / refresh_seconds)), transient=False)
+        live.start()
+
+        def loop():
+            while not stop.wait(refresh_seconds):
+                live.update(_rich_table(tracker.snapshot()))
+
+        def close():
+            stop.set()
+            live.update(_rich_table(tracker.snapshot()))
+            live.stop()
+
+    else:
+
+        def loop():
+            while not stop.wait(refresh_seconds):
+                sys.stderr.write("\r" + _plain_line(tracker.snapshot()) + "\033[K")
+                sys.stderr.flush()
+
+        def close():
+            stop.set()
+            sys.stderr.write("\r" + _plain_line(tracker.snapshot()) + "\033[K\n")
+            sys.stderr.flush()
+
+    threading.Thread(target=loop, daemon=True).start()
+    return close
+
+
+_TRACKER: NullTracker = NullTracker()
+
+
+def get_tracker() -> NullTracker:
+    return _TRACKER
+
+
+def enable_progress(
+    display: bool = True,
+    metrics_port: Optional[int] = None,
+    refresh_seconds: float = 1.0,
+) -> ProgressTracker:
+    """打开进度统计；display=True 起终端面板，metrics_port 不为 None 起 /metrics（0 = 随机端口）。"""
+    global _TRACKER
+    tracker = ProgressTracker()
+    if display:
+        tracker._closers.append(_start_display(tracker, refresh_seconds))
+    if metrics_port is not None:
+        server = _start_metrics_server(tracker, metrics_port)
+        tracker._closers.append(server.shutdown)
+    _TRACKER = tracker
+    return tracker
+
+
+def usage_tokens(response: Any) -> int:
+    """从 OpenAI / Anthropic / Gemini / llama.cpp 的返回里取 token 数，取不到返回 0。"""
+    if isinstance(response, dict):
+        usage = response.get("usage") or {}
+        return int(usage.get("total_tokens") or 0)
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        total = getattr(usage, "total_tokens", None)
+        if total is None:
+            total = (getattr(usage, "input_tokens", 0) or 0) + (getattr(usage, "output_tokens", 0) or 0)
+        return int(total or 0)
+    meta = getattr(response, "usage_metadata", None)
+    if meta is not None:
+        return int(getattr(meta, "total_token_count", 0) or 0)
+    return 0
@@ -0,0 +1,329 @@
+import importlib
+import importlib.util
+import json
+import os
+import threading
+from typing import Dict, Any, Callable, Iterable, Optional, Tuple
+
+from clients import DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT, configure_gemini, get_client, get_gemini_model
+from concurrency import call_slot
+
+# provider 适配层：provider 名 -> 生成脚本模块 + 它用的 SDK。
+# 生成脚本和 SDK 都只在 build_generator / build_judge 真正选中这个 provider 时才 import，
+# 所以 CLI / worker 进程启动时不用付 openai（~1s）和 google.generativeai 的 import 成本。
+# prewarm() 可以在后台线程里提前 import 选中 provider 的 SDK，和读数据集 / 做计划重叠。
+# judge 也走这一层：ChatAdapter 把 OpenAI / Anthropic / Gemini / 本地模型的一次 chat 调用统一成
+# complete(model, system, prompt, temperature) -> (text, response)，任何 provider 的模型都能当 judge。
+
+
+# provider -> 生成脚本模块 + 默认 model（和各个 generate_model_answers_*.py 保持一致）+ SDK
+GEN_PROVIDERS: Dict[str, Dict[str, str]] = {
+    "gpt": {"module": "generate_model_answers_gpt", "default_model": "gpt-4.1-mini", "sdk": "openai"},
+    "claude": {
+        "module": "generate_model_answers_anthropic",
+        "default_model": "claude-3-7-sonnet-latest",
+        "sdk": "anthropic",
+    },
+    "gemini": {
+        "module": "generate_model_answers_gemini",
+        "default_model": "gemini-2.5-pro",
+        "sdk": "google.generativeai",
+    },
+    "grok": {"module": "generate_model_answers_grok", "default_model": "x-ai/grok-3", "sdk": "openai"},
+    "llama": {
+        "module": "generate_model_answers_llama",
+        "default_model": "meta-llama/llama-4-maverick",
+        "sdk": "openai",
+    },
+    # 本地 llama.cpp 模型，model 写 GGUF 文件路径
+    "local": {
+        "module": "local_model",
+        "default_model": os.environ.get("LOCAL_MODEL_PATH", "./models/local.gguf"),
+        "sdk": "llama_cpp",
+    },
+}
+
+
+def parse_model_spec(spec: str) -> Tuple[str, str]:
+    """
+    "provider:model" -> (provider, model)；只写 provider 时用默认 model。
+    只按第一个冒号切，OpenRouter 的 "xxx:free" 这类名字不受影响。
+    """
+    provider, _, model = spec.strip().partition(":")
+    if provider not in GEN_PROVIDERS:
+        raise ValueError(
+            f"Unknown provider '{provider}'. Available providers: {list(GEN_PROVIDERS.keys())}"
+        )
+    return provider, model or GEN_PROVIDERS[provider]["default_model"]
+
+
+# judge 名前缀的别名；没有已知前缀的 judge 名都当 OpenAI model 名（兼容 "gpt-4.1-mini" 这种老写法）
+JUDGE_PROVIDER_ALIASES: Dict[str, str] = {"openai": "gpt", "anthropic": "claude", "openrouter": "grok"}
+
+
+def parse_judge_spec(judge: str) -> Tuple[str, str]:
+    """
+    "claude:claude-3-7-sonnet-latest" -> ("claude", "claude-3-7-sonnet-latest")，
+    "gpt-4.1-mini" -> ("gpt", "gpt-4.1-mini")，"local:<gguf>" -> ("local", "<gguf>")。
+    """
+    prefix, sep, model = judge.strip().partition(":")
+    provider = JUDGE_PROVIDER_ALIASES.get(prefix, prefix)
+    if sep and provider in GEN_PROVIDERS:
+        return provider, model or GEN_PROVIDERS[provider]["default_model"]
+    return "gpt", judge.strip()
+
+
+def extract_json_object(content: str) -> Dict[str, Any]:
+    """
+    小模型经常在 JSON 外面包 ```json ... ``` 或者多说几句，
+    这里先整体 parse，失败再取第一个 { 到最后一个 } 之间的部分。
+    """
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        start, end = content.find("{"), content.rfind("}")
+        if start == -1 or end <= start:
+            raise
+        return json.loads(content[start : end + 1])
+
+
+class ChatAdapter:
+    """一次 system + user 的 chat 调用，返回 (text, 原始 response)；response 用来统计 token。"""
+
+    provider = ""
+
+    def complete(self, model: str, system: str, prompt: str, temperature: float) -> Tuple[str, Any]:
+        raise NotImplementedError
+
+    def loads(self, content: str) -> Dict[str, Any]:
+        # OpenAI 的 judge 一直只接受纯 JSON；其他 provider 常带 ```json，见子类
+        return json.loads(content)
+
+
+class OpenAIChat(ChatAdapter):
+    """OpenAI 以及 OpenRouter 等 OpenAI 兼容 endpoint。"""
+
+    provider = "openai"
+
+    def __init__(self, client):
+        self.client = client
+
+    def complete(self, model: str, system: str, prompt: str, temperature: float) -> Tuple[str, Any]:
+        response = self.client.chat.completions.create(
+            model=model,
+            temperature=temperature,
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": prompt},
+            ],
+        )
+        return response.choices[0].message.content, response
+
+
+class AnthropicChat(ChatAdapter):
+    provider = "anthropic"
+
+    def __init__(self, client, max_tokens: int = 1024):
+        self.client = client
+        self.max_tokens = max_tokens
+
+    def complete(self, model: str, system: str, prompt: str, temperature: float) -> Tuple[str, Any]:
+        message = self.client.messages.create(
+            model=model,
+            max_tokens=self.max_tokens,
+            temperature=temperature,
+            system=system,
+            messages=[{"role": "user", "content": prompt}],
+        )
+        # content 是 block list，只拼 text block
+        text = "".join(block.text for block in message.content if getattr(block, "type", None) == "text")
+        return text.strip(), message
+
+    def loads(self, content: str) -> Dict[str, Any]:
+        return extract_json_object(content)
+
+
+class GeminiChat(ChatAdapter):
+    """GenerativeModel 按 (model, system instruction) 在 clients 里缓存，需要先 configure_gemini。"""
+
+    provider = "gemini"
+
+    def complete(self, model: str, system: str, prompt: str, temperature: float) -> Tuple[str, Any]:
+        response = get_gemini_model(model, system_instruction=system).generate_content(
+            prompt,
+            generation_config={"temperature": temperature, "response_mime_type": "application/json"},
+        )
+        return response.text, response
+
+    def loads(self, content: str) -> Dict[str, Any]:
+        return extract_json_object(content)
+
+
+class LocalChat(ChatAdapter):
+    """本地 llama.cpp 模型（LocalModel）；model 参数只是 label。"""
+
+    provider = "local"
+
+    def __init__(self, local_model):
+        self.local_model = local_model
+
+    def complete(self, model: str, system: str, prompt: str, temperature: float) -> Tuple[str, Any]:
+        with call_slot():
+            return self.local_model.chat(system, prompt, temperature=temperature), None
+
+    def loads(self, content: str) -> Dict[str, Any]:
+        return extract_json_object(content)
+
+
+def as_chat_adapter(client) -> ChatAdapter:
+    """兼容老调用方：直接传 OpenAI client 的当 OpenAIChat。"""
+    return client if isinstance(client, ChatAdapter) else OpenAIChat(client)
+
+
+def get_chat_adapter(
+    judge: str,
+    local_threads: Optional[int] = None,
+    pool_size: int = DEFAULT_POOL_SIZE,
+    timeout: float = DEFAULT_TIMEOUT,
+) -> ChatAdapter:
+    """按 judge spec 的 provider 建（缓存的）client，endpoint / key 和生成脚本一致。"""
+    provider, model = parse_judge_spec(judge)
+    if provider == "local":
+        local_model = importlib.import_module("local_model")
+        return LocalChat(local_model.get_local_model(model, n_threads=local_threads))
+    if provider == "gpt":
+        return OpenAIChat(get_client("openai", pool_size=pool_size, timeout=timeout))
+    if provider in ("grok", "llama"):
+        return OpenAIChat(
+            get_client(
+                "openai",
+                base_url="https://openrouter.ai/api/v1",
+                api_key=os.environ.get("OPENROUTER_API_KEY", "your_key_here"),
+                pool_size=pool_size,
+                timeout=timeout,
+            )
+        )
+    if provider == "claude":
+        return AnthropicChat(
+            get_client(
+                "anthropic",
+                base_url="https://api.openai-proxy.org/anthropic",
+                api_key=os.environ.get("ANTHROPIC_API_KEY", "your_key_here"),
+                pool_size=pool_size,
+                timeout=timeout,
+            )
+        )
+    if provider == "gemini":
+        configure_gemini(
+            api_key=os.environ.get("GEMINI_API_KEY", "your_key_here"),
+            transport="rest",
+            api_endpoint="https://api.openai-proxy.org/google",
+        )
+        return GeminiChat()
+    raise ValueError(f"Unknown judge provider '{provider}'")
+
+
+def build_generator(
+    provider: str,
+    local_threads: Optional[int] = None,
+    pool_size: int = DEFAULT_POOL_SIZE,
+    timeout: float = DEFAULT_TIMEOUT,
+) -> Callable[[str, str, float], str]:
+    """
+    返回统一签名的 generate(model, question, temperature) -> answer。
+    只 import 实际用到的 provider 的脚本（以及它的 SDK）。
+    """
+    mod = importlib.import_module(GEN_PROVIDERS[provider]["module"])
+
+    if provider == "local":
+        return lambda model, q, t: mod.generate_answer_for_question(
+            client=mod.get_local_model(model, n_threads=local_threads),
+            model=model,
+            question=q,
+            temperature=t,
+        )
+    if provider == "gpt":
+        client = get_client("openai", pool_size=pool_size, timeout=timeout)
+        return lambda model, q, t: mod.generate_answer_for_question(
+            client=client, model=model, question=q, temperature=t
+        )
+    if provider in ("grok", "llama"):
+        client = get_client(
+            "openai",
+            base_url="https://openrouter.ai/api/v1",
+            api_key=os.environ.get("OPENROUTER_API_KEY", "your_key_here"),
+            pool_size=pool_size,
+            timeout=timeout,
+        )
+        return lambda model, q, t: mod.generate_answer_for_question(
+            client=client, model=model, question=q, temperature=t
+        )
+    if provider == "claude":
+        client = get_client(
+            "anthropic",
+            base_url="https://api.openai-proxy.org/anthropic",
+            api_key=os.environ.get("ANTHROPIC_API_KEY", "your_key_here"),
+            pool_size=pool_size,
+            timeout=timeout,
+        )
+        return lambda model, q, t: mod.generate_answer_for_question(
+            client=client, model_name=model, question=q, temperature=t
+        )
+    if provider == "gemini":
+        configure_gemini(
+            api_key=os.environ.get("GEMINI_API_KEY", "your_key_here"),
+            transport="rest",
+            api_endpoint="https://api.openai-proxy.org/google",
+        )
+        return lambda model, q, t: mod.generate_answer_for_question(
+            model_name=model, question=q, temperature=t
+        )
+    raise ValueError(f"Unknown provider '{provider}'")
+
+
+def build_judge(
+    judge_model: str,
+    local_threads: Optional[int] = None,
+    pool_size: int = DEFAULT_POOL_SIZE,
+    timeout: float = DEFAULT_TIMEOUT,
+) -> Callable[[Dict[str, Any], str, str, float], Dict[str, Any]]:
+    """
+    返回 judge(record, metric_name, rubric, temperature) -> eval_data。
+    judge_model 是 parse_judge_spec 认的写法："claude:<model>"、"gemini:<model>"、"local:<gguf path>"，
+    没有 provider 前缀的当 OpenAI model 名。
+    """
+    evaluate_single_answer = importlib.import_module("evaluate_answers").evaluate_single_answer
+    client = get_chat_adapter(judge_model, local_threads=local_threads, pool_size=pool_size, timeout=timeout)
+    return lambda rec, metric_name, rubric, t: evaluate_single_answer(
+        client=client,
+        model=judge_model,
+        record=rec,
+        metric_name=metric_name,
+        rubric=rubric,
+        temperature=t,
+    )
+
+
+def judge_sdk(judge_model: str) -> str:
+    return GEN_PROVIDERS[parse_judge_spec(judge_model)[0]]["sdk"]
+
+
+def prewarm(sdks: Iterable[str]) -> threading.Thread:
+    """
+    后台线程里 import 这些 SDK（装了的才 import），返回线程。
+    之后 get_client 里的 import 直接命中 sys.modules；import 锁保证不会重复执行。
+    """
+
+    def run():
+        for name in sdks:
+            try:
+                if importlib.util.find_spec(name.split(".")[0]) is not None:
+                    importlib.import_module(name)
+            except Exception as e:
+                # 真正建 client 时还会再报一次，这里只提示
+                print(f"[WARN] Prewarm import of {name} failed: {e}")
+
+    sdks = list(dict.fromkeys(sdks))
+    thread = threading.Thread(target=run, name="hab-prewarm", daemon=True)
+    thread.start()
+    return thread
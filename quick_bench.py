@@ -0,0 +1,532 @@
+import argparse
+import glob
+import json
+import math
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from irt import item_id
+from records import dumps_line
+from regression import evaluation_files, load_scores
+from run_pipeline import dataset_name, load_dataset
+
+# 快速模式：改了 system prompt / 生成参数想马上看效果时，不跑全量，只抽一个分层样本。
+# 总体是 (数据集 question, metric) 的全部组合，按 (数据集, metric, 难度档) 分层：
+#   难度：irt.py fit 的 b（--items_json），没有就用历史评估里这道题的平均分；没出现过的题单独一层。
+#   scenario：题目里带着 adding_entropy.txt 的哪个场景修饰语，层内就按场景排序后等距抽样
+#   （隐式分层），场景覆盖均匀，又不会把层切得太碎。只认题目里原样出现的修饰语；现在的数据集里
+#   一道都没有，这一步就退化成层内随机顺序（会打 WARN，plan 里 scenario_stratification=false）。
+# 每层的标准差用历史分数估（同一个 (模型, judge) 层内题间方差的平均），Neyman 分配把样本量定到
+# 总均分 95% CI 宽度 <= --ci_width。抽中的题并发生成 + judge，按分层估计量给出均分和误差棒。
+#
+#   python quick_bench.py --models gpt,claude --judges gpt-4.1-mini --ci_width 0.5
+#   python quick_bench.py --models gpt --items_json ./results/irt/items.json --plan_only
+
+Z_95 = 1.96
+DEFAULT_SD = 1.0
+NEW_BIN = "new"
+PRIOR_VAR_WEIGHT = 2
+OTHER_SCENARIO = "(other)"
+SCENARIO_PREFIX = re.compile(r"^consider a scenario\s+(where|in which|involving|with|that involves)?\s*", re.IGNORECASE)
+
+
+def default_datasets() -> List[str]:
+    return sorted(glob.glob("./examples_for_generation/*.csv"))
+
+
+def load_modifiers(path: str) -> List[str]:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def modifier_phrase(modifier: str) -> str:
+    """"Consider a scenario where the user faces X" -> "the user faces x"，用来在题目里找这个修饰语。"""
+    return SCENARIO_PREFIX.sub("", modifier.strip().rstrip(".")).lower()
+
+
+def tag_scenarios(questions: List[str], modifiers: List[str]) -> List[str]:
+    """
+    题目里原样带着某个修饰语（用 adding_entropy.txt 扩写出来的题）就归到那个场景，否则 OTHER_SCENARIO。
+    只认原文短语：试过按关键词相似度猜，对手写的题基本是乱配，反而把抽样弄偏。
+    """
+    phrases = sorted(((modifier_phrase(m), m) for m in modifiers), key=lambda pm: -len(pm[0]))
+    tags = []
+    for question in questions:
+        text = question.lower()
+        tags.append(next((m for phrase, m in phrases if phrase and phrase in text), OTHER_SCENARIO))
+    return tags
+
+
+def build_population(
+    datasets: List[str],
+    metrics: List[str],
+    modifiers: List[str],
+    difficulty: Dict[str, float],
+) -> List[Dict[str, Any]]:
+    items = []
+    for path in datasets:
+        ds = dataset_name(path)
+        questions = load_dataset(path)
+        scenarios = tag_scenarios(questions, modifiers)
+        for q_idx, (question, scenario) in enumerate(zip(questions, scenarios)):
+            for metric in metrics:
+                iid = item_id(question, metric)
+                items.append(
+                    {
+                        "dataset": ds,
+                        "question_id": q_idx,
+                        "question": question,
+                        "metric": metric,
+                        "item_id": iid,
+                        "scenario": scenario,
+                        "difficulty": difficulty.get(iid),
+                    }
+                )
+    return items
+
+
+def history_stats(
+    scores: Dict[Tuple[str, str, str, str], float]
+) -> Tuple[Dict[str, float], Dict[str, Dict[Tuple[str, str], float]]]:
+    """(item_id -> 难度 = -历史均分, item_id -> {(model, judge): 分数})。"""
+    by_item: Dict[str, Dict[Tuple[str, str], float]] = {}
+    for (model, judge, _, iid), score in scores.items():
+        by_item.setdefault(iid, {})[(model, judge)] = score
+    difficulty = {iid: -float(np.mean(list(s.values()))) for iid, s in by_item.items()}
+    return difficulty, by_item
+
+
+def assign_strata(items: List[Dict[str, Any]], n_bins: int, min_per_stratum: int) -> Dict[str, List[Dict[str, Any]]]:
+    """(数据集, metric) 内按难度分位数切 n_bins 档；题少时少切几档，保证每档至少能抽 min_per_stratum 道。"""
+    groups: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+    for it in items:
+        groups.setdefault((it["dataset"], it["metric"]), []).append(it)
+    strata: Dict[str, List[Dict[str, Any]]] = {}
+    for (ds, metric), members in sorted(groups.items()):
+        known = sorted((it for it in members if it["difficulty"] is not None), key=lambda it: it["difficulty"])
+        bins = max(1, min(n_bins, len(known) // max(min_per_stratum, 1)))
+        for rank, it in enumerate(known):
+            it["stratum"] = f"{ds}|{metric}|d{rank * bins // len(known) + 1}of{bins}"
+        for it in members:
+            if it["difficulty"] is None:
+                it["stratum"] = f"{ds}|{metric}|{NEW_BIN}"
+            strata.setdefault(it["stratum"], []).append(it)
+    return strata
+
+
+def stratum_sds(
+    strata: Dict[str, List[Dict[str, Any]]],
+    by_item: Dict[str, Dict[Tuple[str, str], float]],
+    default_sd: float,
+) -> Dict[str, float]:
+    """
+    每层题间标准差：对历史里每个 (model, judge) 分别算层内方差再平均（不掺进模型之间的差异）。
+    历史不够（< 2 道有分数的题）的层用 default_sd。
+    """
+    sds = {}
+    for key, members in strata.items():
+        per_pair: Dict[Tuple[str, str], List[float]] = {}
+        for it in members:
+            for pair, score in by_item.get(it["item_id"], {}).items():
+                per_pair.setdefault(pair, []).append(score)
+        variances = [np.var(v, ddof=1) for v in per_pair.values() if len(v) >= 2]
+        sds[key] = math.sqrt(float(np.mean(variances))) if variances else default_sd
+    return sds
+
+
+def stratified_variance(sizes: Dict[str, int], sds: Dict[str, float], alloc: Dict[str, int]) -> float:
+    total = sum(sizes.values())
+    var = 0.0
+    for key, N in sizes.items():
+        n = alloc.get(key, 0)
+        if n <= 0:
+            continue
+        w = N / total
+        var += w * w * (1 - n / N) * sds[key] ** 2 / n
+    return var
+
+
+def neyman_allocation(
+    sizes: Dict[str, int],
+    sds: Dict[str, float],
+    ci_width: float,
+    min_per_stratum: int = 2,
+    max_items: Optional[int] = None,
+) -> Dict[str, int]:
+    """
+    让总均值的 95% CI 宽度 <= ci_width 的最小样本 + Neyman 分配（n_h ∝ N_h S_h）。
+    n_h 超过 N_h 的层直接全取（不贡献方差），剩下的层重新算，直到没有层超。
+    """
+    total = sum(sizes.values())
+    target_var = (ci_width / (2 * Z_95)) ** 2
+    census: Dict[str, int] = {}
+    alloc: Dict[str, float] = {}
+    while True:
+        rest = [k for k in sizes if k not in census]
+        ws = {k: sizes[k] / total * sds[k] for k in rest}
+        sum_ws = sum(ws.values())
+        if not rest or sum_ws == 0:
+            alloc = {k: 0.0 for k in rest}
+            break
+        fpc = sum(sizes[k] / total * sds[k] ** 2 for k in rest) / total
+        n_rest = sum_ws**2 / (target_var + fpc)
+        alloc = {k: n_rest * ws[k] / sum_ws for k in rest}
+        over = [k for k in rest if alloc[k] >= sizes[k]]
+        if not over:
+            break
+        for k in over:
+            census[k] = sizes[k]
+    result = dict(census)
+    for k, n in alloc.items():
+        result[k] = min(sizes[k], max(math.ceil(n), min_per_stratum))
+
+    if max_items is not None and sum(result.values()) > max_items:
+        result = rescale_allocation(result, max_items)
+    return result
+
+
+def rescale_allocation(alloc: Dict[str, int], max_items: int) -> Dict[str, int]:
+    """
+    按比例缩到 max_items，最大余数法取整（总数正好等于上限）。
+    每层至少 1 道，否则那一层就估不出来了；层数比上限还多时总数会超过 max_items。
+    """
+    total = sum(alloc.values())
+    quotas = {k: n * max_items / total for k, n in alloc.items()}
+    result = {k: max(1, math.floor(q)) for k, q in quotas.items()}
+    left = max_items - sum(result.values())
+    by_remainder = sorted(quotas, key=lambda k: (-(quotas[k] - math.floor(quotas[k])), k))
+    for k in by_remainder[: max(left, 0)]:
+        result[k] += 1
+    return result
+
+
+def systematic_sample(
+    strata: Dict[str, List[Dict[str, Any]]], alloc: Dict[str, int], rng: np.random.Generator
+) -> List[Dict[str, Any]]:
+    """层内按 (scenario, 随机数) 排序后等距抽样，随机起点。"""
+    picked = []
+    for key, members in sorted(strata.items()):
+        n = alloc.get(key, 0)
+        if n <= 0:
+            continue
+        tiebreak = rng.random(len(members))
+        order = sorted(range(len(members)), key=lambda i: (members[i]["scenario"], tiebreak[i]))
+        step = len(members) / n
+        start = rng.random() * step
+        picked.extend(members[order[int(start + k * step)]] for k in range(n))
+    return picked
+
+
+def stratified_estimate(
+    observed: Dict[str, List[float]], sizes: Dict[str, int], planning_sds: Dict[str, float]
+) -> Optional[Dict[str, Any]]:
+    """
+    分层均值和 95% CI。层内方差往规划时的标准差收缩（PRIOR_VAR_WEIGHT 个伪观测）；
+    一个分数都没有的层（全失败）从总体里去掉并重算权重，missing_strata 里记下来。
+    """
+    covered = {k: v for k, v in observed.items() if v and k in sizes}
+    if not covered:
+        return None
+    total = sum(sizes[k] for k in covered)
+    mean, var = 0.0, 0.0
+    for key, ys in covered.items():
+        N, n = sizes[key], len(ys)
+        w = N / total
+        # 层内只抽了两三道时样本方差很不稳（两道同分就是 0），往规划用的方差上收缩
+        prior = planning_sds[key] ** 2
+        s2 = prior
+        if n >= 2:
+            s2 = ((n - 1) * float(np.var(ys, ddof=1)) + PRIOR_VAR_WEIGHT * prior) / (n - 1 + PRIOR_VAR_WEIGHT)
+        mean += w * float(np.mean(ys))
+        var += w * w * max(0.0, 1 - n / N) * s2 / n
+    half = Z_95 * math.sqrt(var)
+    return {
+        "mean": mean,
+        "ci_low": mean - half,
+        "ci_high": mean + half,
+        "n": sum(len(v) for v in covered.values()),
+        "population": total,
+        "missing_strata": sorted(k for k in sizes if k not in covered),
+    }
+
+
+def estimate_cost(items: List[Dict[str, Any]], models: List[Tuple[str, str]], judges: List[str], cost_model) -> float:
+    questions = {it["question"] for it in items}
+    usd = 0.0
+    for _, model in models:
+        usd += sum(cost_model.generate(model, q)[2] for q in questions)
+        for judge in judges:
+            usd += sum(cost_model.evaluate(judge, it["metric"], it["question"], None)[2] for it in items)
+    return usd
+
+
+def run_sample(
+    sample: List[Dict[str, Any]],
+    models: List[Tuple[str, str]],
+    judges: List[str],
+    args,
+) -> List[Dict[str, Any]]:
+    """每个 (模型, question) 生成一次，生成完立刻把它的各个 (metric, judge) 交给评估线程池。"""
+    from evaluate_answers import METRIC_RUBRICS
+    from providers import build_generator, build_judge
+
+    client_opts = {"pool_size": args.pool_size, "timeout": args.timeout}
+    generators = {p: build_generator(p, **client_opts) for p in sorted({p for p, _ in models})}
+    judge_fns = {j: build_judge(j, **client_opts) for j in judges}
+    by_question: Dict[Tuple[str, int], List[Dict[str, Any]]] = {}
+    for it in sample:
+        by_question.setdefault((it["dataset"], it["question_id"]), []).append(it)
+
+    lock = threading.Lock()
+    records: List[Dict[str, Any]] = []
+    eval_futures = []
+    gen_pool = ThreadPoolExecutor(max_workers=max(args.gen_workers, 1))
+    eval_pool = ThreadPoolExecutor(max_workers=max(args.eval_workers, 1))
+    os.makedirs(os.path.dirname(os.path.abspath(args.output_jsonl)), exist_ok=True)
+    out_f = open(args.output_jsonl, "w", encoding="utf-8")
+
+    def judge_one(provider: str, model: str, judge: str, it: Dict[str, Any], answer: str) -> None:
+        rubric = METRIC_RUBRICS[it["metric"]]
+        rec = {"question_id": it["question_id"], "question": it["question"], "answer": answer}
+        try:
+            eval_data = judge_fns[judge](rec, it["metric"], rubric, args.judge_temperature)
+            score = int(eval_data.get("score"))
+        except Exception as e:
+            print(f"[ERROR] Evaluation failed for {it['stratum']} question_id={it['question_id']} judge={judge}: {e}")
+            return
+        out_record = dict(
+            rec,
+            metric=it["metric"],
+            rubric=rubric,
+            score=score,
+            justification=eval_data.get("justification", ""),
+            eval_meta={
+                "model": judge,
+                "temperature": args.judge_temperature,
+                "answer_model": model,
+                "answer_provider": provider,
+                "dataset": it["dataset"],
+                "stratum": it["stratum"],
+                "scenario": it["scenario"],
+            },
+        )
+        line = dumps_line(out_record)
+        with lock:
+            out_f.write(line)
+            records.append(out_record)
+
+    def generate_one(provider: str, model: str, members: List[Dict[str, Any]]) -> None:
+        question = members[0]["question"]
+        try:
+            answer = generators[provider](model, question, args.temperature)
+        except Exception as e:
+            print(f"[ERROR] Generation failed for {provider}:{model} dataset={members[0]['dataset']} "
+                  f"question_id={members[0]['question_id']}: {e}")
+            return
+        with lock:
+            for it in members:
+                for judge in judges:
+                    eval_futures.append(eval_pool.submit(judge_one, provider, model, judge, it, answer))
+
+    gen_futures = [
+        gen_pool.submit(generate_one, provider, model, members)
+        for provider, model in models
+        for members in by_question.values()
+    ]
+    for fut in gen_futures:
+        fut.result()
+    gen_pool.shutdown()
+    # 生成全部结束后 eval_futures 不会再增加
+    for fut in eval_futures:
+        fut.result()
+    eval_pool.shutdown()
+    out_f.close()
+    return records
+
+
+def summarize(
+    records: List[Dict[str, Any]], sizes: Dict[str, int], sds: Dict[str, float]
+) -> List[Dict[str, Any]]:
+    """每个 (模型, judge) 一行总体估计，外加每个数据集一行。"""
+    grouped: Dict[Tuple[str, str], Dict[str, List[float]]] = {}
+    for rec in records:
+        meta = rec["eval_meta"]
+        pair = (f"{meta['answer_provider']}:{meta['answer_model']}", meta["model"])
+        grouped.setdefault(pair, {}).setdefault(meta["stratum"], []).append(float(rec["score"]))
+    rows = []
+    for (model, judge), observed in sorted(grouped.items()):
+        scopes = [("(all)", sizes)] + [
+            (ds, {k: n for k, n in sizes.items() if k.split("|")[0] == ds})
+            for ds in sorted({k.split("|")[0] for k in sizes})
+        ]
+        for scope, scope_sizes in scopes:
+            est = stratified_estimate({k: observed.get(k, []) for k in scope_sizes}, scope_sizes, sds)
+            if est is not None:
+                rows.append(dict(est, model=model, judge=judge, scope=scope))
+    return rows
+
+
+def format_rows(rows: List[Dict[str, Any]]) -> str:
+    lines = [f"{'model':<40} {'judge':<20} {'scope':<28} {'n':>5}/{'N':<5} {'mean':>6}  {'95% CI':<16}"]
+    for row in rows:
+        lines.append(
+            f"{row['model']:<40} {row['judge']:<20} {row['scope']:<28} {row['n']:>5}/{row['population']:<5} "
+            f"{row['mean']:>6.3f}  [{row['ci_low']:.3f}, {row['ci_high']:.3f}]"
+        )
+        if row["missing_strata"]:
+            lines.append(f"{'':<40} [WARN] no scores in {len(row['missing_strata'])} strata, excluded from this estimate")
+    return "\n".join(lines)
+
+
+def save_output_json(path: str, data: Dict[str, Any]) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Quick benchmark: stratified subsample sized for a target CI width, with error bars."
+    )
+    parser.add_argument(
+        "--datasets",
+        type=str,
+        default=None,
+        help="Comma-separated .txt/.csv question files (default: every CSV in ./examples_for_generation).",
+    )
+    parser.add_argument("--models", type=str, default="gpt", help="Comma-separated provider[:model] specs.")
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        default="AVOID_VALUE_MANIPULATION",
+        help="Comma-separated list of metric names, must be keys in METRIC_RUBRICS.",
+    )
+    parser.add_argument("--judges", type=str, default="gpt-4.1-mini", help="Comma-separated judge models.")
+    parser.add_argument("--ci_width", type=float, default=0.5, help="Target width of the 95%% CI of the mean score.")
+    parser.add_argument("--max_items", type=int, default=None, help="Hard cap on sampled (question, metric) items.")
+    parser.add_argument("--difficulty_bins", type=int, default=3, help="Difficulty strata per dataset and metric.")
+    parser.add_argument("--min_per_stratum", type=int, default=2, help="Sample at least this many items per stratum.")
+    parser.add_argument(
+        "--history",
+        type=str,
+        default="./results/evaluations",
+        help="Past evaluations (run_dir, file or glob) for item difficulty and per-stratum score spread.",
+    )
+    parser.add_argument(
+        "--items_json",
+        type=str,
+        default=None,
+        help="Output of 'irt.py fit'; its item difficulty b replaces the historical mean score.",
+    )
+    parser.add_argument(
+        "--scenarios",
+        type=str,
+        default="./examples_for_generation/adding_entropy.txt",
+        help="Scenario modifiers to spread the sample over within each stratum.",
+    )
+    parser.add_argument("--default_sd", type=float, default=DEFAULT_SD, help="Score SD for strata without history.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--temperature", type=float, default=0.7, help="Sampling temperature for answer generation.")
+    parser.add_argument("--judge_temperature", type=float, default=0.0)
+    parser.add_argument("--gen_workers", type=int, default=8, help="Concurrent generation calls.")
+    parser.add_argument("--eval_workers", type=int, default=8, help="Concurrent evaluation calls.")
+    parser.add_argument("--pool_size", type=int, default=16, help="HTTP connection pool size per provider client.")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds.")
+    parser.add_argument("--prices_json", type=str, default=None, help="Price overrides, as in run_pipeline.py.")
+    parser.add_argument(
+        "--output_jsonl",
+        type=str,
+        default="./results/quick/evaluations.jsonl",
+        help="Evaluation records of the sampled items (overwritten each run).",
+    )
+    parser.add_argument("--output_json", type=str, default=None, help="Also write the plan (and estimates, unless --plan_only) here.")
+    parser.add_argument("--plan_only", action="store_true", help="Print the sample plan and cost, then exit.")
+    args = parser.parse_args(argv)
+
+    from costs import CostModel, load_prices
+    from evaluate_answers import METRIC_RUBRICS
+    from providers import parse_model_spec
+
+    datasets = [p.strip() for p in args.datasets.split(",") if p.strip()] if args.datasets else default_datasets()
+    metrics = [m.strip() for m in args.metrics.split(",") if m.strip()]
+    for metric in metrics:
+        if metric not in METRIC_RUBRICS:
+            raise ValueError(f"Unknown metric {metric}. Available: {list(METRIC_RUBRICS.keys())}")
+    models = [parse_model_spec(s) for s in args.models.split(",") if s.strip()]
+    judges = [j.strip() for j in args.judges.split(",") if j.strip()]
+
+    history_files = evaluation_files(args.history)
+    difficulty, by_item = history_stats(load_scores(history_files, {}))
+    source = f"mean score in {len(history_files)} history files"
+    if args.items_json:
+        with open(args.items_json, "r", encoding="utf-8") as f:
+            difficulty = {it["item_id"]: it["b"] for it in json.load(f)["items"]}
+        source = f"IRT b from {args.items_json}"
+
+    items = build_population(datasets, metrics, load_modifiers(args.scenarios), difficulty)
+    strata = assign_strata(items, args.difficulty_bins, args.min_per_stratum)
+    sizes = {k: len(v) for k, v in strata.items()}
+    sds = stratum_sds(strata, by_item, args.default_sd)
+    alloc = neyman_allocation(sizes, sds, args.ci_width, args.min_per_stratum, args.max_items)
+    if args.max_items is not None and sum(alloc.values()) > args.max_items:
+        print(f"[WARN] {len(strata)} strata need at least one item each; sampling {sum(alloc.values())} > --max_items.")
+    sample = systematic_sample(strata, alloc, np.random.default_rng(args.seed))
+    planned_width = 2 * Z_95 * math.sqrt(stratified_variance(sizes, sds, alloc))
+
+    n_known = sum(it["difficulty"] is not None for it in items)
+    print(f"Population: {len(items)} items in {len(strata)} strata ({n_known} with difficulty from {source})")
+    print(f"{'stratum':<56} {'N':>5} {'sd':>6} {'n':>5}")
+    for key in sorted(strata):
+        print(f"{key:<56} {sizes[key]:>5} {sds[key]:>6.3f} {alloc.get(key, 0):>5}")
+    n_scenarios = len({it["scenario"] for it in sample if it["scenario"] != OTHER_SCENARIO})
+    n_tagged = sum(it["scenario"] != OTHER_SCENARIO for it in items)
+    print(
+        f"Sample: {len(sample)} items, {len({(it['dataset'], it['question_id']) for it in sample})} questions, "
+        f"{n_scenarios} scenario modifiers; planned 95% CI width {planned_width:.3f} (target {args.ci_width})"
+    )
+    if n_tagged == 0:
+        # 数据集里的题目前都是手写的，没有哪道原样带着 --scenarios 的修饰语
+        print(
+            f"[WARN] Scenario stratification unavailable: no question contains a modifier from {args.scenarios} "
+            "verbatim; questions are ordered randomly within each stratum."
+        )
+    if planned_width > args.ci_width + 1e-9:
+        print("[WARN] --max_items is too small to reach --ci_width; estimates will be wider.")
+    cost_model = CostModel(load_prices(args.prices_json))
+    quick_usd = estimate_cost(sample, models, judges, cost_model)
+    full_usd = estimate_cost(items, models, judges, cost_model)
+    print(f"Estimated cost: ${quick_usd:.2f} vs ${full_usd:.2f} for the full benchmark")
+
+    plan = {
+        "ci_width": args.ci_width,
+        "planned_ci_width": planned_width,
+        "difficulty_source": source,
+        "scenario_stratification": n_tagged > 0,
+        "n_items": len(sample),
+        "estimated_cost_usd": quick_usd,
+        "strata": {k: {"N": sizes[k], "sd": sds[k], "n": alloc.get(k, 0)} for k in sorted(strata)},
+    }
+    if args.plan_only:
+        if args.output_json:
+            save_output_json(args.output_json, {"plan": plan})
+            print(f"Saved plan to {args.output_json}")
+        return
+
+    records = run_sample(sample, models, judges, args)
+    rows = summarize(records, sizes, sds)
+    print(format_rows(rows))
+    if args.output_json:
+        save_output_json(args.output_json, {"plan": plan, "estimates": rows})
+        print(f"Saved plan and estimates to {args.output_json}")
+    print(f"Done. Saved {len(records)} evaluations to {args.output_jsonl}")
+
+
+if __name__ == "__main__":
+    main()
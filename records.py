@@ -0,0 +1,281 @@
+import hashlib
+import importlib
+import importlib.util
+import json
+import os
+from typing import Dict, Any, Iterator, Iterable, List, Optional, Tuple, Type
+
+# 各个脚本之间传递的 JSONL 记录：question / answer / sample / evaluation 四种，
+# 用 __slots__ 的轻量类型 + 严格校验。
+# 写出去的格式只有一种：标准库 json.dumps(ensure_ascii=False)（", " / ": " 分隔），和以前的结果文件逐字节一致，
+# 装没装 orjson 写出来的文件、cassette 的请求 hash 都一样。
+# 读走可插拔的 JSON codec：装了 orjson 用 orjson，其次 msgspec，都没有退回标准库 json；
+# 可以用环境变量 HAB_JSON_CODEC=orjson|msgspec|json 强制指定。
+
+
+class RecordValidationError(ValueError):
+    """记录缺字段 / 字段类型不对。"""
+
+
+# ------------------------------
+# 1. JSON codec
+# ------------------------------
+
+
+class JsonCodec:
+    """dumps(obj) -> str，永远是 json.dumps(..., ensure_ascii=False)（唯一的输出格式）；
+    loads(str|bytes) -> obj 用选中的 codec，解析失败统一抛 json.JSONDecodeError。"""
+
+    def __init__(self, name: str):
+        self.name = name
+        if name == "orjson":
+            orjson = importlib.import_module("orjson")
+            # orjson.JSONDecodeError 本身就是 json.JSONDecodeError 的子类
+            self.loads = orjson.loads
+        elif name == "msgspec":
+            msgspec = importlib.import_module("msgspec")
+            decoder = msgspec.json.Decoder()
+
+            def loads(s):
+                try:
+                    return decoder.decode(s)
+                except msgspec.DecodeError as e:
+                    raise json.JSONDecodeError(str(e), s if isinstance(s, str) else "", 0) from e
+
+            self.loads = loads
+        elif name == "json":
+            self.loads = json.loads
+        else:
+            raise ValueError(f"Unknown JSON codec '{name}'. Use orjson, msgspec or json.")
+
+    def dumps(self, obj: Any) -> str:
+        # orjson / msgspec 只输出紧凑格式，数字、NaN 的写法也和 json 不完全一样，所以写不用它们
+        return json.dumps(obj, ensure_ascii=False)
+
+    def dumps_bytes(self, obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def available_codecs() -> List[str]:
+    names = []
+    for name in ("orjson", "msgspec"):
+        if importlib.util.find_spec(name) is not None:
+            names.append(name)
+    return names + ["json"]
+
+
+def get_codec(name: Optional[str] = None) -> JsonCodec:
+    name = name or os.environ.get("HAB_JSON_CODEC")
+    if name:
+        return JsonCodec(name)
+    return JsonCodec(available_codecs()[0])
+
+
+CODEC = get_codec()
+
+
+def dumps(obj: Any) -> str:
+    return CODEC.dumps(obj)
+
+
+def loads(s) -> Any:
+    return CODEC.loads(s)
+
+
+def dumps_line(obj: Any) -> str:
+    return CODEC.dumps(obj) + "\n"
+
+
+# ------------------------------
+# 2. Typed records
+# ------------------------------
+
+_ID_TYPES = (int, str)
+
+
+def _check(cls_name: str, field: str, value: Any, types, required: bool) -> None:
+    if value is None:
+        if required:
+            raise RecordValidationError(f"{cls_name}.{field} is required")
+        return
+    # bool 是 int 的子类，question_id / score 不接受 True/False
+    if isinstance(value, bool) and bool not in types:
+        raise RecordValidationError(f"{cls_name}.{field} must be {types}, got bool")
+    if not isinstance(value, types):
+        raise RecordValidationError(
+            f"{cls_name}.{field} must be {types}, got {type(value).__name__}"
+        )
+
+
+class _Record:
+    """
+    FIELDS: (name, 允许的类型, 是否必填)。没声明的 key 放进 extra，to_dict 时原样写回，
+    所以读旧文件 / 新加字段都不会丢数据。
+    """
+
+    __slots__ = ("extra",)
+    FIELDS: Tuple[Tuple[str, tuple, bool], ...] = ()
+
+    def __init__(self, **kwargs):
+        for name, _, _ in self.FIELDS:
+            setattr(self, name, kwargs.pop(name, None))
+        self.extra: Dict[str, Any] = kwargs
+        self.validate()
+
+    def validate(self) -> None:
+        cls_name = type(self).__name__
+        for name, types, required in self.FIELDS:
+            _check(cls_name, name, getattr(self, name), types, required)
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]):
+        if not isinstance(d, dict):
+            raise RecordValidationError(f"{cls.__name__} must be a JSON object, got {type(d).__name__}")
+        return cls(**d)
+
+    def to_dict(self) -> Dict[str, Any]:
+        d: Dict[str, Any] = {}
+        for name, _, required in self.FIELDS:
+            value = getattr(self, name)
+            if value is not None or required:
+                d[name] = value
+        d.update(self.extra)
+        return d
+
+    def __eq__(self, other) -> bool:
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+def question_hash(question: str, metric: Optional[str] = None) -> str:
+    """
+    按题目内容算的稳定 id（空白规范化后 sha1 的前 16 位），和题目在哪个文件、第几行无关。
+    loaders 的去重、sharded_run 的分 shard、irt / regression / quick_bench 的 item id 都用它；
+    给了 metric 时同一道题在不同 metric 下是不同的 item。
+    """
+    text = " ".join(question.split())
+    if metric is not None:
+        text = f"{metric}\n{text}"
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+class QuestionRecord(_Record):
+    __slots__ = ("question_id", "question", "metric", "source", "question_hash")
+    FIELDS = (
+        ("question_id", _ID_TYPES, True),
+        ("question", (str,), True),
+        ("metric", (str,), False),
+        ("source", (str,), False),
+        ("question_hash", (str,), False),
+    )
+
+
+class AnswerRecord(_Record):
+    __slots__ = ("question_id", "question", "answer", "meta")
+    FIELDS = (
+        ("question_id", _ID_TYPES, False),
+        ("question", (str,), True),
+        ("answer", (str,), True),
+        ("meta", (dict,), False),
+    )
+
+
+class SampleRecord(_Record):
+    __slots__ = ("question_id", "question", "metric", "rubric", "answers")
+    FIELDS = (
+        ("question_id", _ID_TYPES, False),
+        ("question", (str,), True),
+        ("metric", (str,), True),
+        ("rubric", (str,), True),
+        ("answers", (dict,), True),
+    )
+
+    def validate(self) -> None:
+        super().validate()
+        # 和 build_prompt 的要求一致：恰好是 "1"-"5" 五个等级，每个一条回复
+        if set(self.answers) != {"1", "2", "3", "4", "5"}:
+            raise RecordValidationError(
+                f"SampleRecord.answers must have keys '1'-'5', got {sorted(self.answers)}"
+            )
+        for level, text in self.answers.items():
+            if not isinstance(text, str):
+                raise RecordValidationError(f"SampleRecord.answers[{level!r}] must be str")
+
+
+class EvaluationRecord(_Record):
+    __slots__ = (
+        "question_id",
+        "question",
+        "answer",
+        "metric",
+        "rubric",
+        "score",
+        "justification",
+        "eval_meta",
+        "score_variance",
+        "n_samples",
+    )
+    FIELDS = (
+        ("question_id", _ID_TYPES, False),
+        ("question", (str,), True),
+        ("answer", (str,), True),
+        ("metric", (str,), True),
+        ("rubric", (str,), False),
+        # judge 解析失败时 score 可能缺失，允许 None；有值就必须是 1-5 的整数
+        ("score", (int,), False),
+        ("justification", (str,), False),
+        ("eval_meta", (dict,), False),
+        # self-consistency 模式才有：多次采样的分数方差和样本数
+        ("score_variance", (float, int), False),
+        ("n_samples", (int,), False),
+    )
+
+    def validate(self) -> None:
+        super().validate()
+        if self.score is not None and not 1 <= self.score <= 5:
+            raise RecordValidationError(f"EvaluationRecord.score must be in 1..5, got {self.score}")
+
+
+# ------------------------------
+# 3. JSONL IO
+# ------------------------------
+
+
+def iter_jsonl(path: str, record_type: Optional[Type[_Record]] = None, skip_invalid: bool = True) -> Iterator[Any]:
+    """
+    逐行读 JSONL。record_type 不为 None 时返回校验过的 typed record，否则返回 dict。
+    skip_invalid=True 时坏行打 [WARN] 跳过，否则直接抛。
+    """
+    with open(path, "rb") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                obj = CODEC.loads(line)
+                if record_type is not None:
+                    obj = record_type.from_dict(obj)
+            except (json.JSONDecodeError, RecordValidationError) as e:
+                if not skip_invalid:
+                    raise
+                print(f"[WARN] Skipping invalid line {line_no} in {path}: {e}")
+                continue
+            yield obj
+
+
+def read_jsonl(path: str, record_type: Optional[Type[_Record]] = None, skip_invalid: bool = True) -> List[Any]:
+    return list(iter_jsonl(path, record_type, skip_invalid))
+
+
+def write_jsonl(path: str, records: Iterable[Any], append: bool = False) -> int:
+    """records 可以是 dict 也可以是 typed record。返回写出的行数。"""
+    n = 0
+    with open(path, "ab" if append else "wb") as f:
+        for rec in records:
+            if isinstance(rec, _Record):
+                rec = rec.to_dict()
+            f.write(CODEC.dumps_bytes(rec) + b"\n")
+            n += 1
+    return n
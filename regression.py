@@ -0,0 +1,251 @@
+import argparse
+import glob
+import json
+import math
+import os
+import sys
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from irt import item_id
+from jsonl_index import record_model
+from records import iter_jsonl
+
+# 两次运行之间的回归检测（provider 偷偷更新了 *-latest 之类）：
+# 按 (被测模型, judge, metric, 题) 对齐 baseline 和 candidate 的分数，题用 question 文本的 hash（irt.item_id），
+# 不依赖 question_id 下标。每个 (模型, judge, metric) 分组算逐题的分差，配对 bootstrap（向量化，见 bootstrap_means）
+# 给均值差的置信区间和双侧 p 值，所有分组一起做 Benjamini–Hochberg。
+# 均值下降超过 --min_delta 且 q < --alpha 的分组记为回归，有回归就 exit 1，可以直接挂在 nightly 任务后面。
+#
+#   python regression.py --baseline ./results/runs/2025-06-01 --candidate ./results/runs/2025-06-02
+#   python regression.py --baseline './old/out_*.jsonl' --candidate './new/out_*.jsonl' --output_json report.json
+
+# 每块 bootstrap 最多这么多个元素（B_chunk × n），控制内存
+BOOTSTRAP_CHUNK = 4_000_000
+MULTINOMIAL_MAX_VALUES = 64
+OVERALL = "(all metrics)"
+
+
+def evaluation_files(spec: str) -> List[str]:
+    """run_dir（取 evaluations/ 下的文件）、单个文件或 glob。"""
+    if os.path.isdir(spec):
+        sub = os.path.join(spec, "evaluations")
+        root = sub if os.path.isdir(sub) else spec
+        return sorted(glob.glob(os.path.join(root, "**", "*.jsonl"), recursive=True))
+    return sorted(glob.glob(spec, recursive=True))
+
+
+def load_scores(paths: List[str], model_map: Dict[str, str]) -> Dict[Tuple[str, str, str, str], float]:
+    """
+    (model, judge, metric, item_id) -> 平均分（resume 重复写 / 多次评估取平均）。
+    model_map 把这边的模型名改成另一边的（比较两个不同版本的模型时用）。
+    """
+    sums: Dict[Tuple[str, str, str, str], List[float]] = {}
+    item_ids: Dict[Tuple[str, str], str] = {}
+    for path in paths:
+        file_model = record_model(path, {})
+        for rec in iter_jsonl(path):
+            score = rec.get("score")
+            if not isinstance(score, (int, float)) or isinstance(score, bool) or "metric" not in rec:
+                continue
+            meta = rec.get("eval_meta") or {}
+            model = record_model(path, rec) if meta.get("answer_model") else file_model
+            model = model_map.get(model, model)
+            # 同一道题在每个模型 / 每次运行里都会出现，hash 只算一次
+            item = (rec.get("question", ""), rec["metric"])
+            iid = item_ids.get(item)
+            if iid is None:
+                iid = item_ids[item] = item_id(*item)
+            key = (model, meta.get("model", ""), rec["metric"], iid)
+            acc = sums.setdefault(key, [0.0, 0])
+            acc[0] += float(score)
+            acc[1] += 1
+    return {key: total / n for key, (total, n) in sums.items()}
+
+
+def bootstrap_means(deltas: np.ndarray, n_boot: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    n_boot 个重抽样均值。1-5 分的分差只有少数几个取值：对 K 个取值抽 Multinomial(n, 频率) 和逐条重抽样分布完全相同，
+    代价从 B×n 降到 B×K；取值多（平均过的分数）时才退回 B×n 的下标矩阵（分块）。
+    """
+    n = len(deltas)
+    values, counts = np.unique(deltas, return_counts=True)
+    if len(values) <= MULTINOMIAL_MAX_VALUES:
+        return rng.multinomial(n, counts / n, size=n_boot) @ values / n
+    chunk = max(1, BOOTSTRAP_CHUNK // n)
+    means = np.empty(n_boot)
+    for start in range(0, n_boot, chunk):
+        size = min(chunk, n_boot - start)
+        means[start : start + size] = deltas[rng.integers(0, n, size=(size, n))].mean(axis=1)
+    return means
+
+
+def paired_bootstrap(
+    deltas: np.ndarray, n_boot: int, rng: np.random.Generator, confidence: float = 0.95
+) -> Tuple[float, float, float]:
+    """
+    均值差的 percentile 区间和双侧 p 值。p 用 bootstrap 标准误的正态近似：
+    经验尾部比例最小只能到 1 / n_boot，分组多的时候 BH 校正后就永远显著不了。
+    """
+    n = len(deltas)
+    mean = float(deltas.mean())
+    if n < 2 or not deltas.any():
+        return mean, mean, 1.0
+    means = bootstrap_means(deltas, n_boot, rng)
+    alpha = 1.0 - confidence
+    lo, hi = np.quantile(means, [alpha / 2, 1 - alpha / 2])
+    se = float(means.std(ddof=1))
+    p = math.erfc(abs(mean) / (se * math.sqrt(2.0))) if se > 0 else 0.0
+    return float(lo), float(hi), p
+
+
+def benjamini_hochberg(p: np.ndarray) -> np.ndarray:
+    n = len(p)
+    if n == 0:
+        return p
+    order = np.argsort(p)
+    ranked = p[order] * n / np.arange(1, n + 1)
+    q = np.minimum.accumulate(ranked[::-1])[::-1]
+    out = np.empty(n)
+    out[order] = np.minimum(q, 1.0)
+    return out
+
+
+def compare(
+    baseline: Dict[Tuple[str, str, str, str], float],
+    candidate: Dict[Tuple[str, str, str, str], float],
+    n_boot: int = 2000,
+    alpha: float = 0.05,
+    min_delta: float = 0.0,
+    seed: int = 0,
+) -> List[Dict[str, Any]]:
+    """每个 (model, judge, metric) 一行，外加每个 (model, judge) 跨 metric 的汇总行。"""
+    groups: Dict[Tuple[str, str, str], List[Tuple[float, float]]] = {}
+    for key, base_score in baseline.items():
+        cand_score = candidate.get(key)
+        if cand_score is None:
+            continue
+        model, judge, metric, _ = key
+        for group in ((model, judge, metric), (model, judge, OVERALL)):
+            groups.setdefault(group, []).append((base_score, cand_score))
+    unmatched_base: Dict[Tuple[str, str, str], int] = {}
+    for key in baseline.keys() - candidate.keys():
+        unmatched_base[key[:3]] = unmatched_base.get(key[:3], 0) + 1
+    unmatched_cand: Dict[Tuple[str, str, str], int] = {}
+    for key in candidate.keys() - baseline.keys():
+        unmatched_cand[key[:3]] = unmatched_cand.get(key[:3], 0) + 1
+
+    rng = np.random.default_rng(seed)
+    rows: List[Dict[str, Any]] = []
+    for (model, judge, metric), pairs in sorted(groups.items()):
+        scores = np.asarray(pairs)
+        deltas = scores[:, 1] - scores[:, 0]
+        lo, hi, p = paired_bootstrap(deltas, n_boot, rng)
+        rows.append(
+            {
+                "model": model,
+                "judge": judge,
+                "metric": metric,
+                "n": len(deltas),
+                "baseline_mean": float(scores[:, 0].mean()),
+                "candidate_mean": float(scores[:, 1].mean()),
+                "delta": float(deltas.mean()),
+                "ci_low": lo,
+                "ci_high": hi,
+                "p_value": p,
+                "worse": int((deltas < 0).sum()),
+                "better": int((deltas > 0).sum()),
+                "unchanged": int((deltas == 0).sum()),
+                "only_baseline": unmatched_base.get((model, judge, metric), 0),
+                "only_candidate": unmatched_cand.get((model, judge, metric), 0),
+            }
+        )
+    q = benjamini_hochberg(np.array([r["p_value"] for r in rows]))
+    for row, q_value in zip(rows, q):
+        row["q_value"] = float(q_value)
+        row["regression"] = bool(q_value < alpha and row["delta"] < -min_delta)
+        row["improvement"] = bool(q_value < alpha and row["delta"] > min_delta)
+    return rows
+
+
+def format_report(rows: List[Dict[str, Any]], show_all: bool = False) -> str:
+    lines = [
+        f"{'':<3}{'model':<36} {'judge':<16} {'metric':<28} {'n':>5} {'base':>6} {'cand':>6} "
+        f"{'delta':>7} {'95% CI':>17} {'q':>7}"
+    ]
+    for row in sorted(rows, key=lambda r: r["delta"]):
+        flag = "!!" if row["regression"] else ("++" if row["improvement"] else "")
+        if not (show_all or flag or row["metric"] == OVERALL):
+            continue
+        lines.append(
+            f"{flag:<3}{row['model']:<36} {row['judge']:<16} {row['metric']:<28} {row['n']:>5} "
+            f"{row['baseline_mean']:>6.3f} {row['candidate_mean']:>6.3f} {row['delta']:>+7.3f} "
+            f"[{row['ci_low']:>+7.3f},{row['ci_high']:>+7.3f}] {row['q_value']:>7.4f}"
+        )
+    n_reg = sum(r["regression"] for r in rows)
+    n_imp = sum(r["improvement"] for r in rows)
+    lines.append(f"{n_reg} significant regressions, {n_imp} significant improvements out of {len(rows)} groups")
+    return "\n".join(lines)
+
+
+def parse_model_map(spec: Optional[str]) -> Dict[str, str]:
+    mapping: Dict[str, str] = {}
+    for pair in (spec or "").split(","):
+        if pair.strip():
+            old, sep, new = pair.partition("=")
+            if not sep:
+                raise SystemExit(f"[ERROR] --model_map entries must look like OLD=NEW, got '{pair}'")
+            mapping[old.strip()] = new.strip()
+    return mapping
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Detect score regressions between two evaluation runs.")
+    parser.add_argument("--baseline", type=str, required=True, help="Baseline run_dir, evaluation file or glob.")
+    parser.add_argument("--candidate", type=str, required=True, help="Candidate run_dir, evaluation file or glob.")
+    parser.add_argument(
+        "--model_map",
+        type=str,
+        default=None,
+        help="Compare renamed models: comma-separated BASELINE_MODEL=CANDIDATE_MODEL.",
+    )
+    parser.add_argument("--n_boot", type=int, default=2000, help="Bootstrap resamples per group.")
+    parser.add_argument("--alpha", type=float, default=0.05, help="False discovery rate for flagging groups.")
+    parser.add_argument("--min_delta", type=float, default=0.1, help="Ignore mean score changes smaller than this.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--show_all", action="store_true", help="Print every group, not only flagged / overall rows.")
+    parser.add_argument("--output_json", type=str, default=None, help="Also write the full report here.")
+    parser.add_argument("--report_only", action="store_true", help="Exit 0 even when regressions are found.")
+    args = parser.parse_args(argv)
+
+    base_files, cand_files = evaluation_files(args.baseline), evaluation_files(args.candidate)
+    for name, files in (("baseline", base_files), ("candidate", cand_files)):
+        if not files:
+            print(f"[ERROR] No evaluation files for --{name}")
+            sys.exit(2)
+    baseline = load_scores(base_files, parse_model_map(args.model_map))
+    candidate = load_scores(cand_files, {})
+    print(f"Loaded {len(baseline)} baseline and {len(candidate)} candidate scores")
+    rows = compare(baseline, candidate, args.n_boot, args.alpha, args.min_delta, args.seed)
+    if not rows:
+        print("[ERROR] No (model, judge, metric, question) overlaps between the two runs.")
+        sys.exit(2)
+    print(format_report(rows, args.show_all))
+
+    if args.output_json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output_json)), exist_ok=True)
+        with open(args.output_json, "w", encoding="utf-8") as f:
+            json.dump(
+                {"baseline": args.baseline, "candidate": args.candidate, "alpha": args.alpha, "groups": rows},
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+        print(f"Done. Saved report to {args.output_json}")
+    if any(r["regression"] for r in rows) and not args.report_only:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
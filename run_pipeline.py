@@ -0,0 +1,820 @@
+import argparse
+import glob
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Tuple, Optional
+
+from answer_normalization import AnswerValidationError, normalize_record
+from cassette import MODES as CASSETTE_MODES, use_cassette
+from clients import DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT, format_pool_stats
+from concurrency import DEFAULT_INITIAL_LIMIT, DEFAULT_MAX_LIMIT, format_limiter_stats, get_limiter, use_limiter
+from costs import BudgetGuard, CostEstimate, CostModel, load_prices
+from deadletter import DeadLetterQueue, with_attempts
+from evaluate_answers import METRIC_RUBRICS
+from loaders import load_questions
+from progress import enable_progress, get_tracker
+from providers import GEN_PROVIDERS, build_generator, build_judge, judge_sdk, parse_judge_spec, parse_model_spec, prewarm
+from records import dumps_line, iter_jsonl
+from self_consistency import DEFAULT_FIRST_WAVE, SelfConsistencyJudge, add_consistency_fields
+
+# 一条命令跑完 generate -> evaluate -> aggregate。
+# DAG 的节点是 (dataset, model, question) 的生成任务，和依赖它的
+# (dataset, model, question, metric, judge) 评估任务；每个答案一生成完
+# 就直接进评估队列，不用等整个生成文件写完。所有 aggregate 依赖全部评估。
+
+
+STATE_FILE = "run_state.json"
+SUMMARY_FILE = "summary.json"
+DEAD_LETTER_FILE = "dead_letter.dlq"
+# 和 jsonl_index.INDEX_SUFFIX 一致；这里不 import jsonl_index（会拉进 numpy）
+INDEX_SUFFIX = ".idx"
+INDEX_REFRESH_SECONDS = 30.0
+
+
+def load_dataset(path: str) -> List[str]:
+    # 和生成脚本走同一套格式插件；这里要先知道题数做计划和成本估算，所以整个读进来
+    return load_questions(path)
+
+
+def dataset_name(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def safe_name(s: str) -> str:
+    return s.replace("/", "_").replace(":", "_")
+
+
+def answers_path(run_dir: str, dataset: str, provider: str, model: str) -> str:
+    return os.path.join(
+        run_dir, "model_answers", f"{dataset}__{provider}__{safe_name(model)}.jsonl"
+    )
+
+
+def raw_answers_path(run_dir: str, dataset: str, provider: str, model: str) -> str:
+    return os.path.join(
+        run_dir, "raw_answers", f"{dataset}__{provider}__{safe_name(model)}.jsonl"
+    )
+
+
+def evaluations_path(run_dir: str, dataset: str, provider: str, model: str, judge: str) -> str:
+    return os.path.join(
+        run_dir,
+        "evaluations",
+        f"{dataset}__{provider}__{safe_name(model)}__{safe_name(judge)}.jsonl",
+    )
+
+
+def read_jsonl(path: str) -> List[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return []
+    # 中途被 kill 时最后一行可能是半行，iter_jsonl 会打 [WARN] 跳过，resume 会重做
+    return list(iter_jsonl(path))
+
+
+class RunState:
+    """
+    run_dir/run_state.json：run 配置 + 每个 stage 的计数。
+    真正的断点信息是 append 写的输出文件本身，resume 时从那里恢复已完成的节点。
+    """
+
+    def __init__(self, run_dir: str, config: Dict[str, Any], resume: bool = True):
+        self.path = os.path.join(run_dir, STATE_FILE)
+        self.lock = threading.Lock()
+        self.state: Dict[str, Any] = {
+            "config": config,
+            "status": "running",
+            "started_at": time.time(),
+            "updated_at": time.time(),
+            "stages": {
+                "generate": {"total": 0, "done": 0, "failed": 0, "resumed": 0, "skipped": 0},
+                "evaluate": {"total": 0, "done": 0, "failed": 0, "resumed": 0, "skipped": 0},
+            },
+            # spent_usd 跨 resume 累加（按本地 tokenizer 估算的实际花费）
+            "cost": {"estimate_usd": None, "budget_usd": None, "spent_usd": 0.0},
+        }
+        # --no_resume 时旧输出已经删了，花费也从 0 算
+        old = self.load(run_dir) if resume else None
+        if old is not None and old.get("config") != config:
+            print(f"[WARN] Run config differs from the one saved in {self.path}; resuming anyway.")
+        if old is not None:
+            self.state["cost"]["spent_usd"] = old.get("cost", {}).get("spent_usd", 0.0)
+
+    @staticmethod
+    def load(run_dir: str) -> Optional[Dict[str, Any]]:
+        path = os.path.join(run_dir, STATE_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def bump(self, stage: str, key: str, n: int = 1) -> None:
+        with self.lock:
+            self.state["stages"][stage][key] += n
+
+    def get(self, stage: str, key: str) -> int:
+        with self.lock:
+            return self.state["stages"][stage][key]
+
+    def set_cost(self, **kwargs) -> None:
+        with self.lock:
+            self.state["cost"].update(kwargs)
+
+    def add_spent(self, usd: float) -> None:
+        with self.lock:
+            self.state["cost"]["spent_usd"] += usd
+
+    def spent(self) -> float:
+        with self.lock:
+            return self.state["cost"]["spent_usd"]
+
+    def save(self, status: Optional[str] = None) -> None:
+        with self.lock:
+            if status is not None:
+                self.state["status"] = status
+            self.state["updated_at"] = time.time()
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.state, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+
+
+class JsonlAppender:
+    """
+    多线程共用的 append writer，每行写完立刻 flush，方便 resume。
+    建过 offset 索引的文件（jsonl_index.py build）边写边把新行补进索引：
+    每 INDEX_REFRESH_SECONDS 秒最多一次（只解析新追加的行），close 时所有写过的文件再补一次。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files: Dict[str, Any] = {}
+        # 有索引的文件 -> 上次补索引的时间
+        self.indexed: Dict[str, float] = {}
+
+    def write(self, path: str, record: Dict[str, Any]) -> None:
+        line = dumps_line(record)
+        with self.lock:
+            f = self.files.get(path)
+            if f is None:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                f = open(path, "a", encoding="utf-8")
+                self.files[path] = f
+                if os.path.exists(path + INDEX_SUFFIX):
+                    self.indexed[path] = time.monotonic()
+            f.write(line)
+            f.flush()
+            last = self.indexed.get(path)
+            if last is not None and time.monotonic() - last >= INDEX_REFRESH_SECONDS:
+                self.indexed[path] = time.monotonic()
+                self._refresh_indexes([path])
+
+    @staticmethod
+    def _refresh_indexes(paths: List[str]) -> None:
+        # numpy 只在这里才 import，不拖慢启动
+        from jsonl_index import refresh_existing_indexes
+
+        refresh_existing_indexes(paths)
+
+    def close(self) -> None:
+        with self.lock:
+            for f in self.files.values():
+                f.close()
+            # 跑的过程中才 build 索引的文件也在这里补上
+            self._refresh_indexes(list(self.files))
+            self.files.clear()
+            self.indexed.clear()
+
+
+def aggregate(
+    run_dir: str,
+    datasets: List[str],
+    models: List[Tuple[str, str]],
+    judges: List[str],
+) -> List[Dict[str, Any]]:
+    """
+    汇总每个 (dataset, model, metric, judge) 的平均分。
+    """
+    rows: List[Dict[str, Any]] = []
+    for ds in datasets:
+        for provider, model in models:
+            for judge in judges:
+                by_metric: Dict[str, List[float]] = {}
+                path = evaluations_path(run_dir, ds, provider, model, judge)
+                for rec in read_jsonl(path):
+                    score = rec.get("score")
+                    if isinstance(score, (int, float)):
+                        by_metric.setdefault(rec["metric"], []).append(float(score))
+                for metric_name, scores in sorted(by_metric.items()):
+                    rows.append(
+                        {
+                            "dataset": ds,
+                            "provider": provider,
+                            "model": model,
+                            "metric": metric_name,
+                            "judge": judge,
+                            "n": len(scores),
+                            "mean_score": sum(scores) / len(scores),
+                        }
+                    )
+    return rows
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Generate, evaluate and aggregate in one pipelined run."
+    )
+    parser.add_argument(
+        "--datasets",
+        type=str,
+        default="./examples_for_generation/avoid_value_manipulation.csv",
+        help="Comma-separated list of question files (.txt / .csv / .jsonl / .parquet, see loaders.py).",
+    )
+    parser.add_argument(
+        "--models",
+        type=str,
+        default="gpt",
+        help=(
+            "Comma-separated list of provider[:model] specs, e.g. "
+            "'gpt:gpt-4.1-mini,claude,llama:meta-llama/llama-4-maverick'. "
+            f"Providers: {', '.join(GEN_PROVIDERS)}."
+        ),
+    )
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        default="AVOID_VALUE_MANIPULATION",
+        help="Comma-separated list of metric names, must be keys in METRIC_RUBRICS.",
+    )
+    parser.add_argument(
+        "--judges",
+        type=str,
+        default="gpt-4.1-mini",
+        help=(
+            "Comma-separated list of judges: OpenAI model names, or provider-prefixed "
+            "(claude:<model>, gemini:<model>, grok:<model>, local:<gguf path>)."
+        ),
+    )
+    parser.add_argument(
+        "--run_dir",
+        type=str,
+        default="./results/runs/default",
+        help="Directory for answers, evaluations, run state and summary.",
+    )
+    parser.add_argument(
+        "--temperature",
+        type=float,
+        default=0.7,
+        help="Sampling temperature for answer generation.",
+    )
+    parser.add_argument(
+        "--judge_temperature",
+        type=float,
+        default=0.0,
+        help="Sampling temperature for evaluation (usually 0.0).",
+    )
+    parser.add_argument(
+        "--self_consistency",
+        action="store_true",
+        help=(
+            "Sample each judge repeatedly in parallel waves and stop per item once the score "
+            "distribution has converged; evaluations get score_variance and n_samples."
+        ),
+    )
+    parser.add_argument(
+        "--sc_first_wave",
+        type=int,
+        default=DEFAULT_FIRST_WAVE,
+        help="Judge samples in the first wave; a unanimous first wave stops there if it already meets --sc_confidence.",
+    )
+    parser.add_argument("--sc_wave_size", type=int, default=3, help="Judge samples per later wave (on disagreement).")
+    parser.add_argument("--sc_max_samples", type=int, default=9, help="Maximum judge samples per item.")
+    parser.add_argument(
+        "--sc_confidence",
+        type=float,
+        default=0.9,
+        help="Stop once P(modal score beats the runner-up) reaches this.",
+    )
+    parser.add_argument("--sc_temperature", type=float, default=0.7, help="Judge temperature for self-consistency samples.")
+    parser.add_argument(
+        "--gen_workers",
+        type=int,
+        default=4,
+        help="Number of concurrent generation calls.",
+    )
+    parser.add_argument(
+        "--eval_workers",
+        type=int,
+        default=4,
+        help="Number of concurrent evaluation calls per judge provider.",
+    )
+    parser.add_argument(
+        "--local_threads",
+        type=int,
+        default=None,
+        help="CPU threads for local llama.cpp models (default: all cores).",
+    )
+    parser.add_argument(
+        "--pool_size",
+        type=int,
+        default=DEFAULT_POOL_SIZE,
+        help="HTTP connection pool size per provider client.",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=DEFAULT_TIMEOUT,
+        help="Per-request timeout in seconds for provider clients.",
+    )
+    parser.add_argument(
+        "--no_normalize",
+        action="store_true",
+        help="Store provider output as-is instead of unwrapping JSON-wrapped answers.",
+    )
+    parser.add_argument(
+        "--keep_raw",
+        action="store_true",
+        help="Also keep raw provider output under <run_dir>/raw_answers/.",
+    )
+    parser.add_argument(
+        "--budget_usd",
+        type=float,
+        default=None,
+        help="Hard budget for this run_dir (cumulative across resumes). Nodes that would exceed it "
+        "are skipped and picked up by the next resume with a higher budget.",
+    )
+    parser.add_argument(
+        "--prices_json",
+        type=str,
+        default=None,
+        help="JSON {model: [input, output]} prices in $ per 1M tokens, overriding costs.PRICES_PER_MTOK.",
+    )
+    parser.add_argument(
+        "--plan_only",
+        action="store_true",
+        help="Count work items, estimate tokens and cost, then exit without calling any provider.",
+    )
+    parser.add_argument(
+        "--adaptive_concurrency",
+        action="store_true",
+        help="Tune in-flight requests per provider/model (and per judge) from latency and 429s, starting at "
+        "--initial_concurrency and growing up to --max_concurrency; --gen_workers / --eval_workers then no longer cap them. "
+        "If the initial limit is not below the cap the limiter can only back off.",
+    )
+    parser.add_argument(
+        "--initial_concurrency",
+        type=int,
+        default=DEFAULT_INITIAL_LIMIT,
+        help="Starting in-flight limit per provider/model with --adaptive_concurrency.",
+    )
+    parser.add_argument(
+        "--max_concurrency",
+        type=int,
+        default=DEFAULT_MAX_LIMIT,
+        help="Upper bound on in-flight calls per provider/model (and per judge) with --adaptive_concurrency.",
+    )
+    parser.add_argument(
+        "--cassette",
+        type=str,
+        default=None,
+        help="Record / replay provider traffic to / from this cassette file (default: $HAB_CASSETTE).",
+    )
+    parser.add_argument(
+        "--cassette_mode",
+        choices=CASSETTE_MODES,
+        default="replay",
+        help="record: call providers and save; replay: offline from the cassette; auto: replay, record misses.",
+    )
+    parser.add_argument(
+        "--cassette_latency",
+        type=float,
+        default=0.0,
+        help="In replay, sleep this multiple of the recorded latency (0 = no simulated latency).",
+    )
+    parser.add_argument(
+        "--progress",
+        action="store_true",
+        help="Show a live progress / throughput / ETA view in the terminal.",
+    )
+    parser.add_argument(
+        "--metrics_port",
+        type=int,
+        default=None,
+        help="Serve Prometheus-style metrics on http://127.0.0.1:<port>/metrics (0 = any free port).",
+    )
+    parser.add_argument(
+        "--no_resume",
+        action="store_true",
+        help="Start over: delete outputs, raw answers and dead-letter files already in --run_dir and reset the spent budget.",
+    )
+    args = parser.parse_args(argv)
+
+    dataset_paths = [p.strip() for p in args.datasets.split(",") if p.strip()]
+    models = [parse_model_spec(s) for s in args.models.split(",") if s.strip()]
+    judges = [j.strip() for j in args.judges.split(",") if j.strip()]
+    metric_names = [m.strip() for m in args.metrics.split(",") if m.strip()]
+    for m in metric_names:
+        if m not in METRIC_RUBRICS:
+            raise ValueError(
+                f"Unknown metric '{m}'. Available metrics: {list(METRIC_RUBRICS.keys())}"
+            )
+    if not args.plan_only:
+        # 读数据集 / 做计划的同时在后台把选中 provider 的 SDK import 好
+        prewarm([GEN_PROVIDERS[p]["sdk"] for p, _ in models] + [judge_sdk(j) for j in judges])
+
+    datasets: Dict[str, List[str]] = {}
+    for path in dataset_paths:
+        datasets[dataset_name(path)] = load_dataset(path)
+        print(f"Loaded {len(datasets[dataset_name(path)])} questions from {path}")
+
+    os.makedirs(args.run_dir, exist_ok=True)
+    config = {
+        "datasets": dataset_paths,
+        "models": [f"{p}:{m}" for p, m in models],
+        "metrics": metric_names,
+        "judges": judges,
+        "temperature": args.temperature,
+        "judge_temperature": args.judge_temperature,
+        "normalize": not args.no_normalize,
+    }
+    if args.self_consistency:
+        config["self_consistency"] = {
+            "wave_size": args.sc_wave_size,
+            "max_samples": args.sc_max_samples,
+            "confidence": args.sc_confidence,
+            "temperature": args.sc_temperature,
+        }
+    if args.no_resume:
+        stale = glob.glob(os.path.join(args.run_dir, "**", "*.dlq"), recursive=True)
+        for ds in datasets:
+            for provider, model in models:
+                stale.append(answers_path(args.run_dir, ds, provider, model))
+                stale.append(raw_answers_path(args.run_dir, ds, provider, model))
+                stale.extend(evaluations_path(args.run_dir, ds, provider, model, j) for j in judges)
+        for p in stale:
+            if os.path.exists(p):
+                os.remove(p)
+    state = RunState(args.run_dir, config, resume=not args.no_resume)
+
+    # 先把 resume 信息和总数算好，再开始提交任务
+    plan = []
+    for ds, questions in datasets.items():
+        for provider, model in models:
+            answered = {
+                r["question_id"]: r
+                for r in read_jsonl(answers_path(args.run_dir, ds, provider, model))
+            }
+            done_evals = set()
+            for judge in judges:
+                for r in read_jsonl(evaluations_path(args.run_dir, ds, provider, model, judge)):
+                    done_evals.add((judge, r.get("question_id"), r.get("metric")))
+            plan.append((ds, provider, model, questions, answered, done_evals))
+
+            n_items = len(questions) * len(judges) * len(metric_names)
+            state.bump("generate", "total", len(questions))
+            state.bump("evaluate", "total", n_items)
+            state.bump("generate", "resumed", len(answered))
+            state.bump("evaluate", "resumed", len(done_evals))
+
+    print(
+        f"Planned {state.get('generate', 'total')} generation and "
+        f"{state.get('evaluate', 'total')} evaluation nodes "
+        f"({state.get('generate', 'resumed')} / {state.get('evaluate', 'resumed')} already done)"
+    )
+
+    # 成本估算：只算这次真正要跑的节点；还没生成的答案按默认长度估。
+    # self-consistency 按第一波估（一致的题第一波就停），预算预留按 max_samples
+    eval_calls = args.sc_first_wave if args.self_consistency else 1
+    eval_max_calls = max(args.sc_first_wave, args.sc_max_samples) if args.self_consistency else 1
+    cost_model = CostModel(load_prices(args.prices_json))
+    texts = [q for questions in datasets.values() for q in questions]
+    for _, _, _, _, answered, _ in plan:
+        texts.extend(r["answer"] for r in answered.values())
+    cost_model.counter.count_many(texts)
+    estimate = CostEstimate()
+    for ds, provider, model, questions, answered, done_evals in plan:
+        for q_idx, question in enumerate(questions):
+            answer = answered[q_idx]["answer"] if q_idx in answered else None
+            if answer is None:
+                estimate.add("generate", f"{provider}:{model}", cost_model.generate(model, question))
+            for judge in judges:
+                for metric_name in metric_names:
+                    if (judge, q_idx, metric_name) not in done_evals:
+                        estimate.add(
+                            "evaluate", judge, cost_model.evaluate(judge, metric_name, question, answer), n=eval_calls
+                        )
+    spent_before = state.spent()
+    print(f"Estimated cost (tokenizer: {cost_model.counter.name}):")
+    print(estimate.format())
+    state.set_cost(estimate_usd=estimate.total_usd, budget_usd=args.budget_usd)
+    budget = None
+    if args.budget_usd is not None:
+        budget = BudgetGuard(args.budget_usd, spent_usd=spent_before)
+        print(f"Budget: ${args.budget_usd:.2f} (already spent ${spent_before:.2f} in this run_dir)")
+        if spent_before + estimate.total_usd > args.budget_usd:
+            print("[WARN] Estimated cost exceeds the budget; the run will stop early. Resume with a higher --budget_usd.")
+    state.save()
+    if args.plan_only:
+        return
+
+    cassette = None
+    if args.cassette:
+        # 要在建 client 之前打开，transport 才会套上 record / replay
+        cassette = use_cassette(args.cassette, args.cassette_mode, args.cassette_latency)
+        print(f"Using cassette {args.cassette} (mode={args.cassette_mode})")
+
+    client_opts = {
+        "local_threads": args.local_threads,
+        "pool_size": args.pool_size,
+        "timeout": args.timeout,
+    }
+    generators = {p: build_generator(p, **client_opts) for p in sorted({p for p, _ in models})}
+    judge_fns = {j: build_judge(j, **client_opts) for j in judges}
+    if args.self_consistency:
+        judge_fns = {
+            j: SelfConsistencyJudge(
+                fn,
+                wave_size=args.sc_wave_size,
+                max_samples=args.sc_max_samples,
+                confidence=args.sc_confidence,
+                temperature=args.sc_temperature,
+                workers=args.eval_workers,
+                first_wave=args.sc_first_wave,
+            )
+            for j, fn in judge_fns.items()
+        }
+
+    if args.progress or args.metrics_port is not None:
+        enable_progress(display=args.progress, metrics_port=args.metrics_port)
+    progress = get_tracker()
+
+    writer = JsonlAppender()
+    # 重试用完还失败的节点；resume 会重跑它们，也可以只用 deadletter.py retry 重跑这些
+    dead_letters = DeadLetterQueue(os.path.join(args.run_dir, DEAD_LETTER_FILE))
+    if args.adaptive_concurrency:
+        # 每个 provider/model（judge）一个 limiter，从 --initial_concurrency 起步，上限 --max_concurrency；
+        # 线程池按上限之和开，某个 model 被限流时不会占住别的 model 的线程
+        if args.initial_concurrency >= args.max_concurrency:
+            print(
+                f"[WARN] --initial_concurrency {args.initial_concurrency} >= --max_concurrency {args.max_concurrency}: "
+                "the adaptive limiters can only back off"
+            )
+        gen_limiters = {
+            (p, m): get_limiter(
+                f"generate:{p}:{m}", initial_limit=args.initial_concurrency, max_limit=args.max_concurrency
+            )
+            for p, m in models
+        }
+        eval_limiters = {
+            j: get_limiter(f"evaluate:{j}", initial_limit=args.initial_concurrency, max_limit=args.max_concurrency)
+            for j in judges
+        }
+        gen_pool = ThreadPoolExecutor(max_workers=args.max_concurrency * len(models))
+    else:
+        gen_limiters, eval_limiters = {}, {}
+        gen_pool = ThreadPoolExecutor(max_workers=args.gen_workers)
+    # judge 按 provider 分线程池（每个 provider --eval_workers 个；adaptive 时是 --max_concurrency 乘上这个 provider 的 judge 数），
+    # 不同厂商的 judge 并发跑、各自受自己的限流，一个 provider 被 429 不会占住别的 provider 的线程
+    judge_providers = {j: parse_judge_spec(j)[0] for j in judges}
+    eval_pools = {
+        p: ThreadPoolExecutor(
+            max_workers=args.max_concurrency * sum(1 for q in judge_providers.values() if q == p)
+            if args.adaptive_concurrency
+            else args.eval_workers
+        )
+        for p in set(judge_providers.values())
+    }
+    pending_lock = threading.Lock()
+    pending = [0]
+    all_done = threading.Event()
+
+    def task_started() -> None:
+        with pending_lock:
+            pending[0] += 1
+
+    def task_finished() -> None:
+        with pending_lock:
+            pending[0] -= 1
+            if pending[0] == 0:
+                all_done.set()
+
+    def tracked(fn, *fn_args) -> None:
+        # 不管节点成功与否都要归还计数，否则 all_done 永远等不到
+        try:
+            fn(*fn_args)
+        except Exception as e:
+            print(f"[ERROR] Unexpected pipeline error in {fn.__name__}: {e}")
+        finally:
+            task_finished()
+
+    def charge(reserved: float, actual: float) -> None:
+        if budget is not None:
+            budget.settle(reserved, actual)
+        state.add_spent(actual)
+
+    def charge_failed(reserved: float) -> None:
+        # 失败的调用也可能花了钱，不知道实际多少，按预留额计入
+        if budget is not None:
+            budget.release(reserved)
+        state.add_spent(reserved)
+
+    def run_eval(ds: str, provider: str, model: str, judge: str, rec: Dict[str, Any], metric_name: str) -> None:
+        rubric = METRIC_RUBRICS[metric_name]
+        reserved = cost_model.evaluate(judge, metric_name, rec["question"], rec["answer"])[2] * eval_max_calls
+        if budget is not None and not budget.reserve(reserved):
+            # 预算不够：不跑也不写，留给下一次 resume
+            state.bump("evaluate", "skipped")
+            progress.add_total("evaluate", -1)
+            return
+        progress.started("evaluate", judge)
+        out_path = evaluations_path(args.run_dir, ds, provider, model, judge)
+        eval_meta = {
+            "model": judge,
+            "temperature": args.judge_temperature,
+            "answer_model": model,
+            "answer_provider": provider,
+            "dataset": ds,
+        }
+        try:
+            # 每次 provider 请求（每次重试、每个 self-consistency 样本）各占 limiter 的一个 slot
+            with use_limiter(eval_limiters.get(judge)):
+                eval_data = with_attempts(judge_fns[judge], rec, metric_name, rubric, args.judge_temperature)
+        except Exception as e:
+            progress.finished("evaluate", judge, ok=False)
+            charge_failed(reserved)
+            print(
+                f"[ERROR] Evaluation failed for dataset={ds} model={model} "
+                f"question_id={rec.get('question_id')} metric={metric_name} judge={judge}: {e}"
+            )
+            dead_letters.add_evaluation(
+                judge, args.judge_temperature, rec, metric_name, rubric, out_path, e, eval_meta=dict(eval_meta)
+            )
+            state.bump("evaluate", "failed")
+            return
+
+        out_record: Dict[str, Any] = {
+            "question_id": rec.get("question_id"),
+            "question": rec["question"],
+            "answer": rec["answer"],
+            "metric": metric_name,
+            "rubric": rubric,
+            "score": eval_data.get("score"),
+            "justification": eval_data.get("justification", ""),
+            "eval_meta": eval_meta,
+        }
+        add_consistency_fields(out_record, eval_data)
+        progress.finished("evaluate", judge)
+        charge(
+            reserved,
+            cost_model.evaluate(
+                judge, metric_name, rec["question"], rec["answer"], out_record["justification"]
+            )[2]
+            * eval_data.get("n_calls", 1),
+        )
+        writer.write(out_path, out_record)
+        state.bump("evaluate", "done")
+        if state.get("evaluate", "done") % 10 == 0:
+            state.save()
+            print(
+                f"Evaluated {state.get('evaluate', 'done')}/{state.get('evaluate', 'total')} items"
+            )
+
+    def submit_evals(ds: str, provider: str, model: str, rec: Dict[str, Any], done_evals) -> None:
+        for judge in judges:
+            for metric_name in metric_names:
+                if (judge, rec["question_id"], metric_name) in done_evals:
+                    continue
+                task_started()
+                eval_pools[judge_providers[judge]].submit(tracked, run_eval, ds, provider, model, judge, rec, metric_name)
+
+    def run_gen(ds: str, provider: str, model: str, q_idx: int, question: str, done_evals) -> None:
+        reserved = cost_model.generate(model, question)[2]
+        if budget is not None and not budget.reserve(reserved):
+            n_evals = len(judges) * len(metric_names)
+            state.bump("generate", "skipped")
+            state.bump("evaluate", "skipped", n_evals)
+            progress.add_total("generate", -1)
+            progress.add_total("evaluate", -n_evals)
+            return
+        progress.started("generate", provider)
+        record: Dict[str, Any] = {
+            "question_id": q_idx,
+            "question": question,
+            "meta": {
+                "model": model,
+                "temperature": args.temperature,
+                "provider": provider,
+                "dataset": ds,
+            },
+        }
+
+        def dead_letter(e: Exception) -> None:
+            dead_letters.add_generation(
+                provider,
+                model,
+                args.temperature,
+                record,
+                answers_path(args.run_dir, ds, provider, model),
+                e,
+                normalize=not args.no_normalize,
+                raw_jsonl=raw_answers_path(args.run_dir, ds, provider, model) if args.keep_raw else None,
+            )
+
+        try:
+            with use_limiter(gen_limiters.get((provider, model))):
+                answer = with_attempts(generators[provider], model, question, args.temperature)
+        except Exception as e:
+            progress.finished("generate", provider, ok=False)
+            charge_failed(reserved)
+            print(f"[ERROR] dataset={ds} model={model} question {q_idx} failed: {e}")
+            dead_letter(e)
+            state.bump("generate", "failed")
+            # 生成失败，依赖它的评估节点也跑不了
+            state.bump("evaluate", "failed", len(judges) * len(metric_names))
+            progress.add_total("evaluate", -len(judges) * len(metric_names))
+            return
+
+        charge(reserved, cost_model.generate(model, question, answer)[2])
+        # 输出里 answer 排在 meta 前面，和以前的文件一致
+        record = {"question_id": q_idx, "question": question, "answer": answer, "meta": record["meta"]}
+        if not args.no_normalize:
+            # judge 只看拆包后的纯文本答案
+            try:
+                normalize_record(record)
+            except AnswerValidationError as e:
+                progress.finished("generate", provider, ok=False)
+                print(f"[ERROR] dataset={ds} model={model} question {q_idx} returned an invalid answer: {e}")
+                dead_letter(e)
+                state.bump("generate", "failed")
+                state.bump("evaluate", "failed", len(judges) * len(metric_names))
+                progress.add_total("evaluate", -len(judges) * len(metric_names))
+                return
+            if args.keep_raw:
+                writer.write(
+                    raw_answers_path(args.run_dir, ds, provider, model),
+                    {"question_id": q_idx, "raw_sha1": record["meta"]["raw_sha1"], "raw": answer},
+                )
+        progress.finished("generate", provider)
+        writer.write(answers_path(args.run_dir, ds, provider, model), record)
+        state.bump("generate", "done")
+        # 流水线：答案一出来就进评估队列
+        submit_evals(ds, provider, model, record, done_evals)
+
+    # 进度条只算这次真正要跑的节点
+    progress.set_total("generate", state.get("generate", "total") - state.get("generate", "resumed"))
+    progress.set_total("evaluate", state.get("evaluate", "total") - state.get("evaluate", "resumed"))
+
+    task_started()  # 占位，防止提交过程中计数归零
+    for ds, provider, model, questions, answered, done_evals in plan:
+        for q_idx, question in enumerate(questions):
+            if q_idx in answered:
+                submit_evals(ds, provider, model, answered[q_idx], done_evals)
+                continue
+            task_started()
+            gen_pool.submit(tracked, run_gen, ds, provider, model, q_idx, question, done_evals)
+    task_finished()
+
+    all_done.wait()
+    gen_pool.shutdown()
+    for pool in eval_pools.values():
+        pool.shutdown()
+    if args.self_consistency:
+        for fn in judge_fns.values():
+            fn.close()
+    writer.close()
+    dead_letters.close()
+    progress.close()
+
+    rows = aggregate(args.run_dir, list(datasets.keys()), models, judges)
+    with open(os.path.join(args.run_dir, SUMMARY_FILE), "w", encoding="utf-8") as f:
+        json.dump(rows, f, ensure_ascii=False, indent=2)
+    for row in rows:
+        print(
+            f"{row['dataset']:<32} {row['provider'] + ':' + row['model']:<40} "
+            f"{row['metric']:<28} judge={row['judge']:<16} n={row['n']:<5} mean={row['mean_score']:.3f}"
+        )
+
+    print("Provider client pools:")
+    print(format_pool_stats())
+    if cassette is not None:
+        print(f"Cassette: {cassette.stats}")
+    if args.adaptive_concurrency:
+        print("Adaptive concurrency:")
+        print(format_limiter_stats())
+
+    print(f"Spent ~${state.spent():.2f} in this run_dir (estimated from local token counts)")
+    if budget is not None and budget.exhausted:
+        print(
+            f"[WARN] Budget of ${args.budget_usd:.2f} reached: skipped {state.get('generate', 'skipped')} generation "
+            f"and {state.get('evaluate', 'skipped')} evaluation nodes. Re-run with a higher --budget_usd to resume."
+        )
+        state.save(status="budget_exhausted")
+    else:
+        state.save(status="done")
+    print(f"Done. Saved run outputs to {args.run_dir}")
+
+
+if __name__ == "__main__":
+    main()
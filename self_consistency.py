@@ -0,0 +1,155 @@
+import contextvars
+import math
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, List, Optional
+
+# self-consistency judge：同一个 (answer, metric) 让 judge 以 temperature > 0 重复打分。
+# 第一波并发 first_wave 次（默认 3），之后每波 wave_size 次；每波之后做一次序贯检验，分数分布收敛了就停：
+#   众数 s1（n1 票）和第二名 s2（n2 票）之间，p1 / (p1 + p2) ~ Beta(1 + n1, 1 + n2)，
+#   P(p1 > p2) >= confidence 就认为众数稳定了。
+# 全票一致的 n 票的置信度是 1 - 2^-(n+1)：默认 confidence 0.9 时 3 票一致（0.9375）就能停，2 票（0.875）不够，
+# 所以默认第一波是 3，大部分题第一波就结束。
+# 有争议的题一直加波直到 max_samples。输出里带分数方差、实际用掉的样本数和调用次数（含失败的）。
+
+DEFAULT_FIRST_WAVE = 3
+DEFAULT_WAVE_SIZE = 3
+DEFAULT_MAX_SAMPLES = 9
+DEFAULT_CONFIDENCE = 0.9
+DEFAULT_TEMPERATURE = 0.7
+
+
+def mode_confidence(n1: int, n2: int) -> float:
+    """
+    P(p1 > p2)，p1 / (p1 + p2) ~ Beta(1 + n1, 1 + n2)。
+    整数参数时 P(Beta(a, b) <= 1/2) = P(Binomial(a + b - 1, 1/2) >= a)，不需要 scipy。
+    """
+    a, b = 1 + n1, 1 + n2
+    n = a + b - 1
+    tail = sum(math.comb(n, k) for k in range(a, n + 1)) / 2.0 ** n
+    return 1.0 - tail
+
+
+def unanimous_samples_needed(confidence: float, limit: int = 64) -> int:
+    """全票一致时至少要几票，mode_confidence 才到 confidence。"""
+    n = 1
+    while n < limit and mode_confidence(n, 0) < confidence:
+        n += 1
+    return n
+
+
+def summarize_scores(scores: List[int]) -> Dict[str, Any]:
+    counts = Counter(scores)
+    # 票数相同取较小的分（保守）
+    ranked = sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))
+    n1 = ranked[0][1]
+    n2 = ranked[1][1] if len(ranked) > 1 else 0
+    mean = sum(scores) / len(scores)
+    variance = sum((s - mean) ** 2 for s in scores) / (len(scores) - 1) if len(scores) > 1 else 0.0
+    return {
+        "score": ranked[0][0],
+        "score_mean": mean,
+        "score_variance": variance,
+        "score_counts": {str(s): c for s, c in sorted(counts.items())},
+        "confidence": mode_confidence(n1, n2),
+    }
+
+
+class SelfConsistencyJudge:
+    """
+    包一个 judge(record, metric_name, rubric, temperature) -> eval_data（providers.build_judge 的返回值），
+    签名不变，返回的 eval_data 多了 score_variance / n_samples / self_consistency。
+    每个 judge 一个自己的线程池跑 wave 内的并发采样：外层调用方本身在线程池里，
+    不能把子任务提交回同一个池子（会互相等死）。
+    """
+
+    def __init__(
+        self,
+        judge: Callable[[Dict[str, Any], str, str, float], Dict[str, Any]],
+        wave_size: int = DEFAULT_WAVE_SIZE,
+        max_samples: int = DEFAULT_MAX_SAMPLES,
+        confidence: float = DEFAULT_CONFIDENCE,
+        temperature: float = DEFAULT_TEMPERATURE,
+        workers: int = 4,
+        first_wave: int = DEFAULT_FIRST_WAVE,
+    ):
+        self.judge = judge
+        self.first_wave = max(1, first_wave)
+        self.wave_size = max(1, wave_size)
+        self.max_samples = max(self.first_wave, max_samples)
+        self.confidence = confidence
+        self.temperature = temperature
+        needed = unanimous_samples_needed(confidence)
+        if self.first_wave < needed <= self.max_samples:
+            print(
+                f"[WARN] A unanimous first wave of {self.first_wave} samples only reaches confidence "
+                f"{mode_confidence(self.first_wave, 0):.3f} < {confidence}; every item will need at least {needed} samples"
+            )
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers) * max(self.first_wave, self.wave_size))
+
+    def __call__(
+        self, record: Dict[str, Any], metric_name: str, rubric: str, temperature: Optional[float] = None
+    ) -> Dict[str, Any]:
+        # 外面传进来的 temperature（通常是 0.0）对重复采样没有意义，用自己的
+        samples: List[Dict[str, Any]] = []
+        errors: List[Exception] = []
+        waves = 0
+        attempts = 0
+        summary: Optional[Dict[str, Any]] = None
+        # 失败的样本也算进 max_samples，最坏情况的调用次数是固定的
+        while attempts < self.max_samples:
+            n = min(self.first_wave if waves == 0 else self.wave_size, self.max_samples - attempts)
+            attempts += n
+            # 每个样本带一份调用方 context 进线程池，dead-letter 的尝试记录和 limiter slot 才跟得过去
+            futures = [
+                self.pool.submit(
+                    contextvars.copy_context().run, self.judge, record, metric_name, rubric, self.temperature
+                )
+                for _ in range(n)
+            ]
+            waves += 1
+            for fut in futures:
+                try:
+                    data = fut.result()
+                    int(data.get("score"))
+                    samples.append(data)
+                except Exception as e:
+                    # 单个样本失败（judge 自己已经重试过）不影响其他样本
+                    errors.append(e)
+            if samples:
+                summary = summarize_scores([int(s["score"]) for s in samples])
+                if summary["confidence"] >= self.confidence:
+                    break
+        if summary is None:
+            raise RuntimeError(f"All self-consistency samples failed: {errors[-1] if errors else 'no samples'}")
+
+        # justification 取一条和最终分数一致的样本
+        chosen = next(s for s in samples if int(s["score"]) == summary["score"])
+        eval_data = dict(chosen)
+        eval_data["score"] = summary["score"]
+        eval_data["score_variance"] = summary["score_variance"]
+        eval_data["n_samples"] = len(samples)
+        # 计费按实际发出去的调用算，失败的样本也花了钱
+        eval_data["n_calls"] = attempts
+        eval_data["self_consistency"] = {
+            "score_mean": summary["score_mean"],
+            "score_counts": summary["score_counts"],
+            "confidence": summary["confidence"],
+            "converged": summary["confidence"] >= self.confidence,
+            "waves": waves,
+            "failed_samples": len(errors),
+            "temperature": self.temperature,
+        }
+        return eval_data
+
+    def close(self) -> None:
+        self.pool.shutdown()
+
+
+def add_consistency_fields(out_record: Dict[str, Any], eval_data: Dict[str, Any]) -> None:
+    """把 SelfConsistencyJudge 的结果字段抄到输出的评估记录上（普通 judge 时什么都不做）。"""
+    if "n_samples" not in eval_data:
+        return
+    out_record["score_variance"] = eval_data["score_variance"]
+    out_record["n_samples"] = eval_data["n_samples"]
+    out_record.setdefault("eval_meta", {})["self_consistency"] = eval_data["self_consistency"]
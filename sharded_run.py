@@ -0,0 +1,498 @@
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+
+from answer_normalization import normalize_record
+from deadletter import DeadLetterQueue, dead_letter_path, with_attempts
+from evaluate_answers import METRIC_RUBRICS, load_answers_jsonl
+from providers import build_generator, build_judge, parse_model_spec
+from run_pipeline import load_dataset, read_jsonl
+from records import dumps_line, question_hash
+
+# 分片分布式模式：一个 run 按 question 文本的稳定 hash 切成 N 个 shard，
+# 多个 worker 进程（可以在不同机器上，只要共享 run_dir 所在的文件系统）
+# 通过 run_dir/queue.sqlite 领 shard、跑完标记 done，最后 merge 出规范的输出文件。
+# 有 item 失败的 shard 放回 pending，下次领走时只重跑没写出的 item；
+# 连续 --max_attempts 次都还有失败的标成 failed，merge 默认拒绝（--allow_partial 才合并）。
+#
+#   python sharded_run.py init   --run_dir D --stage generate --input_file x.csv --model gpt --num_shards 16
+#   python sharded_run.py worker --run_dir D      # 每台机器 / 每个进程跑一个
+#   python sharded_run.py merge  --run_dir D --output_jsonl ./results/model_answers/out_gpt.jsonl
+#   python sharded_run.py local  --run_dir D --num_workers 4 ...   # 单机多进程：init + worker + merge
+
+CONFIG_FILE = "sharded_config.json"
+QUEUE_FILE = "queue.sqlite"
+SHARD_DIR = "shards"
+DEFAULT_LEASE_SECONDS = 300.0
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+def shard_of(question: str, num_shards: int) -> int:
+    # 只看题目内容，和它在输入文件里的位置无关
+    return int(question_hash(question), 16) % num_shards
+
+
+class WorkQueue:
+    """
+    shard 级别的 SQLite 工作队列。领 shard 用 BEGIN IMMEDIATE 保证多进程互斥；
+    worker 定时刷新 heartbeat，超过 lease 没刷新的 shard 可以被别的 worker 接手。
+    不开 WAL：WAL 依赖共享内存，放在 NFS 之类的共享盘上不安全。
+    """
+
+    def __init__(self, path: str, lease_seconds: float = DEFAULT_LEASE_SECONDS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=60.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        return conn
+
+    def create(self, num_shards: int) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS shards (
+                    shard INTEGER PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    worker TEXT,
+                    heartbeat REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    done INTEGER NOT NULL DEFAULT 0,
+                    failed INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO shards (shard, status) VALUES (?, 'pending')",
+                [(i,) for i in range(num_shards)],
+            )
+
+    def claim(self, worker: str, max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> Optional[int]:
+        """failed 的 shard 在调大 max_attempts 之后也会被重新领走。"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                """
+                SELECT shard FROM shards
+                WHERE status = 'pending' OR (status = 'claimed' AND heartbeat < ?)
+                   OR (status = 'failed' AND attempts < ?)
+                ORDER BY attempts, shard LIMIT 1
+                """,
+                (time.time() - self.lease_seconds, max_attempts),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE shards SET status = 'claimed', worker = ?, heartbeat = ?, "
+                "attempts = attempts + 1 WHERE shard = ?",
+                (worker, time.time(), row[0]),
+            )
+            conn.execute("COMMIT")
+            return row[0]
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def heartbeat(self, shard: int, worker: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE shards SET heartbeat = ? WHERE shard = ? AND worker = ?",
+                (time.time(), shard, worker),
+            )
+
+    def finish(
+        self, shard: int, worker: str, done: int, failed: int, max_attempts: int = DEFAULT_MAX_ATTEMPTS
+    ) -> str:
+        """全部成功 -> done；有失败 -> pending 等重跑，已经试了 max_attempts 次 -> failed。返回新状态。"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE shards SET status = CASE WHEN ? = 0 THEN 'done' WHEN attempts >= ? THEN 'failed' "
+                "ELSE 'pending' END, done = ?, failed = ? WHERE shard = ? AND worker = ?",
+                (failed, max_attempts, done, failed, shard, worker),
+            )
+            row = conn.execute("SELECT status FROM shards WHERE shard = ?", (shard,)).fetchone()
+        return row[0] if row else "missing"
+
+    def summary(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM shards GROUP BY status").fetchall()
+        return {status: n for status, n in rows}
+
+    def failed_items(self) -> int:
+        """各 shard 最近一次跑完时失败的 item 数之和。"""
+        with self._connect() as conn:
+            return conn.execute("SELECT COALESCE(SUM(failed), 0) FROM shards").fetchone()[0]
+
+
+def shard_path(run_dir: str, shard: int) -> str:
+    return os.path.join(run_dir, SHARD_DIR, f"shard-{shard:05d}.jsonl")
+
+
+def load_config(run_dir: str) -> Dict[str, Any]:
+    with open(os.path.join(run_dir, CONFIG_FILE), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_work_items(config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    generate：每个 question 一个 item（question_id 仍然是输入文件里的行号，和单机脚本一致）；
+    evaluate：每条答案 x 每个 metric 一个 item。
+    """
+    if config["stage"] == "generate":
+        return [
+            {"question_id": q_idx, "question": q}
+            for q_idx, q in enumerate(load_dataset(config["input_file"]))
+        ]
+    items = []
+    for rec in load_answers_jsonl(config["input_file"]):
+        for metric_name in config["metrics"]:
+            items.append(dict(rec, metric=metric_name))
+    return items
+
+
+def item_key(config: Dict[str, Any], item: Dict[str, Any]):
+    if config["stage"] == "generate":
+        return item["question_id"]
+    return (item.get("question_id"), item["metric"])
+
+
+def cmd_init(args) -> None:
+    if args.stage == "generate":
+        provider, model = parse_model_spec(args.model)
+        config = {
+            "provider": provider,
+            "model": model,
+            "temperature": args.temperature,
+            "normalize": not args.no_normalize,
+        }
+    else:
+        metrics = [m.strip() for m in args.metrics.split(",") if m.strip()]
+        for m in metrics:
+            if m not in METRIC_RUBRICS:
+                raise ValueError(
+                    f"Unknown metric '{m}'. Available metrics: {list(METRIC_RUBRICS.keys())}"
+                )
+        config = {"judge": args.model, "metrics": metrics, "temperature": args.temperature}
+    config.update(
+        {
+            "stage": args.stage,
+            "input_file": os.path.abspath(args.input_file),
+            "num_shards": args.num_shards,
+        }
+    )
+
+    os.makedirs(os.path.join(args.run_dir, SHARD_DIR), exist_ok=True)
+    config_path = os.path.join(args.run_dir, CONFIG_FILE)
+    if os.path.exists(config_path):
+        old = load_config(args.run_dir)
+        if old != config:
+            raise ValueError(f"{config_path} already exists with a different config: {old}")
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+
+    WorkQueue(os.path.join(args.run_dir, QUEUE_FILE)).create(args.num_shards)
+    print(f"Initialized {args.num_shards} {args.stage} shards in {args.run_dir}")
+
+
+def process_shard(
+    config: Dict[str, Any],
+    items: List[Dict[str, Any]],
+    out_path: str,
+    concurrency: int,
+) -> Dict[str, int]:
+    """跑一个 shard；输出按行 append，shard 被重新领走时跳过已经写出的 item。"""
+    done_keys = set()
+    for rec in read_jsonl(out_path):
+        done_keys.add(item_key(config, rec))
+    todo = [it for it in items if item_key(config, it) not in done_keys]
+
+    if config["stage"] == "generate":
+        generate = build_generator(config["provider"])
+    else:
+        judge = build_judge(config["judge"])
+
+    lock = threading.Lock()
+    counts = {"done": len(done_keys), "failed": 0}
+    # 有失败的 shard 会放回队列，重新领走时只跑还没写出的 item（也就是失败的那些）；
+    # dead letter 只是留个底（错误、重试历史），deadletter.py retry 也会跳过已写出的
+    dead_letters = DeadLetterQueue(dead_letter_path(out_path))
+
+    def run_item(item: Dict[str, Any]) -> None:
+        try:
+            if config["stage"] == "generate":
+                answer = with_attempts(generate, config["model"], item["question"], config["temperature"])
+                record: Dict[str, Any] = {
+                    "question_id": item["question_id"],
+                    "question": item["question"],
+                    "answer": answer,
+                    "meta": {
+                        "model": config["model"],
+                        "temperature": config["temperature"],
+                        "provider": config["provider"],
+                    },
+                }
+                if config.get("normalize", True):
+                    normalize_record(record)
+            else:
+                rubric = METRIC_RUBRICS[item["metric"]]
+                eval_data = with_attempts(judge, item, item["metric"], rubric, config["temperature"])
+                record = {
+                    "question_id": item.get("question_id"),
+                    "question": item["question"],
+                    "answer": item["answer"],
+                    "metric": item["metric"],
+                    "rubric": rubric,
+                    "score": eval_data.get("score"),
+                    "justification": eval_data.get("justification", ""),
+                    "eval_meta": {
+                        "model": config["judge"],
+                        "temperature": config["temperature"],
+                    },
+                }
+        except Exception as e:
+            print(f"[ERROR] question_id={item.get('question_id')} failed: {e}")
+            if config["stage"] == "generate":
+                dead_letters.add_generation(
+                    config["provider"],
+                    config["model"],
+                    config["temperature"],
+                    {
+                        "question_id": item["question_id"],
+                        "question": item["question"],
+                        "meta": {
+                            "model": config["model"],
+                            "temperature": config["temperature"],
+                            "provider": config["provider"],
+                        },
+                    },
+                    out_path,
+                    e,
+                    normalize=config.get("normalize", True),
+                )
+            else:
+                eval_meta = {"model": config["judge"], "temperature": config["temperature"]}
+                rubric = METRIC_RUBRICS.get(item["metric"], "")
+                dead_letters.add_evaluation(
+                    config["judge"], config["temperature"], item, item["metric"], rubric, out_path, e, eval_meta
+                )
+            with lock:
+                counts["failed"] += 1
+            return
+        line = dumps_line(record)
+        with lock:
+            out_f.write(line)
+            out_f.flush()
+            counts["done"] += 1
+
+    with open(out_path, "a", encoding="utf-8") as out_f:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(run_item, todo))
+    dead_letters.close()
+    return counts
+
+
+def cmd_worker(args) -> None:
+    config = load_config(args.run_dir)
+    queue = WorkQueue(os.path.join(args.run_dir, QUEUE_FILE), lease_seconds=args.lease_seconds)
+    worker = args.worker_id or f"{socket.gethostname()}:{os.getpid()}"
+
+    # 所有 worker 都从同一个输入文件算 shard，结果确定
+    by_shard: Dict[int, List[Dict[str, Any]]] = {}
+    for item in load_work_items(config):
+        by_shard.setdefault(shard_of(item["question"], config["num_shards"]), []).append(item)
+
+    while True:
+        shard = queue.claim(worker, args.max_attempts)
+        if shard is None:
+            break
+        items = by_shard.get(shard, [])
+        print(f"[{worker}] Claimed shard {shard} ({len(items)} items)")
+
+        stop = threading.Event()
+
+        def beat() -> None:
+            while not stop.wait(args.lease_seconds / 3):
+                queue.heartbeat(shard, worker)
+
+        beater = threading.Thread(target=beat, daemon=True)
+        beater.start()
+        try:
+            counts = process_shard(config, items, shard_path(args.run_dir, shard), args.concurrency)
+        finally:
+            stop.set()
+            beater.join()
+        status = queue.finish(shard, worker, counts["done"], counts["failed"], args.max_attempts)
+        print(f"[{worker}] Finished shard {shard}: {counts['done']} done, {counts['failed']} failed ({status})")
+
+    print(f"[{worker}] No more shards. Queue status: {queue.summary()}")
+
+
+def cmd_merge(args) -> None:
+    config = load_config(args.run_dir)
+    queue = WorkQueue(os.path.join(args.run_dir, QUEUE_FILE))
+    status = queue.summary()
+    failed = queue.failed_items()
+    if status.get("done", 0) != config["num_shards"]:
+        if not args.allow_partial:
+            raise RuntimeError(
+                f"Not all shards are done ({status}, {failed} failed items); rerun workers "
+                "(with a higher --max_attempts for failed shards) or pass --allow_partial."
+            )
+        print(f"[WARN] Merging a partial run: shards {status}, {failed} failed items are missing from the output")
+
+    records: Dict[Any, Dict[str, Any]] = {}
+    for shard in range(config["num_shards"]):
+        for rec in read_jsonl(shard_path(args.run_dir, shard)):
+            records[item_key(config, rec)] = rec
+
+    def sort_key(k):
+        # question_id 可能是 None（输入文件里缺字段），排到最后
+        if config["stage"] == "generate":
+            return (k is None, k if k is not None else 0)
+        return (k[0] is None, k[0] if k[0] is not None else 0, k[1])
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output_jsonl)), exist_ok=True)
+    with open(args.output_jsonl, "w", encoding="utf-8") as out_f:
+        for k in sorted(records, key=sort_key):
+            out_f.write(dumps_line(records[k]))
+    print(f"Done. Merged {len(records)} records from {config['num_shards']} shards into {args.output_jsonl}")
+
+
+def cmd_local(args) -> None:
+    """单机多进程：init，起 num_workers 个 worker 子进程，全部结束后 merge。"""
+    cmd_init(args)
+    script = os.path.abspath(__file__)
+    procs = [
+        subprocess.Popen(
+            [
+                sys.executable,
+                script,
+                "worker",
+                "--run_dir",
+                args.run_dir,
+                "--worker_id",
+                f"local-{i}",
+                "--concurrency",
+                str(args.concurrency),
+                "--lease_seconds",
+                str(args.lease_seconds),
+                "--max_attempts",
+                str(args.max_attempts),
+            ]
+        )
+        for i in range(args.num_workers)
+    ]
+    codes = [p.wait() for p in procs]
+    if any(codes):
+        print(f"[WARN] Some workers exited with non-zero codes: {codes}")
+    cmd_merge(args)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Sharded, multi-process generation / evaluation with a shared SQLite work queue."
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def add_init_args(p):
+        p.add_argument("--stage", choices=["generate", "evaluate"], required=True)
+        p.add_argument(
+            "--input_file",
+            type=str,
+            required=True,
+            help="Questions (.txt/.csv) for generate, model answers (.jsonl) for evaluate.",
+        )
+        p.add_argument(
+            "--model",
+            type=str,
+            default=None,
+            help="provider[:model] for generate (e.g. 'claude'), judge model for evaluate.",
+        )
+        p.add_argument(
+            "--metrics",
+            type=str,
+            default="AVOID_VALUE_MANIPULATION",
+            help="Comma-separated metric names (evaluate only).",
+        )
+        p.add_argument("--temperature", type=float, default=None)
+        p.add_argument(
+            "--no_normalize",
+            action="store_true",
+            help="Store provider output as-is instead of unwrapping JSON-wrapped answers (generate only).",
+        )
+        p.add_argument("--num_shards", type=int, default=16)
+
+    def add_worker_args(p):
+        p.add_argument(
+            "--concurrency",
+            type=int,
+            default=4,
+            help="Concurrent calls inside one worker.",
+        )
+        p.add_argument(
+            "--lease_seconds",
+            type=float,
+            default=DEFAULT_LEASE_SECONDS,
+            help="A claimed shard without heartbeat for this long can be taken over.",
+        )
+        p.add_argument(
+            "--max_attempts",
+            type=int,
+            default=DEFAULT_MAX_ATTEMPTS,
+            help="Runs of a shard with failed items before it is marked failed instead of requeued.",
+        )
+
+    def add_merge_args(p):
+        p.add_argument("--output_jsonl", type=str, required=True)
+        p.add_argument(
+            "--allow_partial",
+            action="store_true",
+            help="Merge even if some shards are not done yet or gave up with failed items.",
+        )
+
+    p_init = sub.add_parser("init", help="Create the shard queue for a run.")
+    p_init.add_argument("--run_dir", type=str, required=True)
+    add_init_args(p_init)
+
+    p_worker = sub.add_parser("worker", help="Claim and process shards until none are left.")
+    p_worker.add_argument("--run_dir", type=str, required=True)
+    p_worker.add_argument("--worker_id", type=str, default=None)
+    add_worker_args(p_worker)
+
+    p_merge = sub.add_parser("merge", help="Merge finished shards into the canonical output file.")
+    p_merge.add_argument("--run_dir", type=str, required=True)
+    add_merge_args(p_merge)
+
+    p_local = sub.add_parser("local", help="init + N local worker processes + merge.")
+    p_local.add_argument("--run_dir", type=str, required=True)
+    p_local.add_argument("--num_workers", type=int, default=4)
+    add_init_args(p_local)
+    add_worker_args(p_local)
+    add_merge_args(p_local)
+
+    args = parser.parse_args(argv)
+
+    if args.command in ("init", "local"):
+        if args.model is None:
+            args.model = "gpt" if args.stage == "generate" else "gpt-4.1-mini"
+        if args.temperature is None:
+            args.temperature = 0.7 if args.stage == "generate" else 0.0
+
+    {"init": cmd_init, "worker": cmd_worker, "merge": cmd_merge, "local": cmd_local}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
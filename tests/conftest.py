@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 脚本都在仓库根目录（没有包），测试直接 import 模块名
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
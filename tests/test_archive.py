@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+
+def _eval_records(n_questions: int, metrics=("M1", "M2"), models=("gpt", "claude")):
+    return [
+        {
+            "question_id": q,
+            "question": f"question {q} " + "shared context " * 5,
+            "metric": metric,
+            "meta": {"provider": "", "model": model},
+            "evaluation": {"score": (q % 5) + 1, "justification": f"{model} on {metric}"},
+        }
+        for q in range(n_questions)
+        for metric in metrics
+        for model in models
+    ]
+
+
+def test_archive_roundtrip(tmp_path):
+    pytest.importorskip("zstandard")
+    from archive import ArchiveReader, ArchiveWriter
+
+    path = str(tmp_path / "history.hzst")
+    records = _eval_records(40)
+    half = len(records) // 2
+    sources = {"out_a.jsonl": records[:half], "out_b.jsonl": records[half:]}
+    with ArchiveWriter(path, frame_records=16, level=3, train_records=50) as writer:
+        for source, recs in sources.items():
+            for rec in recs:
+                writer.write(rec, source)
+
+    with ArchiveReader(path) as reader:
+        assert len(reader) == len(records)
+        assert list(reader.iter_records()) == records
+        assert list(reader.iter_records("out_b.jsonl")) == sources["out_b.jsonl"]
+        hits = reader.get(question_id=30, metric="M1", model="gpt")
+        assert hits == [r for r in records if r["question_id"] == 30 and r["metric"] == "M1" and r["meta"]["model"] == "gpt"]
+        assert reader.get(question_id=30, source="out_a.jsonl") == []
+
+
+def test_archive_keeps_raw_lines(tmp_path):
+    pytest.importorskip("zstandard")
+    from archive import ArchiveReader, ArchiveWriter
+
+    path = str(tmp_path / "small.hzst")
+    # 不是规范格式的行（多余空格、key 顺序）原样保存，解包后逐字节一致
+    lines = [b'{"question_id": 1,   "metric": "M1", "question": "q"}', b'{"metric":"M2","question_id":2}']
+    with ArchiveWriter(path, frame_records=1, level=3) as writer:
+        for raw in lines:
+            writer.write(json.loads(raw), "raw.jsonl", line=raw)
+    with ArchiveReader(path) as reader:
+        assert [line.rstrip(b"\n") for _, line in reader.iter_lines()] == lines
@@ -0,0 +1,40 @@
+import pytest
+
+from cassette import Cassette, CassetteMiss, cassette_transport, request_key
+
+
+def test_request_key_ignores_field_order():
+    assert request_key({"a": 1, "b": {"x": [1, 2], "y": None}}) == request_key({"b": {"y": None, "x": [1, 2]}, "a": 1})
+    assert request_key({"a": 1}) != request_key({"a": 2})
+
+
+def test_cassette_record_then_replay(tmp_path):
+    httpx = pytest.importorskip("httpx")
+    path = str(tmp_path / "traffic.sqlite")
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(200, json={"n": len(calls)}, headers={"x-test": "1"})
+
+    cassette = Cassette(path, mode="record")
+    client = httpx.Client(transport=cassette_transport(httpx, httpx.MockTransport(handler), cassette, "openai", False))
+    first = client.post("https://api.example.com/v1/chat", json={"model": "m", "messages": ["hi"]})
+    second = client.post("https://api.example.com/v1/chat", json={"messages": ["hi"], "model": "m"})
+    client.close()
+    cassette.close()
+    assert [first.json(), second.json()] == [{"n": 1}, {"n": 2}]
+
+    # replay 完全不碰网络，同一个 request 录了两次就按次序轮流返回
+    cassette = Cassette(path, mode="replay")
+    offline = httpx.MockTransport(lambda request: pytest.fail("replay must not hit the network"))
+    client = httpx.Client(transport=cassette_transport(httpx, offline, cassette, "openai", False))
+    replayed = [client.post("https://api.example.com/v1/chat", json={"model": "m", "messages": ["hi"]}) for _ in range(3)]
+    assert [r.json() for r in replayed] == [{"n": 1}, {"n": 2}, {"n": 1}]
+    assert replayed[0].headers["x-test"] == "1"
+    with pytest.raises(CassetteMiss):
+        client.post("https://api.example.com/v1/chat", json={"model": "other"})
+    assert cassette.stats["hits"] == 3 and cassette.stats["misses"] == 1
+    assert cassette.summary()[0]["interactions"] == 2
+    client.close()
+    cassette.close()
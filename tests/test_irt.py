@@ -0,0 +1,78 @@
+import json
+
+import numpy as np
+import pytest
+
+import irt
+import providers
+from deadletter import load_dead_letters
+from irt import fit_2pl
+from records import iter_jsonl
+
+
+def test_fit_2pl_recovers_ability_order_and_difficulty():
+    rng = np.random.default_rng(0)
+    theta = np.linspace(-2.0, 2.0, 100)
+    b = np.linspace(-1.5, 1.5, 30)
+    p = 1.0 / (1.0 + np.exp(-(theta[:, None] - b[None, :])))
+    Y = (rng.random(p.shape) < p).astype(float)
+    M = np.ones_like(Y)
+    fit = fit_2pl(Y, M)
+
+    assert fit["a"].shape == (30,) and fit["b"].shape == (30,)
+    assert np.isfinite(fit["loglik"])
+    assert (fit["theta_sd"] > 0).all()
+    assert np.corrcoef(fit["theta"], theta)[0, 1] > 0.9
+    assert np.corrcoef(fit["b"], b)[0, 1] > 0.9
+
+
+def test_fit_2pl_ignores_missing_responses():
+    rng = np.random.default_rng(1)
+    Y = (rng.random((20, 10)) < 0.5).astype(float)
+    M = np.ones_like(Y)
+    M[:, 0] = 0.0
+    full = fit_2pl(Y, M)
+    # 没人作答的题改成什么 Y 都不影响结果
+    Y[:, 0] = 1.0 - Y[:, 0]
+    flipped = fit_2pl(Y, M)
+    np.testing.assert_allclose(full["theta"], flipped["theta"])
+    assert full["loglik"] == pytest.approx(flipped["loglik"])
+
+
+def test_adaptive_normalizes_answers_and_keeps_question_id(tmp_path, monkeypatch):
+    metric = "AVOID_VALUE_MANIPULATION"
+    items = [
+        {"item_id": "ok", "question_id": 7, "question": "q-ok", "metric": metric, "a": 1.0, "b": 0.0},
+        {"item_id": "bad", "question_id": 8, "question": "q-bad", "metric": metric, "a": 1.0, "b": 0.5},
+    ]
+    items_json = tmp_path / "items.json"
+    items_json.write_text(json.dumps({"items": items, "models": {}}), encoding="utf-8")
+    # q-ok 返回包了一层 JSON 的答案，q-bad 返回空白答案
+    raw = {"q-ok": '{"answer": "plain text"}', "q-bad": "   "}
+    judged = []
+
+    def judge(record, metric_name, rubric, temperature):
+        judged.append(record["answer"])
+        return {"score": 4, "justification": "ok"}
+
+    monkeypatch.setattr(providers, "build_generator", lambda provider: lambda model, q, t: raw[q])
+    monkeypatch.setattr(providers, "build_judge", lambda spec: judge)
+    out = tmp_path / "adaptive.jsonl"
+    answers = tmp_path / "answers.jsonl"
+    irt.main([
+        "adaptive", "--items_json", str(items_json), "--model", "gpt:gpt-4.1-mini",
+        "--output_jsonl", str(out), "--answers_jsonl", str(answers), "--min_items", "2", "--max_items", "2",
+    ])
+
+    # judge 只看到规范化后的答案，两个输出文件都带 question_id
+    assert judged == ["plain text"]
+    [answer] = list(iter_jsonl(str(answers)))
+    assert answer["question_id"] == 7 and answer["answer"] == "plain text"
+    assert answer["meta"]["answer_format"] == "json_wrapped"
+    [evaluation] = list(iter_jsonl(str(out)))
+    assert evaluation["question_id"] == 7 and evaluation["eval_meta"]["irt_item_id"] == "ok"
+    # 空答案进 dead letter，重跑后写回答案文件
+    [letter] = load_dead_letters(str(out) + ".dlq")
+    assert letter["kind"] == "generate"
+    assert letter["item"]["record"]["question_id"] == 8
+    assert letter["item"]["output_jsonl"] == str(answers)
@@ -0,0 +1,69 @@
+import os
+
+from jsonl_index import JsonlIndex, index_path_for
+from records import dumps_line
+
+
+def _eval_records(n_questions: int, metrics=("M1", "M2"), models=("gpt", "claude")):
+    return [
+        {
+            "question_id": q,
+            "question": f"question {q} " + "shared context " * 5,
+            "metric": metric,
+            "meta": {"provider": "", "model": model},
+            "evaluation": {"score": (q % 5) + 1, "justification": f"{model} on {metric}"},
+        }
+        for q in range(n_questions)
+        for metric in metrics
+        for model in models
+    ]
+
+
+def _write_jsonl(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for rec in records:
+            f.write(dumps_line(rec))
+
+
+def test_jsonl_index_roundtrip(tmp_path):
+    path = str(tmp_path / "evals.jsonl")
+    records = _eval_records(20)
+    _write_jsonl(path, records)
+
+    index = JsonlIndex(path)
+    assert os.path.exists(index_path_for(path))
+    assert len(index) == len(records)
+    assert index.get(question_id=3, metric="M2", model="claude") == [
+        r for r in records if r["question_id"] == 3 and r["metric"] == "M2" and r["meta"]["model"] == "claude"
+    ]
+    # 命令行传进来的 question_id 是字符串
+    assert len(index.get(question_id="7")) == 4
+    assert index.get(question_id=999) == []
+
+    # 重新打开只读索引文件，结果一样
+    reopened = JsonlIndex(path, refresh=False)
+    assert len(reopened) == len(records)
+    assert reopened.get(question_id=3, metric="M2", model="claude") == index.get(question_id=3, metric="M2", model="claude")
+
+
+def test_jsonl_index_picks_up_appends_and_rewrites(tmp_path):
+    path = str(tmp_path / "evals.jsonl")
+    records = _eval_records(5)
+    _write_jsonl(path, records)
+    index = JsonlIndex(path)
+
+    extra = _eval_records(8)[len(records):]
+    with open(path, "a", encoding="utf-8") as f:
+        for rec in extra:
+            f.write(dumps_line(rec))
+    assert index.refresh() == len(extra)
+    assert len(index) == len(records) + len(extra)
+    assert len(index.get(question_id=6)) == 4
+
+    # 文件被整个重写（更短）时索引重建，不会返回旧 offset 上的内容
+    rewritten = _eval_records(2, metrics=("M3",))
+    _write_jsonl(path, rewritten)
+    index = JsonlIndex(path)
+    assert len(index) == len(rewritten)
+    assert index.get(question_id=1, metric="M3", model="gpt") == [rewritten[2]]
+    assert index.get(question_id=6) == []
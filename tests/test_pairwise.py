@@ -0,0 +1,59 @@
+import math
+
+import numpy as np
+import pytest
+
+from pairwise import comparable_items, fit_bradley_terry, seed_round
+
+
+def test_bradley_terry_orders_models_by_win_rate():
+    # 0 总赢 1 和 2，1 总赢 2
+    idx_a = np.array([0, 0, 1] * 10)
+    idx_b = np.array([1, 2, 2] * 10)
+    score_a = np.ones(30)
+    ratings = fit_bradley_terry(3, idx_a, idx_b, score_a)
+    assert ratings[0] > ratings[1] > ratings[2]
+    assert np.isfinite(ratings).all()
+    assert abs(ratings.mean()) < 1e-9
+
+
+def test_bradley_terry_ties_give_equal_ratings():
+    idx_a = np.array([0, 1, 0])
+    idx_b = np.array([1, 2, 2])
+    ratings = fit_bradley_terry(3, idx_a, idx_b, np.full(3, 0.5))
+    np.testing.assert_allclose(ratings, 0.0, atol=1e-6)
+
+
+def test_bradley_terry_matches_closed_form_for_two_models():
+    # 两个模型时 MLE（加 prior 平局）是 log((w + prior/2) / (l + prior/2))
+    score_a = np.array([1.0] * 7 + [0.0] * 3)
+    ratings = fit_bradley_terry(2, np.zeros(10, dtype=int), np.ones(10, dtype=int), score_a, prior=1.0)
+    assert ratings[0] - ratings[1] == pytest.approx(math.log(7.5 / 3.5), abs=1e-6)
+
+
+def _answers(questions):
+    return {qid: {"question_id": qid, "question": q, "answer": f"answer to {q}"} for qid, q in questions.items()}
+
+
+def test_comparable_items_skips_mismatched_questions(capsys):
+    models = ["a", "b"]
+    answers = {
+        "a": _answers({0: "q0", 1: "q1", 2: "q2"}),
+        # 同一个 question_id 在另一个文件里是另一道题
+        "b": _answers({0: "q0", 1: "other", 3: "q3"}),
+    }
+    candidates = comparable_items(models, answers, ["M1", "M2"])
+    assert candidates == {(0, 1): [(0, "M1"), (0, "M2")]}
+    assert "[WARN] 1 question_ids" in capsys.readouterr().out
+
+
+def test_seed_round_keeps_unscheduled_candidates():
+    models = ["a", "b", "c", "d"]
+    candidates = {
+        (i, j): [(0, "M"), (1, "M")] for i in range(len(models)) for j in range(i + 1, len(models))
+    }
+    seeded = seed_round(models, candidates, compared={("a", "b")}, budget=2)
+    assert [(i, j) for i, j, _, _ in seeded] == [(0, 2), (0, 3)]
+    # 没排进这一轮的对一条都不少
+    assert sum(len(items) for items in candidates.values()) == 12 - 2
+    assert len(candidates[(1, 2)]) == 2 and len(candidates[(0, 1)]) == 2
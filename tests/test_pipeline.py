@@ -0,0 +1,132 @@
+import json
+import os
+
+import pytest
+
+import run_pipeline
+from records import iter_jsonl
+
+METRIC = "AVOID_VALUE_MANIPULATION"
+
+
+class FakeProviders:
+    """假的生成 / 评估函数：记录调用次数，fail 里的题目直接抛错（模拟重试用完）。"""
+
+    def __init__(self):
+        self.generated = []
+        self.judged = []
+        self.fail = set()
+
+    def build_generator(self, provider, **client_opts):
+        def generate(model, question, temperature):
+            if question in self.fail:
+                raise RuntimeError("provider down")
+            self.generated.append(question)
+            return f"answer to {question}"
+
+        return generate
+
+    def build_judge(self, judge, **client_opts):
+        def evaluate(rec, metric_name, rubric, temperature):
+            self.judged.append((rec["question_id"], metric_name))
+            return {"score": 4, "justification": "ok"}
+
+        return evaluate
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    fake = FakeProviders()
+    monkeypatch.setattr(run_pipeline, "build_generator", fake.build_generator)
+    monkeypatch.setattr(run_pipeline, "build_judge", fake.build_judge)
+    monkeypatch.setattr(run_pipeline, "prewarm", lambda modules: None)
+    dataset = tmp_path / "questions.txt"
+    dataset.write_text("q0\nq1\nq2\nq3\n", encoding="utf-8")
+    run_dir = str(tmp_path / "run")
+
+    def run(*extra):
+        run_pipeline.main(
+            ["--datasets", str(dataset), "--models", "gpt:gpt-4.1-mini", "--judges", "gpt-4.1-mini", "--metrics", METRIC,
+             "--run_dir", run_dir, "--gen_workers", "2", "--eval_workers", "2", *extra]
+        )
+        return run_pipeline.RunState.load(run_dir)
+
+    fake.run = run
+    fake.run_dir = run_dir
+    return fake
+
+
+def _outputs(run_dir):
+    answers = list(iter_jsonl(run_pipeline.answers_path(run_dir, "questions", "gpt", "gpt-4.1-mini")))
+    evals = list(
+        iter_jsonl(run_pipeline.evaluations_path(run_dir, "questions", "gpt", "gpt-4.1-mini", "gpt-4.1-mini"))
+    )
+    return answers, evals
+
+
+def test_resume_only_runs_missing_nodes(pipeline):
+    pipeline.fail = {"q2"}
+    state = pipeline.run()
+    assert state["stages"]["generate"]["failed"] == 1
+    answers, evals = _outputs(pipeline.run_dir)
+    assert sorted(r["question_id"] for r in answers) == [0, 1, 3]
+    assert sorted(r["question_id"] for r in evals) == [0, 1, 3]
+    assert os.path.exists(os.path.join(pipeline.run_dir, run_pipeline.DEAD_LETTER_FILE))
+
+    # 从追加写的输出文件恢复：只重跑失败的那道题和它的评估
+    pipeline.fail = set()
+    pipeline.generated.clear()
+    pipeline.judged.clear()
+    state = pipeline.run()
+    assert pipeline.generated == ["q2"]
+    assert pipeline.judged == [(2, METRIC)]
+    assert state["stages"]["generate"]["resumed"] == 3
+    assert state["stages"]["evaluate"]["resumed"] == 3
+    assert state["status"] == "done"
+    answers, evals = _outputs(pipeline.run_dir)
+    assert sorted(r["question_id"] for r in answers) == [0, 1, 2, 3]
+    assert sorted(r["question_id"] for r in evals) == [0, 1, 2, 3]
+
+    with open(os.path.join(pipeline.run_dir, run_pipeline.SUMMARY_FILE), encoding="utf-8") as f:
+        summary = json.load(f)
+    assert [(row["n"], row["mean_score"]) for row in summary] == [(4, 4.0)]
+
+    # 全部做完后再 resume 什么都不调
+    pipeline.generated.clear()
+    pipeline.judged.clear()
+    pipeline.run()
+    assert pipeline.generated == [] and pipeline.judged == []
+    assert len(_outputs(pipeline.run_dir)[0]) == 4
+
+
+def test_spent_budget_carries_over_resumes(pipeline):
+    pipeline.fail = {"q1", "q3"}
+    first = pipeline.run()["cost"]["spent_usd"]
+    assert first > 0
+
+    pipeline.fail = set()
+    second = pipeline.run()["cost"]["spent_usd"]
+    # 第二次只跑了剩下的两道题，花费在第一次的基础上累加
+    assert second > first
+
+    third = pipeline.run()["cost"]["spent_usd"]
+    assert third == pytest.approx(second)
+
+
+def test_no_resume_resets_outputs_and_spent(pipeline):
+    pipeline.fail = {"q0"}
+    spent = pipeline.run()["cost"]["spent_usd"]
+    dlq = os.path.join(pipeline.run_dir, run_pipeline.DEAD_LETTER_FILE)
+    assert os.path.exists(dlq)
+
+    pipeline.fail = set()
+    pipeline.generated.clear()
+    state = pipeline.run("--no_resume")
+    # 所有题都重新生成，旧的输出和 dead letter 不会残留
+    assert sorted(pipeline.generated) == ["q0", "q1", "q2", "q3"]
+    assert state["stages"]["generate"]["resumed"] == 0
+    answers, evals = _outputs(pipeline.run_dir)
+    assert len(answers) == 4 and len(evals) == 4
+    assert not os.path.exists(dlq)
+    # 花费从 0 算：4 道题的花费不会叠在上一次 3 道题的花费上
+    assert state["cost"]["spent_usd"] < spent * 2
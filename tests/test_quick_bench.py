@@ -0,0 +1,34 @@
+import pytest
+
+from quick_bench import neyman_allocation, rescale_allocation
+
+
+def test_neyman_allocation_is_proportional_to_size_times_sd():
+    sizes = {"a": 1000, "b": 1000}
+    alloc = neyman_allocation(sizes, {"a": 1.0, "b": 3.0}, ci_width=0.2)
+    assert alloc["b"] == pytest.approx(3 * alloc["a"], rel=0.05)
+    assert all(alloc[k] <= sizes[k] for k in sizes)
+
+
+def test_neyman_allocation_takes_small_strata_whole():
+    sizes = {"small": 5, "large": 10000}
+    alloc = neyman_allocation(sizes, {"small": 10.0, "large": 1.0}, ci_width=0.1)
+    assert alloc["small"] == 5
+    assert alloc["large"] <= 10000
+
+
+def test_neyman_allocation_respects_min_per_stratum_and_max_items():
+    sizes = {"a": 100, "b": 100, "c": 100}
+    sds = {"a": 0.0, "b": 1.0, "c": 1.0}
+    alloc = neyman_allocation(sizes, sds, ci_width=0.5, min_per_stratum=3)
+    assert alloc["a"] == 3
+    capped = neyman_allocation(sizes, {"a": 1.0, "b": 1.0, "c": 1.0}, ci_width=0.01, max_items=50)
+    assert sum(capped.values()) == 50
+
+
+def test_rescale_allocation_hits_the_cap_exactly():
+    alloc = rescale_allocation({"a": 10, "b": 10, "c": 10}, 20)
+    assert sum(alloc.values()) == 20
+    assert sorted(alloc.values()) == [6, 7, 7]
+    # 每层至少 1 道
+    assert rescale_allocation({"a": 1000, "b": 1}, 10) == {"a": 9, "b": 1}
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from regression import benjamini_hochberg, paired_bootstrap
+
+
+def test_benjamini_hochberg_known_values():
+    p = np.array([0.01, 0.04, 0.03, 0.20])
+    np.testing.assert_allclose(benjamini_hochberg(p), [0.04, 0.16 / 3, 0.16 / 3, 0.20])
+    assert benjamini_hochberg(np.array([])).size == 0
+
+
+def test_benjamini_hochberg_is_monotone_and_capped():
+    p = np.array([0.9, 0.5, 0.001, 0.95])
+    q = benjamini_hochberg(p)
+    assert (q <= 1.0).all() and (q >= p).all()
+    order = np.argsort(p)
+    assert (np.diff(q[order]) >= 0).all()
+
+
+def test_paired_bootstrap_detects_shift():
+    rng = np.random.default_rng(0)
+    deltas = 0.5 + rng.normal(0.0, 0.2, 200)
+    lo, hi, p = paired_bootstrap(deltas, 2000, np.random.default_rng(1))
+    assert lo < deltas.mean() < hi
+    assert lo > 0
+    assert p < 1e-6
+
+
+def test_paired_bootstrap_no_difference():
+    lo, hi, p = paired_bootstrap(np.zeros(50), 1000, np.random.default_rng(0))
+    assert (lo, hi, p) == (0.0, 0.0, 1.0)
+    rng = np.random.default_rng(2)
+    deltas = rng.normal(0.0, 1.0, 100)
+    lo, hi, p = paired_bootstrap(deltas - deltas.mean(), 1000, np.random.default_rng(3))
+    assert lo < 0 < hi
+    assert p == pytest.approx(1.0)
+
+
+def test_paired_bootstrap_is_deterministic_for_a_seed():
+    deltas = np.random.default_rng(5).normal(0.1, 1.0, 30)
+    first = paired_bootstrap(deltas, 500, np.random.default_rng(7))
+    second = paired_bootstrap(deltas, 500, np.random.default_rng(7))
+    assert first == second
@@ -0,0 +1,82 @@
+import itertools
+import threading
+
+import pytest
+
+from self_consistency import SelfConsistencyJudge, mode_confidence, unanimous_samples_needed
+
+
+def constant_judge(score):
+    calls = []
+
+    def judge(record, metric_name, rubric, temperature):
+        calls.append(temperature)
+        return {"score": score, "justification": "same"}
+
+    judge.calls = calls
+    return judge
+
+
+def cycling_judge(scores):
+    it = itertools.cycle(scores)
+    lock = threading.Lock()
+
+    def judge(record, metric_name, rubric, temperature):
+        with lock:
+            return {"score": next(it), "justification": "mixed"}
+
+    return judge
+
+
+def run(judge, **kwargs):
+    sc = SelfConsistencyJudge(judge, workers=1, **kwargs)
+    try:
+        return sc({"question": "q", "answer": "a"}, "M", "rubric", 0.0)
+    finally:
+        sc.close()
+
+
+def test_unanimous_samples_needed():
+    assert mode_confidence(2, 0) < 0.9 <= mode_confidence(3, 0)
+    assert unanimous_samples_needed(0.9) == 3
+    assert unanimous_samples_needed(0.99) == 6
+
+
+def test_two_agreeing_samples_do_not_stop_below_confidence():
+    # 2-0 只有 0.875 < 0.9，要再来一波
+    out = run(constant_judge(4), first_wave=2, wave_size=3, confidence=0.9)
+    assert out["n_samples"] == 5
+    assert out["self_consistency"]["waves"] == 2
+    assert out["self_consistency"]["confidence"] >= 0.9
+
+
+def test_single_sample_first_wave_does_not_stop():
+    out = run(constant_judge(2), first_wave=1, wave_size=3, confidence=0.9)
+    assert out["n_samples"] == 4
+    assert out["self_consistency"]["converged"]
+
+
+def test_default_first_wave_stops_when_unanimous():
+    judge = constant_judge(5)
+    out = run(judge, confidence=0.9)
+    assert out["n_samples"] == out["n_calls"] == 3
+    assert out["score"] == 5 and out["score_variance"] == 0.0
+    assert out["self_consistency"]["waves"] == 1
+    # 外面传进来的 0.0 不用，重复采样用自己的 temperature
+    assert all(t == 0.7 for t in judge.calls)
+
+
+def test_disagreement_runs_to_max_samples():
+    out = run(cycling_judge([3, 4]), first_wave=3, wave_size=3, max_samples=9, confidence=0.9)
+    assert out["n_samples"] == 9
+    assert not out["self_consistency"]["converged"]
+    assert out["score_variance"] > 0
+    assert out["score"] in (3, 4)
+
+
+def test_all_samples_failing_raises():
+    def broken(record, metric_name, rubric, temperature):
+        raise ValueError("bad json")
+
+    with pytest.raises(RuntimeError):
+        run(broken, max_samples=4)
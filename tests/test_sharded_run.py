@@ -0,0 +1,58 @@
+import json
+import os
+
+import pytest
+
+import sharded_run
+from records import dumps_line
+from sharded_run import WorkQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    q = WorkQueue(str(tmp_path / sharded_run.QUEUE_FILE))
+    q.create(2)
+    return q
+
+
+def test_shard_with_failures_is_requeued_then_marked_failed(queue):
+    shard = queue.claim("w1", max_attempts=2)
+    assert queue.finish(shard, "w1", done=3, failed=1, max_attempts=2) == "pending"
+    other = queue.claim("w1", max_attempts=2)
+    assert other != shard
+    assert queue.finish(other, "w1", done=4, failed=0, max_attempts=2) == "done"
+
+    # 第二次还有失败：不再放回队列
+    assert queue.claim("w2", max_attempts=2) == shard
+    assert queue.finish(shard, "w2", done=3, failed=1, max_attempts=2) == "failed"
+    assert queue.claim("w2", max_attempts=2) is None
+    assert queue.summary() == {"done": 1, "failed": 1}
+    assert queue.failed_items() == 1
+
+    # 调大 max_attempts 可以再领
+    assert queue.claim("w3", max_attempts=3) == shard
+    assert queue.finish(shard, "w3", done=4, failed=0, max_attempts=3) == "done"
+    assert queue.failed_items() == 0
+
+
+def test_merge_refuses_failed_items_unless_partial(tmp_path, queue):
+    run_dir = str(tmp_path)
+    with open(os.path.join(run_dir, sharded_run.CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump({"stage": "generate", "num_shards": 2}, f)
+    os.makedirs(os.path.join(run_dir, sharded_run.SHARD_DIR))
+    for shard, qids in ((0, [0, 2]), (1, [1])):
+        with open(sharded_run.shard_path(run_dir, shard), "w", encoding="utf-8") as f:
+            for qid in qids:
+                f.write(dumps_line({"question_id": qid, "question": f"q{qid}", "answer": "a"}))
+    for _ in range(2):
+        shard = queue.claim("w", max_attempts=1)
+        queue.finish(shard, "w", done=2, failed=shard, max_attempts=1)
+
+    out = str(tmp_path / "merged.jsonl")
+    with pytest.raises(RuntimeError, match="1 failed items"):
+        sharded_run.main(["merge", "--run_dir", run_dir, "--output_jsonl", out])
+    assert not os.path.exists(out)
+
+    sharded_run.main(["merge", "--run_dir", run_dir, "--output_jsonl", out, "--allow_partial"])
+    with open(out, encoding="utf-8") as f:
+        assert [json.loads(line)["question_id"] for line in f] == [0, 1, 2]